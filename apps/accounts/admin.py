@@ -5,6 +5,7 @@ from .models import UserProfile, YouTubeAccount
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'phone', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'user__email', 'phone')
     readonly_fields = ('created_at', 'updated_at')
 
@@ -12,6 +13,7 @@ class UserProfileAdmin(admin.ModelAdmin):
 @admin.register(YouTubeAccount)
 class YouTubeAccountAdmin(admin.ModelAdmin):
     list_display = ('channel_title', 'user', 'channel_id', 'is_active', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('is_active', 'created_at')
     search_fields = ('channel_title', 'user__username', 'channel_id')
     readonly_fields = ('created_at', 'updated_at', 'token_expiry')
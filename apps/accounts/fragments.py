@@ -0,0 +1,28 @@
+"""
+Versions for cached page fragments.
+
+Per-user template fragments are cached with {% cache %} under the user's id
+and fragment version. Saving or deleting anything they show replaces the
+version (see signals.py), so the next render misses and rebuilds them; the
+stale entries are never read again and age out of the cache. A version is a
+timestamp rather than a counter, so one lost from the cache can't come back
+as a value old fragments were stored under.
+"""
+import time
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'fragments:'
+
+
+def cache_key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def get_version(user):
+    """The current fragment version of user (a User or user id)."""
+    return cache.get_or_set(cache_key(getattr(user, 'pk', user)), time.time_ns, None)
+
+
+def bump(user_id):
+    cache.set(cache_key(user_id), time.time_ns(), None)
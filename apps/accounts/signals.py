@@ -1,8 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
-from .models import UserProfile
+from apps.streaming.models import MediaFile
+from . import fragments
+from .models import UserProfile, YouTubeAccount
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -17,3 +19,13 @@ def save_user_profile(sender, instance, **kwargs):
     except ObjectDoesNotExist:
         # Profile does not exist yet, ignore
         pass
+
+
+# Cached dashboard and media list fragments show these; bulk updates of them
+# bump the version explicitly
+@receiver(post_save, sender=YouTubeAccount)
+@receiver(post_delete, sender=YouTubeAccount)
+@receiver(post_save, sender=MediaFile)
+@receiver(post_delete, sender=MediaFile)
+def bump_fragment_version(sender, instance, **kwargs):
+    fragments.bump(instance.user_id)
@@ -4,9 +4,10 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth.forms import AuthenticationForm
 from .forms import UserRegistrationForm, UserUpdateForm, ProfileUpdateForm
-from apps.payments.models import Subscription
+from apps.payments.entitlements import get_entitlement
 from django.core.exceptions import ObjectDoesNotExist
 from apps.accounts.models import UserProfile
+from . import fragments
 
 def register_view(request):
     if request.user.is_authenticated:
@@ -54,13 +55,7 @@ def logout_view(request):
 
 @login_required
 def dashboard_view(request):
-    try:
-        subscription = Subscription.objects.filter(
-            user=request.user, 
-            is_active=True
-        ).order_by('-created_at').first()
-    except:
-        subscription = None
+    subscription = get_entitlement(request.user)
     
     youtube_accounts = request.user.youtube_accounts.filter(is_active=True)
     active_streams = request.user.streams.filter(status__in=['running', 'starting'])
@@ -69,6 +64,7 @@ def dashboard_view(request):
         'subscription': subscription,
         'youtube_accounts': youtube_accounts,
         'active_streams': active_streams,
+        'fragment_version': fragments.get_version(request.user),
     }
     return render(request, 'accounts/dashboard.html', context)
 
@@ -107,13 +103,10 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.conf import settings
 from apps.accounts.models import YouTubeAccount
+from apps.streaming.bulk import stop_streams
 from apps.streaming.models import Stream
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 import logging
-import psutil
 
 logger = logging.getLogger(__name__)
 
@@ -122,81 +115,27 @@ def disconnect_youtube(request, account_id):
     """Disconnect YouTube account and stop all associated streams"""
     yt_account = get_object_or_404(YouTubeAccount, id=account_id, user=request.user)
     
-    # Step 1: Build YouTube client BEFORE clearing tokens
-    youtube = None
-    try:
-        if yt_account.access_token and yt_account.refresh_token:
-            credentials = Credentials(
-                token=yt_account.access_token,
-                refresh_token=yt_account.refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=settings.GOOGLE_CLIENT_ID,
-                client_secret=settings.GOOGLE_CLIENT_SECRET
-            )
-            youtube = build('youtube', 'v3', credentials=credentials)
-    except Exception as e:
-        logger.error(f"Failed to build YouTube client for disconnect: {e}")
-    
-    # Step 2: Find all running streams for this account
-    active_streams = Stream.objects.filter(
-        youtube_account=yt_account,
-        status__in=['running', 'starting']
+    # Step 1: Stop every active stream and end its broadcast BEFORE clearing tokens
+    active_ids = list(
+        Stream.objects.filter(youtube_account=yt_account, status__in=['running', 'starting'])
+        .values_list('id', flat=True)
     )
-    
-    # 🔍 DEBUG LOGGING - PUT HERE
-    logger.info(f"=== DISCONNECT DEBUG ===")
-    logger.info(f"Account: {yt_account.channel_title}")
-    logger.info(f"Found {active_streams.count()} active streams")
-    logger.info(f"YouTube client built: {youtube is not None}")
-    for stream in active_streams:
-        logger.info(f"Stream {stream.id} - Title: {stream.title} - Broadcast ID: {stream.broadcast_id} - Process ID: {stream.process_id}")
-    logger.info(f"========================")
-    
-    # Step 3: Stop each stream on YouTube BEFORE clearing tokens
-    for stream in active_streams:
-        try:
-            # Kill local FFmpeg process
-            if stream.process_id:
-                try:
-                    parent = psutil.Process(stream.process_id)
-                    for child in parent.children(recursive=True):
-                        child.terminate()
-                    parent.terminate()
-                    parent.wait(timeout=5)
-                    logger.info(f"Killed FFmpeg process {stream.process_id}")
-                except Exception as e:
-                    logger.error(f"Failed to kill process {stream.process_id}: {e}")
-                stream.process_id = None
-            
-            # End YouTube broadcast if we have valid credentials
-            if youtube and stream.broadcast_id:
-                try:
-                    youtube.liveBroadcasts().transition(
-                        part='status',
-                        id=stream.broadcast_id,
-                        broadcastStatus='complete'
-                    ).execute()
-                    logger.info(f"✅ Successfully ended YouTube broadcast {stream.broadcast_id}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to end broadcast {stream.broadcast_id}: {e}")
-            else:
-                logger.warning(f"Skipping YouTube transition - youtube={youtube is not None}, broadcast_id={stream.broadcast_id}")
-            
-            # Update stream status
-            stream.status = 'stopped'
-            stream.save()
-            
-        except Exception as e:
-            logger.error(f"Error stopping stream {stream.id}: {e}")
-    
-    # Step 4: NOW clear the YouTube account tokens
+    result = stop_streams(active_ids, reason='Stream stopped: YouTube account disconnected')
+    logger.info(f"Disconnect of {yt_account.channel_title}: {result}")
+
+    # Step 2: NOW clear the YouTube account tokens
     yt_account.is_active = False
     yt_account.access_token = ""
     yt_account.refresh_token = ""
     yt_account.save()
     
+    if result['errors']:
+        messages.warning(
+            request,
+            f"{len(result['errors'])} YouTube broadcast(s) could not be ended and may need ending in YouTube Studio."
+        )
     messages.success(
         request, 
-        f"Disconnected {yt_account.channel_title}. {active_streams.count()} stream(s) stopped."
+        f"Disconnected {yt_account.channel_title}. {result['stopped']} stream(s) stopped."
     )
     return redirect('dashboard')
@@ -12,6 +12,7 @@ class PaymentInline(admin.TabularInline):
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'plan_type', 'status', 'max_streams', 'start_date', 'end_date', 'is_active')
+    list_select_related = ('user',)
     list_filter = ('plan_type', 'status', 'is_active', 'start_date')
     search_fields = ('user__username', 'razorpay_order_id', 'razorpay_payment_id')
     readonly_fields = ('created_at', 'updated_at', 'start_date')
@@ -36,6 +37,7 @@ class SubscriptionAdmin(admin.ModelAdmin):
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('subscription', 'razorpay_payment_id', 'amount', 'status', 'method', 'created_at')
+    list_select_related = ('subscription__user',)
     list_filter = ('status', 'method', 'created_at')
     search_fields = ('razorpay_payment_id', 'subscription__user__username')
     readonly_fields = ('created_at',)
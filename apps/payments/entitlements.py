@@ -0,0 +1,106 @@
+"""
+Per-user entitlements.
+
+What a user's subscription allows (plan, stream and storage limits, end date)
+and how much storage is in use is read on almost every page. It is built with
+one query and kept in the cache until the subscription ends, a payment or
+cancellation changes it, or the user's media changes (see signals.py), so
+warm checks cost no queries at all. How many streams are live is tracked by
+the slots in apps/streaming/slots.py instead.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Subscription
+
+KEY_PREFIX = 'entitlement:'
+
+_MISSING = object()
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    subscription_id: int
+    plan_type: str
+    max_streams: int
+    storage_limit: int
+    end_date: datetime
+    storage_used: int
+
+    # Lets templates written for a Subscription render an Entitlement
+    is_active = True
+
+    @property
+    def storage_available(self):
+        return max(self.storage_limit - self.storage_used, 0)
+
+    @property
+    def storage_percentage(self):
+        return (self.storage_used / self.storage_limit) * 100 if self.storage_limit else 100
+
+    def has_storage_for(self, file_size):
+        return file_size <= self.storage_limit - self.storage_used
+
+    def get_plan_type_display(self):
+        return dict(Subscription.PLAN_CHOICES).get(self.plan_type, self.plan_type)
+
+    def get_storage_limit_display(self):
+        """Display storage limit in GB"""
+        return round(self.storage_limit / (1024 ** 3), 2)
+
+
+def cache_key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def _load(user_id, now):
+    from apps.streaming.models import MediaFile
+
+    storage_used = (
+        MediaFile.objects.filter(user_id=OuterRef('user_id'))
+        .values('user_id').annotate(total=Sum('file_size')).values('total')
+    )
+    row = (
+        Subscription.objects.filter(user_id=user_id, is_active=True, status='active', end_date__gt=now)
+        .order_by('-end_date')
+        .annotate(
+            storage_used=Coalesce(Subquery(storage_used, output_field=IntegerField()), 0),
+        )
+        .values('id', 'plan_type', 'max_streams', 'storage_limit', 'end_date', 'storage_used')
+        .first()
+    )
+    if row is None:
+        return None
+    return Entitlement(subscription_id=row.pop('id'), **row)
+
+
+def get_entitlement(user):
+    """The user's current Entitlement, or None without an active subscription."""
+    user_id = getattr(user, 'pk', user)
+    key = cache_key(user_id)
+    entitlement = cache.get(key, _MISSING)
+    if entitlement is not _MISSING:
+        return entitlement
+
+    now = timezone.now()
+    entitlement = _load(user_id, now)
+    timeout = settings.ENTITLEMENT_CACHE_TTL
+    if entitlement is not None:
+        # Gone from the cache the moment the subscription ends
+        timeout = min(timeout, (entitlement.end_date - now).total_seconds())
+    cache.set(key, entitlement, timeout)
+    return entitlement
+
+
+def invalidate(user_id):
+    cache.delete(cache_key(user_id))
+
+
+def invalidate_many(user_ids):
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
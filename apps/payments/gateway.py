@@ -0,0 +1,28 @@
+"""
+Razorpay client.
+
+The razorpay package is imported and its client built on the first payment
+call rather than when the views load, so processes that never take a payment
+(Celery workers, most web requests) don't pay for it.
+"""
+from functools import cache
+
+from django.conf import settings
+
+
+@cache
+def client():
+    import razorpay
+
+    return razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
+
+
+def signature_valid(params):
+    """Whether a checkout callback's order id, payment id and signature match."""
+    from razorpay.errors import SignatureVerificationError
+
+    try:
+        client().utility.verify_payment_signature(params)
+    except SignatureVerificationError:
+        return False
+    return True
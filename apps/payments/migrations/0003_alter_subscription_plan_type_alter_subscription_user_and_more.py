@@ -0,0 +1,53 @@
+# Generated by Django 5.0.14 on 2026-10-19 18:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0002_subscription_storage_limit"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="subscription",
+            name="plan_type",
+            field=models.CharField(
+                choices=[
+                    ("monthly", "Monthly Plan"),
+                    ("annual", "Annual Plan"),
+                    ("oneday", "OneDay Plan"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="subscription",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="subscriptions",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                fields=["user", "is_active", "status"],
+                name="sub_user_active_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscription",
+            index=models.Index(
+                condition=models.Q(("is_active", True), ("status", "active")),
+                fields=["end_date"],
+                name="sub_active_end_date_idx",
+            ),
+        ),
+    ]
@@ -16,7 +16,8 @@ class Subscription(models.Model):
         ('cancelled', 'Cancelled'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
+    # Indexed by the (user, is_active, status) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', db_index=False)
     plan_type = models.CharField(max_length=20, choices=PLAN_CHOICES)
     razorpay_order_id = models.CharField(max_length=255, unique=True)
     razorpay_payment_id = models.CharField(max_length=255, blank=True)
@@ -64,6 +65,16 @@ class Subscription(models.Model):
         verbose_name = 'Subscription'
         verbose_name_plural = 'Subscriptions'
         ordering = ['-created_at']
+        indexes = [
+            # Active subscription lookup done on nearly every page
+            models.Index(fields=['user', 'is_active', 'status'], name='sub_user_active_status_idx'),
+            # Daily expiry sweep over subscriptions that are still active
+            models.Index(
+                fields=['end_date'],
+                name='sub_active_end_date_idx',
+                condition=models.Q(is_active=True, status='active'),
+            ),
+        ]
 
 class Payment(models.Model):
     subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE, related_name='payments')
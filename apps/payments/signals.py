@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.streaming.models import MediaFile
+
+from .entitlements import invalidate
+from .models import Subscription
+
+
+# Saves and deletes of anything an Entitlement is built from drop the cached
+# copy; bulk updates of subscriptions invalidate explicitly
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=MediaFile)
+@receiver(post_delete, sender=MediaFile)
+def invalidate_entitlement(sender, instance, **kwargs):
+    invalidate(instance.user_id)
@@ -1,69 +1,107 @@
 from celery import shared_task
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.db import connection
 from django.utils import timezone
 from datetime import timedelta
 import logging
 
+from .entitlements import invalidate_many
 from .models import Subscription
-from apps.streaming.models import Stream
 
 logger = logging.getLogger(__name__)
 
 
+# Expiry warnings are sent this long before a subscription ends, once
+EXPIRY_WARNING_DAYS = 3
+NOTIFY_BATCH_SIZE = 500
+
+
+def expire_subscriptions(now):
+    """
+    Mark every active subscription that ended before now as expired in one
+    statement and return the IDs of the users they belonged to.
+    """
+    table = connection.ops.quote_name(Subscription._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET status = %s, is_active = %s, updated_at = %s "
+            f"WHERE is_active = %s AND status = %s AND end_date < %s "
+            f"RETURNING user_id",
+            ['expired', False, now, True, 'active', now],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
 @shared_task
 def check_subscription_expiry():
     """
     Check for expired subscriptions and deactivate them
     Runs daily at midnight via Celery Beat
     """
-    # Find subscriptions that have expired
-    expired_subscriptions = Subscription.objects.filter(
-        is_active=True,
-        end_date__lt=timezone.now(),
-        status='active'
+    from apps.streaming.tasks import stop_user_streams
+
+    now = timezone.now()
+
+    user_ids = expire_subscriptions(now)
+    invalidate_many(user_ids)
+    # Users who already renewed keep streaming
+    user_ids -= set(
+        Subscription.objects.filter(user_id__in=user_ids, is_active=True, status='active')
+        .values_list('user_id', flat=True)
     )
-    
-    for subscription in expired_subscriptions:
-        # Update subscription status
-        subscription.status = 'expired'
-        subscription.is_active = False
-        subscription.save()
-        
-        # Stop all running streams for this user
-        running_streams = Stream.objects.filter(
-            user=subscription.user,
-            status__in=['running', 'starting']
+    if user_ids:
+        stop_user_streams.delay(
+            sorted(user_ids), reason='Stream stopped due to subscription expiry', level='WARNING'
         )
-        
-        for stream in running_streams:
-            from apps.streaming.stream_manager import StreamManager
-            manager = StreamManager(stream)
-            manager.stop_stream()
-            
-            from apps.streaming.models import StreamLog
-            StreamLog.objects.create(
-                stream=stream,
-                level='WARNING',
-                message='Stream stopped due to subscription expiry'
-            )
-        
-        logger.info(f"Deactivated expired subscription for user {subscription.user.username}")
-    
-    # Send warning for subscriptions expiring in 3 days
-    warning_date = timezone.now() + timedelta(days=3)
-    expiring_soon = Subscription.objects.filter(
-        is_active=True,
-        end_date__lte=warning_date,
-        end_date__gte=timezone.now(),
-        status='active'
+
+    # Warn about subscriptions ending a few days from now; the one-day
+    # window means each subscription is warned once by this daily job
+    warning_end = now + timedelta(days=EXPIRY_WARNING_DAYS)
+    expiring_ids = list(
+        Subscription.objects.filter(
+            is_active=True,
+            status='active',
+            end_date__gte=warning_end - timedelta(days=1),
+            end_date__lt=warning_end,
+        ).values_list('id', flat=True)
+    )
+    for i in range(0, len(expiring_ids), NOTIFY_BATCH_SIZE):
+        notify_expiring_subscriptions.delay(expiring_ids[i:i + NOTIFY_BATCH_SIZE])
+
+    logger.info(
+        f"Deactivated subscriptions of {len(user_ids)} users, "
+        f"{len(expiring_ids)} subscriptions expiring soon"
+    )
+    return f"Deactivated subscriptions of {len(user_ids)} users"
+
+
+@shared_task
+def notify_expiring_subscriptions(subscription_ids):
+    """
+    Email the owners of a batch of subscriptions that are about to expire,
+    over a single mail connection
+    """
+    subscriptions = Subscription.objects.filter(id__in=subscription_ids).exclude(user__email='').values_list(
+        'user__username', 'user__email', 'end_date'
     )
-    
-    for subscription in expiring_soon:
-        # Here you can send email notifications
-        logger.warning(f"Subscription for user {subscription.user.username} expiring soon")
-        # TODO: Send email notification
-    
-    logger.info(f"Processed {expired_subscriptions.count()} expired subscriptions")
-    return f"Deactivated {expired_subscriptions.count()} expired subscriptions"
+    messages = [
+        (
+            'Your subscription is expiring soon',
+            f"Hi {username},\n\nYour subscription ends on {end_date:%d %b %Y}. "
+            f"Renew it to keep your streams running.",
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        )
+        for username, email, end_date in subscriptions
+    ]
+    try:
+        sent = send_mass_mail(messages)
+    except Exception as e:
+        logger.error(f"Failed to send {len(messages)} expiry warnings: {str(e)}")
+        return f"Failed to send expiry warnings: {str(e)}"
+    logger.info(f"Sent {sent} subscription expiry warnings")
+    return f"Sent {sent} expiry warnings"
 
 
 @shared_task
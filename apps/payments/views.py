@@ -4,22 +4,17 @@ from django.contrib import messages
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponseBadRequest, JsonResponse
 from django.conf import settings
-import razorpay
+from . import gateway
+from .entitlements import get_entitlement, invalidate
 from .models import Subscription, Payment
 
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
 @login_required
 def subscribe_view(request):
     """Show subscription plans"""
     plans = settings.SUBSCRIPTION_PLANS
 
     # Check if user has active subscription
-    active_subscription = Subscription.objects.filter(
-        user=request.user,
-        is_active=True,
-        status='active'
-    ).first()
+    active_subscription = get_entitlement(request.user)
 
     context = {
         'plans': plans,
@@ -45,11 +40,7 @@ def create_order(request, plan_type):
         amount = plan['price']  # Price in paise
 
         # Get the user's active subscription, if any
-        active_subscription = Subscription.objects.filter(
-            user=request.user,
-            is_active=True,
-            status='active'
-        ).first()
+        active_subscription = get_entitlement(request.user)
 
         # Optional: define plan ranking hierarchy (higher ⇒ better)
         plan_priority = {
@@ -69,11 +60,11 @@ def create_order(request, plan_type):
                 return redirect('subscribe')
 
         # Create new Razorpay order for valid upgrade
-        razorpay_order = razorpay_client.order.create({
+        razorpay_order = gateway.client().order.create({
             'amount': amount,
             'currency': 'INR',
             'payment_capture': '1'
-        })
+        }, timeout=settings.EXTERNAL_API_TIMEOUT)
 
         # NEW: Calculate storage limit based on plan
         if plan_type == 'monthly':
@@ -126,7 +117,9 @@ def payment_callback(request):
             }
 
             # Verify payment signature
-            razorpay_client.utility.verify_payment_signature(params_dict)
+            if not gateway.signature_valid(params_dict):
+                messages.error(request, 'Payment verification failed')
+                return redirect('payment_failed')
 
             # Get subscription
             subscription = Subscription.objects.get(razorpay_order_id=razorpay_order_id)
@@ -142,9 +135,10 @@ def payment_callback(request):
             Subscription.objects.filter(
                 user=subscription.user
             ).exclude(id=subscription.id).update(is_active=False)
+            invalidate(subscription.user_id)
 
             # Create payment record
-            payment_details = razorpay_client.payment.fetch(payment_id)
+            payment_details = gateway.client().payment.fetch(payment_id, timeout=settings.EXTERNAL_API_TIMEOUT)
             Payment.objects.create(
                 subscription=subscription,
                 razorpay_payment_id=payment_id,
@@ -156,9 +150,6 @@ def payment_callback(request):
             messages.success(request, 'Subscription activated successfully!')
             return redirect('payment_success')
 
-        except razorpay.errors.SignatureVerificationError:
-            messages.error(request, 'Payment verification failed')
-            return redirect('payment_failed')
         except Exception as e:
             messages.error(request, f'Payment processing failed: {str(e)}')
             return redirect('payment_failed')
@@ -182,6 +173,7 @@ def cancel_subscription(request, subscription_id):
     subscription.status = 'cancelled'
     subscription.is_active = False
     subscription.save()
+    invalidate(request.user.id)
 
     messages.success(request, 'Subscription cancelled successfully')
     return redirect('dashboard')
@@ -1,10 +1,27 @@
-from django.contrib import admin
-from .models import MediaFile, Stream, StreamLog
+import json
+import uuid
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.html import format_html
+from django.utils.http import urlencode
+
+from . import heartbeat, slots, state
+from .bulk import stop_streams
+from .log_archive import iter_archived_logs
+from .models import EncoderProcess, MediaFile, Stream, StreamLog, StreamLogArchive
+from .tasks import bulk_start_streams
 
 
 @admin.register(MediaFile)
 class MediaFileAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'media_type', 'file_size', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('media_type', 'created_at')
     search_fields = ('title', 'user__username')
     readonly_fields = ('created_at',)
@@ -20,11 +37,14 @@ class StreamLogInline(admin.TabularInline):
 @admin.register(Stream)
 class StreamAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'youtube_account', 'status', 'loop_enabled', 'started_at', 'created_at')
+    list_select_related = ('user', 'youtube_account__user')
     list_filter = ('status', 'loop_enabled', 'created_at')
     search_fields = ('title', 'user__username', 'youtube_account__channel_title')
-    readonly_fields = ('id', 'created_at', 'updated_at', 'started_at', 'stopped_at')
+    # Status only changes through the actions below, which go through state.py
+    readonly_fields = ('id', 'status', 'version', 'created_at', 'updated_at', 'started_at', 'stopped_at')
     filter_horizontal = ('media_files',)
     inlines = [StreamLogInline]
+    actions = ['stop_selected', 'start_selected', 'fail_selected']
     
     fieldsets = (
         ('Basic Information', {
@@ -34,7 +54,7 @@ class StreamAdmin(admin.ModelAdmin):
             'fields': ('media_files', 'loop_enabled')
         }),
         ('Stream Details', {
-            'fields': ('status', 'stream_key', 'broadcast_id', 'stream_url', 'process_id')
+            'fields': ('status', 'version', 'stream_key', 'broadcast_id', 'stream_url')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at', 'started_at', 'stopped_at')
@@ -45,10 +65,148 @@ class StreamAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # Write only what the form changed, so a start or stop that moved the
+        # stream while the page was open isn't overwritten
+        fields = [name for name in form.changed_data if name in {f.name for f in obj._meta.concrete_fields}]
+        if fields:
+            obj.save(update_fields=fields + ['updated_at'])
+
+    @admin.action(description='Stop selected streams')
+    def stop_selected(self, request, queryset):
+        result = stop_streams(
+            list(queryset.values_list('id', flat=True)),
+            reason=f'Stream stopped by admin {request.user.username}',
+        )
+        self.message_user(
+            request,
+            f"Stopped {result['stopped']} stream(s) in {result['elapsed']}s, "
+            f"{result['broadcasts_ended']} broadcast(s) ended.",
+        )
+        if result['errors']:
+            self.message_user(
+                request,
+                f"{len(result['errors'])} broadcast(s) could not be ended: " + '; '.join(result['errors'].values()),
+                messages.WARNING,
+            )
+
+    @admin.action(description='Start selected streams')
+    def start_selected(self, request, queryset):
+        # Creating broadcasts takes a few seconds each, so it runs in the worker
+        stream_ids = [str(stream_id) for stream_id in queryset.values_list('id', flat=True)]
+        bulk_start_streams.delay(stream_ids)
+        self.message_user(request, f"Starting {len(stream_ids)} stream(s) in the background.")
+
+    @admin.action(description='Mark selected streams as failed')
+    def fail_selected(self, request, queryset):
+        # For streams stuck starting or stopping with no encoder left; a
+        # stream whose encoder is still beating has to be stopped instead
+        failed = skipped = 0
+        message = f'Marked failed by admin {request.user.username}'
+        for stream in queryset:
+            try:
+                with state.stream_lock(stream.id):
+                    stream.refresh_from_db(fields=['status', 'version', 'error_message', 'updated_at'])
+                    if heartbeat.get_heartbeat(stream.id) or not state.fail(stream, message):
+                        skipped += 1
+                        continue
+            except state.StreamBusy:
+                skipped += 1
+                continue
+            StreamLog.objects.create(stream=stream, level='ERROR', message=message)
+            slots.release([stream.id])
+            failed += 1
+        self.message_user(request, f"Marked {failed} stream(s) as failed.")
+        if skipped:
+            self.message_user(
+                request,
+                f"{skipped} stream(s) were busy, still encoding or could not move to error; stop them instead.",
+                messages.WARNING,
+            )
+
+
+@admin.register(EncoderProcess)
+class EncoderProcessAdmin(admin.ModelAdmin):
+    list_display = ('stream', 'node', 'pid', 'created_at')
+    list_select_related = ('stream__user',)
+    list_filter = ('node',)
+    search_fields = ('stream__title', 'stream__id', 'node')
+    readonly_fields = ('stream', 'node', 'pid', 'create_time', 'fingerprint', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
 
 @admin.register(StreamLog)
 class StreamLogAdmin(admin.ModelAdmin):
     list_display = ('stream', 'level', 'message', 'created_at')
+    list_select_related = ('stream__user',)
     list_filter = ('level', 'created_at')
     search_fields = ('stream__title', 'message')
     readonly_fields = ('stream', 'level', 'message', 'created_at')
+
+
+def _parse_bound(value, end=False):
+    """ISO datetime or date from a query string; a bare date covers the whole day."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+@admin.register(StreamLogArchive)
+class StreamLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('stream', 'first_at', 'last_at', 'row_count', 'levels', 'size', 'fetch_link')
+    list_select_related = ('stream__user',)
+    list_filter = ('first_at',)
+    search_fields = ('stream__title', 'stream__id')
+    readonly_fields = ('stream', 'file', 'first_at', 'last_at', 'last_log_id', 'row_count', 'levels', 'size', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description='Logs')
+    def fetch_link(self, obj):
+        query = urlencode({'stream': obj.stream_id, 'start': obj.first_at.isoformat(), 'end': obj.last_at.isoformat()})
+        return format_html('<a href="{}?{}">Fetch</a>', reverse('admin:streaming_streamlogarchive_fetch'), query)
+
+    def get_urls(self):
+        return [
+            path('fetch/', self.admin_site.admin_view(self.fetch_view), name='streaming_streamlogarchive_fetch'),
+        ] + super().get_urls()
+
+    def fetch_view(self, request):
+        """
+        Stream archived logs for one stream as JSONL, e.g.
+        ?stream=<uuid>&start=2024-01-01&end=2024-01-31&level=ERROR
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            stream_id = uuid.UUID(request.GET.get('stream', ''))
+        except ValueError:
+            return HttpResponseBadRequest('stream must be a stream id')
+        try:
+            start = _parse_bound(request.GET.get('start'))
+            end = _parse_bound(request.GET.get('end'), end=True)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        levels = request.GET.getlist('level') or None
+
+        def lines():
+            for record in iter_archived_logs(stream_id, start=start, end=end, levels=levels):
+                record['created_at'] = record['created_at'].isoformat()
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="stream-{stream_id}-logs.jsonl"'
+        return response
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+class StreamingConfig(AppConfig):
+    name = 'apps.streaming'
+
+    def ready(self):
+        import apps.streaming.signals
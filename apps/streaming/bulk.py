@@ -0,0 +1,218 @@
+"""
+Bulk stream operations.
+
+Stopping or starting many streams one at a time costs a few seconds of
+encoder shutdown and YouTube API latency per stream. These functions take a
+set of stream IDs, stop their encoders together and run the YouTube calls on
+a thread pool capped at STREAM_BULK_CONCURRENCY, with the database reads and
+writes batched around them. Each returns an aggregate result dict.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from apps.payments.entitlements import get_entitlement
+
+from . import heartbeat, metrics, process_registry, slots, state
+from .models import EncoderProcess, Stream, StreamLog
+from .stream_manager import StreamManager
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ['running', 'starting']
+
+
+def _run_concurrently(fn, items, concurrency=None):
+    """fn(item) for every item on a capped thread pool; returns {item: (result, error)}."""
+    concurrency = concurrency or settings.STREAM_BULK_CONCURRENCY
+    if not items:
+        return {}
+
+    def call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, str(e)
+        finally:
+            # Worker threads get their own database connections
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as pool:
+        return dict(zip(items, pool.map(call, items)))
+
+
+def _end_broadcast(stream):
+    manager = StreamManager(stream)
+    if not manager.authenticate_youtube():
+        raise Exception("YouTube authentication failed")
+    manager.youtube.liveBroadcasts().transition(
+        broadcastStatus='complete',
+        id=stream.broadcast_id,
+        part='status'
+    ).execute()
+
+
+def _stop_encoders(stream_ids):
+    """Stop the registered encoders of stream_ids together; returns {stream_id: timings}."""
+    records = list(EncoderProcess.objects.filter(stream_id__in=stream_ids))
+    local = {}
+    remote = []
+    for record in records:
+        if record.node != settings.NODE_ID:
+            remote.append(record)
+            continue
+        proc = process_registry.get_process(record)
+        if proc is not None:
+            local[proc.pid] = (record.stream_id, proc)
+
+    # Every encoder flushes in its own process, so they are signalled at once
+    # and waited on together rather than capped; remote ones are asked first
+    # so they flush meanwhile
+    for record in remote:
+        heartbeat.request_stop(record.stream_id)
+    timings = {}
+    for pid, stop in process_registry.stop_processes([proc for _, proc in local.values()]).items():
+        timings[local[pid][0]] = stop
+    if remote:
+        timings.update(process_registry.stop_remote(remote, requested=True))
+    EncoderProcess.objects.filter(
+        id__in=[record.id for record in records if record.node == settings.NODE_ID]
+    ).delete()
+    return timings
+
+
+def stop_streams(stream_ids, reason='Stream stopped', level='INFO'):
+    """
+    Stop every active stream in stream_ids: encoders first, then their
+    YouTube broadcasts, then one status update and one log insert.
+
+    Returns {'stopped', 'still_stopping', 'encoders_killed', 'broadcasts_ended',
+    'errors': {stream id: message}, 'elapsed'}; still_stopping counts streams
+    whose encoder on another node hadn't exited in time.
+    """
+    started = time.monotonic()
+    streams = list(
+        Stream.objects.filter(id__in=stream_ids, status__in=ACTIVE_STATUSES).select_related('youtube_account')
+    )
+    ids = [stream.id for stream in streams]
+    if not ids:
+        return {
+            'stopped': 0, 'still_stopping': 0, 'encoders_killed': 0, 'broadcasts_ended': 0, 'errors': {}, 'elapsed': 0,
+        }
+    # So supervisors report the encoder exits as stops, not crashes. Not
+    # locked: the version bump makes any start still in flight back off and
+    # stop the encoder it launched
+    state.transition_many(ids, 'stopping')
+    metrics.forget_restarts(ids)
+
+    encoders = _stop_encoders(ids)
+
+    with_broadcast = [stream for stream in streams if stream.broadcast_id]
+    outcomes = _run_concurrently(_end_broadcast, with_broadcast)
+    errors = {stream.id: error for stream, (_, error) in outcomes.items() if error}
+    for stream_id, error in errors.items():
+        logger.error(f"Failed to end broadcast for stream {stream_id}: {error}")
+
+    # Encoders on other nodes that haven't exited yet keep their streams
+    # stopping and their slots until their supervisors record the exit
+    done = [stream_id for stream_id in ids if encoders.get(stream_id, {}).get('stopped', True)]
+    now = timezone.now()
+    state.transition_many(done, 'stopped', from_statuses=['stopping'], stopped_at=now)
+    slots.release(done)
+    StreamLog.objects.bulk_create([
+        StreamLog(
+            stream=stream,
+            level='WARNING' if stream.id in errors else level,
+            message=f"{reason} (broadcast not ended: {errors[stream.id]})" if stream.id in errors else reason,
+        )
+        for stream in streams
+    ])
+
+    result = {
+        'stopped': len(done),
+        'still_stopping': len(ids) - len(done),
+        'encoders_killed': sum(1 for stop in encoders.values() if stop.get('killed')),
+        'broadcasts_ended': len(with_broadcast) - len(errors),
+        'errors': {str(stream_id): error for stream_id, error in errors.items()},
+        'elapsed': round(time.monotonic() - started, 3),
+    }
+    logger.info(
+        f"Bulk stopped {result['stopped']} streams in {result['elapsed']}s: "
+        f"{result['broadcasts_ended']} broadcasts ended, {len(errors)} errors"
+    )
+    return result
+
+
+def _start(stream):
+    manager = StreamManager(stream)
+    if not manager.create_broadcast():
+        raise Exception(stream.error_message or "Failed to create YouTube broadcast")
+    if not manager.start_ffmpeg_stream():
+        raise Exception(stream.error_message or "Failed to start streaming process")
+
+
+def start_streams(stream_ids):
+    """
+    Start every idle, stopped or failed stream in stream_ids, creating the
+    YouTube broadcasts and launching the encoders concurrently. Each stream
+    first reserves one of its owner's slots; streams over the limit fail.
+
+    Returns {'started', 'errors': {stream id: message}, 'elapsed'}.
+    """
+    started = time.monotonic()
+    candidates = list(
+        Stream.objects.filter(id__in=stream_ids)
+        .exclude(status__in=slots.LIVE_STATUSES)
+        .select_related('youtube_account')
+    )
+    streams = []
+    errors = {}
+    locks = {}
+    for stream in candidates:
+        entitlement = get_entitlement(stream.user_id)
+        try:
+            if not entitlement:
+                raise slots.SlotUnavailable('No active subscription')
+            locks[stream.id] = state.acquire_lock(stream.id)
+        except (slots.SlotUnavailable, state.StreamBusy) as e:
+            errors[stream.id] = str(e)
+            continue
+        try:
+            slots.reserve(stream, entitlement.max_streams)
+        except (slots.SlotUnavailable, state.StreamBusy, state.InvalidTransition) as e:
+            errors[stream.id] = str(e)
+            state.release_lock(stream.id, locks.pop(stream.id))
+            continue
+        streams.append(stream)
+
+    try:
+        # A large batch takes far longer than one start; the locks last until it ends
+        with state.keep_locks(locks):
+            outcomes = _run_concurrently(_start, streams)
+    finally:
+        for stream_id, token in locks.items():
+            state.release_lock(stream_id, token)
+    failed = [stream.id for stream, (_, error) in outcomes.items() if error]
+    errors.update((stream.id, error) for stream, (_, error) in outcomes.items() if error)
+    # StreamManager already marks most failures; this catches the rest
+    state.transition_many(failed, 'error', from_statuses=['starting'])
+    slots.release(failed)
+
+    StreamLog.objects.bulk_create([
+        StreamLog(stream=stream, level='ERROR', message=f'Failed to start stream: {errors[stream.id]}')
+        if stream.id in errors else
+        StreamLog(stream=stream, level='INFO', message='Stream started successfully')
+        for stream in candidates
+    ])
+
+    result = {
+        'started': len(streams) - len(failed),
+        'errors': {str(stream_id): error for stream_id, error in errors.items()},
+        'elapsed': round(time.monotonic() - started, 3),
+    }
+    logger.info(f"Bulk started {result['started']} streams in {result['elapsed']}s, {len(errors)} errors")
+    return result
@@ -0,0 +1,136 @@
+"""
+Stream liveness via Redis heartbeats.
+
+The encoder supervisor (see supervisor.py) refreshes a per-stream key with a
+short TTL every few seconds for as long as ffmpeg is alive. A stream whose
+key is missing has no live encoder anywhere, whichever host or container
+started it, and a reused PID can't fake one.
+"""
+import json
+import time
+
+import redis
+
+HEARTBEAT_INTERVAL = 5  # seconds between beats
+HEARTBEAT_TTL = 15  # a stream is dead after this long without a beat
+KEY_PREFIX = 'stream:heartbeat:'
+STOP_KEY_PREFIX = 'stream:stop:'
+
+# Seconds between polls while waiting for encoders to stop
+STOP_POLL_INTERVAL = 0.25
+
+# Deletes the heartbeat and stop request only if the beat is absent or is
+# the given supervisor's: a new encoder for the stream may be beating by now
+_CLEAR_SCRIPT = """
+local value = redis.call('get', KEYS[1])
+if value then
+    local last = cjson.decode(value)
+    if last['node'] ~= ARGV[1] or last['pid'] ~= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+return redis.call('del', KEYS[1], KEYS[2])
+"""
+
+_client = None
+
+
+def heartbeat_key(stream_id):
+    return f"{KEY_PREFIX}{stream_id}"
+
+
+def stop_key(stream_id):
+    return f"{STOP_KEY_PREFIX}{stream_id}"
+
+
+def get_redis():
+    """Shared client for the Django side, built from settings.REDIS_URL."""
+    global _client
+    if _client is None:
+        from django.conf import settings
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+    return _client
+
+
+def beat(stream_id, pid, progress=None):
+    """
+    Record that the encoder for stream_id is alive for the next HEARTBEAT_TTL
+    seconds, with its latest progress (speed, bitrate_kbps) if known. Returns
+    True if a stop has been requested for the stream.
+    """
+    from django.conf import settings
+    value = json.dumps({'node': settings.NODE_ID, 'pid': pid, 'at': time.time(), **(progress or {})})
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.set(heartbeat_key(stream_id), value, ex=HEARTBEAT_TTL)
+    pipe.exists(stop_key(stream_id))
+    return bool(pipe.execute()[1])
+
+
+def clear(stream_id, pid=None):
+    """
+    Forget the stream's heartbeat and stop request. With pid, only if the
+    last beat came from that supervisor on this node (or has expired).
+    """
+    if pid is None:
+        get_redis().delete(heartbeat_key(stream_id), stop_key(stream_id))
+        return
+    from django.conf import settings
+    get_redis().eval(_CLEAR_SCRIPT, 2, heartbeat_key(stream_id), stop_key(stream_id), settings.NODE_ID, pid)
+
+
+def request_stop(stream_id):
+    """
+    Ask the stream's supervisor to stop its encoder at the next beat. Used
+    for encoders on another node, which can't be signalled from here.
+    """
+    get_redis().set(stop_key(stream_id), 1, ex=HEARTBEAT_TTL * 4)
+
+
+def cancel_stop(stream_id):
+    """Drop a pending stop request, so an encoder started now doesn't act on one meant for its predecessor."""
+    get_redis().delete(stop_key(stream_id))
+
+
+def wait_stopped(encoders, timeout):
+    """
+    Wait until none of encoders ({stream_id: (node, pid)}) is beating any
+    more, or timeout seconds pass. A stream beating from another supervisor
+    counts as stopped. Returns the stream ids still beating.
+    """
+    deadline = time.monotonic() + timeout
+    waiting = dict(encoders)
+    while waiting:
+        stream_ids = list(waiting)
+        values = get_redis().mget([heartbeat_key(stream_id) for stream_id in stream_ids])
+        for stream_id, value in zip(stream_ids, values):
+            last = json.loads(value) if value else None
+            if last is None or (last.get('node'), last.get('pid')) != waiting[stream_id]:
+                del waiting[stream_id]
+        if not waiting or time.monotonic() >= deadline:
+            break
+        time.sleep(min(STOP_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+    return set(waiting)
+
+
+def get_heartbeat(stream_id):
+    """The last beat as a dict (node, pid, at), or None if the stream isn't alive."""
+    value = get_redis().get(heartbeat_key(stream_id))
+    return json.loads(value) if value else None
+
+
+def get_heartbeats(stream_ids):
+    """The last beat of each stream in stream_ids that is alive, in one round trip."""
+    stream_ids = list(stream_ids)
+    if not stream_ids:
+        return {}
+    values = get_redis().mget([heartbeat_key(stream_id) for stream_id in stream_ids])
+    return {stream_id: json.loads(value) for stream_id, value in zip(stream_ids, values) if value is not None}
+
+
+def live_stream_ids(stream_ids):
+    """Subset of stream_ids with an unexpired heartbeat, in one round trip."""
+    stream_ids = list(stream_ids)
+    if not stream_ids:
+        return set()
+    values = get_redis().mget([heartbeat_key(stream_id) for stream_id in stream_ids])
+    return {stream_id for stream_id, value in zip(stream_ids, values) if value is not None}
@@ -0,0 +1,161 @@
+"""
+Cold archive for StreamLog.
+
+Before retention removes old rows from the live table, they are exported per
+stream into gzip-compressed JSONL segments in media storage. Each segment is
+written once and never modified; a StreamLogArchive row records its time
+range, row count and the levels it contains so the admin can find the right
+segments without opening them.
+"""
+import gzip
+import io
+import json
+import logging
+from collections import defaultdict
+
+from django.core.files.base import ContentFile
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+
+from .models import StreamLog, StreamLogArchive
+
+logger = logging.getLogger(__name__)
+
+# Rows per segment file, per query while exporting, and buffered in memory
+# across all streams before the partial segments are flushed
+SEGMENT_MAX_ROWS = 50000
+EXPORT_CHUNK_SIZE = 5000
+BUFFER_MAX_ROWS = 200000
+
+
+def _build_segment(stream_id, rows):
+    """Compress rows to a JSONL segment and store it. Returns the unsaved index row."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        for row in rows:
+            record = {
+                'id': row['id'],
+                'created_at': row['created_at'].isoformat(),
+                'level': row['level'],
+                'message': row['message'],
+            }
+            gz.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+    data = buffer.getvalue()
+
+    first_at = min(row['created_at'] for row in rows)
+    last_id = max(row['id'] for row in rows)
+    archive = StreamLogArchive(
+        stream_id=stream_id,
+        first_at=first_at,
+        last_at=max(row['created_at'] for row in rows),
+        last_log_id=last_id,
+        row_count=len(rows),
+        levels=sorted({row['level'] for row in rows}),
+        size=len(data),
+    )
+    name = f"{stream_id}/{first_at:%Y%m%dT%H%M%S}-{last_id}.jsonl.gz"
+    archive.file.save(name, ContentFile(data), save=False)
+    return archive
+
+
+def _flush(pending):
+    """Write a segment for every buffered stream and index them in one insert."""
+    archives = [_build_segment(stream_id, rows) for stream_id, rows in pending.items()]
+    StreamLogArchive.objects.bulk_create(archives)
+    pending.clear()
+    return archives
+
+
+def archive_logs_before(before):
+    """
+    Export every stream's logs older than `before` that have not been
+    archived yet. The aged rows are read once in created_at order; each
+    stream's newest archived created_at (last_at) skips rows a previous run
+    already exported, so a run that failed before the delete can simply be
+    repeated. Ids are not a usable mark: a row can get a lower id than one
+    created after it, and would then never be exported before retention
+    deleted it.
+
+    Raises on any failure so the caller does not go on to delete logs that
+    weren't exported. Returns (segments written, rows archived).
+    """
+    archived_up_to = dict(
+        StreamLogArchive.objects.order_by()
+        .values('stream_id')
+        .annotate(archived_at=Max('last_at'))
+        .values_list('stream_id', 'archived_at')
+    )
+
+    segments = 0
+    rows = 0
+    pending = defaultdict(list)
+    buffered = 0
+    after = None
+    while True:
+        logs = StreamLog.objects.filter(created_at__lt=before)
+        if after:
+            # Keyset pagination on (created_at, id)
+            logs = logs.filter(
+                Q(created_at__gt=after['created_at']) | Q(created_at=after['created_at'], id__gt=after['id'])
+            )
+        chunk = list(
+            logs.order_by('created_at', 'id')
+            .values('id', 'stream_id', 'created_at', 'level', 'message')[:EXPORT_CHUNK_SIZE]
+        )
+        if not chunk:
+            break
+        after = chunk[-1]
+
+        for row in chunk:
+            stream_id = row['stream_id']
+            archived_at = archived_up_to.get(stream_id)
+            if archived_at and row['created_at'] <= archived_at:
+                continue
+            pending[stream_id].append(row)
+            buffered += 1
+            rows += 1
+            if len(pending[stream_id]) >= SEGMENT_MAX_ROWS:
+                buffered -= len(pending[stream_id])
+                StreamLogArchive.objects.bulk_create([_build_segment(stream_id, pending.pop(stream_id))])
+                segments += 1
+
+        if buffered >= BUFFER_MAX_ROWS:
+            segments += len(_flush(pending))
+            buffered = 0
+
+    segments += len(_flush(pending))
+    logger.info(f"Archived {rows} logs older than {before:%Y-%m-%d} into {segments} segments")
+    return segments, rows
+
+
+def read_segment(archive):
+    """Yield the records of one segment as dicts, created_at parsed back to datetime."""
+    with archive.file.open('rb') as fh, gzip.GzipFile(fileobj=fh) as gz:
+        for line in gz:
+            record = json.loads(line)
+            record['created_at'] = parse_datetime(record['created_at'])
+            yield record
+
+
+def iter_archived_logs(stream_id, start=None, end=None, levels=None):
+    """
+    Yield archived log records for a stream between start and end (either may
+    be None), oldest first, opening only the segments that overlap the range.
+    """
+    archives = StreamLogArchive.objects.filter(stream_id=stream_id).order_by('first_at')
+    if start:
+        archives = archives.filter(last_at__gte=start)
+    if end:
+        archives = archives.filter(first_at__lte=end)
+
+    for archive in archives:
+        if levels and not set(levels) & set(archive.levels):
+            continue
+        for record in read_segment(archive):
+            if start and record['created_at'] < start:
+                continue
+            if end and record['created_at'] > end:
+                continue
+            if levels and record['level'] not in levels:
+                continue
+            yield record
@@ -0,0 +1,195 @@
+"""
+StreamLog retention.
+
+On PostgreSQL streaming_streamlog is range-partitioned by created_at into one
+partition per UTC day (see migration 0008), so expiring old logs is a
+DETACH + DROP of whole partitions instead of a table-wide DELETE. Rows that
+land outside the daily partitions go to a DEFAULT partition and are removed
+with chunked deletes, which is also how other databases (SQLite in
+development) expire logs.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+import logging
+
+from django.db import connection, transaction
+
+from .models import StreamLog
+
+logger = logging.getLogger(__name__)
+
+LOG_TABLE = StreamLog._meta.db_table
+DEFAULT_PARTITION = f"{LOG_TABLE}_default"
+PARTITION_PREFIX = f"{LOG_TABLE}_p"
+
+# How many days of partitions to keep created ahead of time
+PARTITION_DAYS_AHEAD = 7
+
+DELETE_CHUNK_SIZE = 5000
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def start_of_day(moment):
+    """UTC midnight at or before moment, i.e. the nearest partition boundary."""
+    day = moment.astimezone(dt_timezone.utc).date()
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def is_partitioned():
+    """True when the log table is a PostgreSQL partitioned table."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [LOG_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Return {day: partition name} for the existing daily partitions."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND pg_table_is_visible(p.oid)",
+            [LOG_TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        if name.startswith(PARTITION_PREFIX):
+            try:
+                partitions[datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()] = name
+            except ValueError:
+                continue
+    return partitions
+
+
+def create_partition(day):
+    """
+    Create the partition for one UTC day. Rows for that day already sitting
+    in the DEFAULT partition are moved into it first, since PostgreSQL
+    refuses to attach a range the DEFAULT partition has rows for.
+    """
+    name = partition_name(day)
+    start, end = _day_bounds(day)
+    qn = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT 1 FROM {qn(DEFAULT_PARTITION)} WHERE created_at >= %s AND created_at < %s LIMIT 1",
+            [start, end],
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(LOG_TABLE)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, end],
+            )
+            return name
+
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(LOG_TABLE)} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {qn(DEFAULT_PARTITION)} "
+            f"WHERE created_at >= %s AND created_at < %s RETURNING *) "
+            f"INSERT INTO {qn(name)} SELECT * FROM moved",
+            [start, end],
+        )
+        cursor.execute(
+            f"ALTER TABLE {qn(LOG_TABLE)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    logger.warning(f"Moved rows for {day} out of {DEFAULT_PARTITION} into {name}")
+    return name
+
+
+def ensure_partitions(days_ahead=PARTITION_DAYS_AHEAD):
+    """Create any missing partitions from today up to days_ahead. Returns the new names."""
+    existing = list_partitions()
+    today = datetime.now(dt_timezone.utc).date()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if day not in existing:
+            created.append(create_partition(day))
+    return created
+
+
+def drop_partitions_before(cutoff):
+    """
+    Drop every daily partition whose range ends at or before cutoff.
+    Returns the names of the dropped partitions.
+    """
+    qn = connection.ops.quote_name
+    dropped = []
+    for day, name in sorted(list_partitions().items()):
+        if _day_bounds(day)[1] > cutoff:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {qn(LOG_TABLE)} DETACH PARTITION {qn(name)}")
+            cursor.execute(f"DROP TABLE {qn(name)}")
+        dropped.append(name)
+    return dropped
+
+
+def delete_logs_before(cutoff, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Delete logs older than cutoff in chunks, each in its own short
+    transaction, so no single statement holds locks over the whole table.
+    Returns the number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        ids = list(
+            StreamLog.objects.filter(created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        count, _ = StreamLog.objects.filter(id__in=ids, created_at__lt=cutoff).delete()
+        deleted += count
+
+
+def delete_default_partition_logs_before(cutoff, chunk_size=DELETE_CHUNK_SIZE):
+    """Chunked delete of rows older than cutoff from the DEFAULT partition only."""
+    qn = connection.ops.quote_name
+    deleted = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(DEFAULT_PARTITION)} WHERE id IN ("
+                f"SELECT id FROM {qn(DEFAULT_PARTITION)} WHERE created_at < %s "
+                f"ORDER BY created_at LIMIT %s)",
+                [cutoff, chunk_size],
+            )
+            if cursor.rowcount == 0:
+                return deleted
+            deleted += cursor.rowcount
+
+
+def expire_logs(cutoff):
+    """
+    Remove logs older than cutoff. On a partitioned table whole days are
+    dropped, so a day's logs go once the entire day is past the cutoff.
+    Returns (dropped partitions, deleted rows).
+    """
+    if not is_partitioned():
+        return [], delete_logs_before(cutoff)
+
+    ensure_partitions()
+    dropped = drop_partitions_before(cutoff)
+    deleted = delete_default_partition_logs_before(cutoff)
+    return dropped, deleted
@@ -0,0 +1,166 @@
+"""
+Synthetic data used by the bench_* management commands.
+
+Everything is written with bulk_create so seeding thousands of rows stays fast,
+which means model save() overrides and post_save signals are bypassed; fields
+they would normally fill in are set explicitly here.
+"""
+from datetime import timedelta
+import os
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from apps.accounts.models import UserProfile, YouTubeAccount
+from apps.payments.models import Payment, Subscription
+from apps.streaming import heartbeat
+from apps.streaming.models import EncoderProcess, MediaFile, Stream, StreamLog, StreamSlot
+
+BATCH_SIZE = 2000
+
+DEFAULT_STATUSES = ['idle', 'stopped', 'stopped', 'error', 'running', 'starting']
+
+# Every seeded subscription's concurrent-stream limit
+MAX_STREAMS = 3
+
+
+def seed(users=50, streams_per_user=40, media_per_user=60, logs_per_stream=10, expired_users=20,
+         statuses=DEFAULT_STATUSES):
+    """
+    Seed users with subscriptions, YouTube accounts, media, streams and logs.
+    Stream statuses cycle through `statuses`, so its mix sets how many are live.
+    Returns a dict with the objects the benchmarks drive requests through.
+    At least two users are needed, and the last two are never expired.
+    """
+    if users < 2:
+        raise ValueError('seed() needs at least 2 users')
+    expired_users = min(expired_users, users - 2)
+    now = timezone.now()
+
+    User.objects.bulk_create(
+        [User(username=f"bench{i}", email=f"bench{i}@example.com") for i in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+    all_users = list(User.objects.filter(username__startswith='bench').order_by('id'))
+    UserProfile.objects.bulk_create([UserProfile(user=user) for user in all_users], batch_size=BATCH_SIZE)
+    admin = User.objects.create_superuser('bench_admin', 'bench_admin@example.com', None)
+
+    subscriptions = []
+    for i, user in enumerate(all_users):
+        expired = i < expired_users
+        subscriptions.append(Subscription(
+            user=user,
+            plan_type='annual',
+            razorpay_order_id=f"order_bench_{i}",
+            razorpay_payment_id=f"pay_bench_{i}",
+            amount=399900,
+            max_streams=MAX_STREAMS,
+            storage_limit=2 * (1024 ** 3),
+            status='active',
+            is_active=True,
+            end_date=now - timedelta(days=1) if expired else now + timedelta(days=2 if i % 2 else 200),
+        ))
+    Subscription.objects.bulk_create(subscriptions, batch_size=BATCH_SIZE)
+    Payment.objects.bulk_create(
+        [Payment(subscription=s, razorpay_payment_id=s.razorpay_payment_id, amount=s.amount, status='captured')
+         for s in Subscription.objects.filter(user__in=all_users)],
+        batch_size=BATCH_SIZE,
+    )
+
+    YouTubeAccount.objects.bulk_create(
+        [YouTubeAccount(user=user, channel_id=f"UCbench{i}", channel_title=f"Bench channel {i}",
+                        access_token='token', refresh_token='refresh', is_active=True)
+         for i, user in enumerate(all_users)],
+        batch_size=BATCH_SIZE,
+    )
+    accounts = {a.user_id: a for a in YouTubeAccount.objects.filter(user__in=all_users)}
+
+    MediaFile.objects.bulk_create(
+        [MediaFile(user=user, title=f"Clip {n}", file=f"uploads/media/bench_{user.id}_{n}.mp4",
+                   media_type='video' if n % 4 else 'audio', sequence=(n + 1) * 1024,
+                   file_size=25 * 1024 * 1024)
+         for user in all_users for n in range(media_per_user)],
+        batch_size=BATCH_SIZE,
+    )
+
+    streams = []
+    for user_index, user in enumerate(all_users):
+        live_count = 0
+        for n in range(streams_per_user):
+            status = statuses[n % len(statuses)]
+            # Expired users keep nothing running so the expiry task never calls
+            # YouTube, and nobody has more live streams than their plan allows
+            if status in ('running', 'starting'):
+                if user_index < expired_users or live_count >= MAX_STREAMS:
+                    status = 'stopped'
+                else:
+                    live_count += 1
+            streams.append(Stream(
+                user=user,
+                youtube_account=accounts[user.id],
+                title=f"Stream {n}",
+                status=status,
+                broadcast_id=f"bc_{user.id}_{n}" if status != 'idle' else '',
+                started_at=now - timedelta(hours=n) if status == 'running' else None,
+            ))
+    Stream.objects.bulk_create(streams, batch_size=BATCH_SIZE)
+    # Registered on a node of their own so reconcile() never touches them
+    EncoderProcess.objects.bulk_create(
+        [EncoderProcess(stream=stream, node='bench', pid=os.getpid(), create_time=0, fingerprint='')
+         for stream in streams if stream.status == 'running'],
+        batch_size=BATCH_SIZE,
+    )
+    # Slots are numbered 0..MAX_STREAMS-1 per user, as slots.reserve() hands them out
+    slot_numbers = {}
+    slots = []
+    for stream in streams:
+        if stream.status in ('running', 'starting'):
+            number = slot_numbers[stream.user_id] = slot_numbers.get(stream.user_id, -1) + 1
+            slots.append(StreamSlot(user_id=stream.user_id, stream=stream, number=number))
+    StreamSlot.objects.bulk_create(slots, batch_size=BATCH_SIZE)
+    _beat_for_half(streams)
+
+    media_ids = {}
+    for media_id, user_id in MediaFile.objects.filter(user__in=all_users).values_list('id', 'user_id'):
+        media_ids.setdefault(user_id, []).append(media_id)
+    Stream.media_files.through.objects.bulk_create(
+        [Stream.media_files.through(stream_id=s.id, mediafile_id=media_id)
+         for s in streams for media_id in media_ids[s.user_id][:5]],
+        batch_size=BATCH_SIZE,
+    )
+
+    levels = ['INFO', 'INFO', 'WARNING', 'ERROR']
+    StreamLog.objects.bulk_create(
+        [StreamLog(stream=s, level=levels[n % len(levels)], message=f"Bench log line {n}")
+         for s in streams for n in range(logs_per_stream)],
+        batch_size=BATCH_SIZE,
+    )
+    # auto_now_add ignores explicit values, so age a third of the logs afterwards
+    oldest_id = StreamLog.objects.order_by('id').values_list('id', flat=True).first() or 0
+    StreamLog.objects.filter(id__lt=oldest_id + len(streams) * logs_per_stream // 3).update(
+        created_at=now - timedelta(days=45)
+    )
+
+    # The last user is never expired and has running streams; the one before
+    # it gets no streams at all so it is still allowed to open stream_create
+    user = all_users[-1]
+    creator = all_users[-2]
+    Stream.objects.filter(user=creator).delete()
+    return {
+        'user': user,
+        'creator': creator,
+        'admin': admin,
+        'stream': Stream.objects.filter(user=user, status='running').first(),
+        'media': MediaFile.objects.filter(user=user).first(),
+    }
+
+
+def _beat_for_half(streams):
+    """Publish heartbeats for every other running stream; the rest look dead to the health check."""
+    alive = [stream for stream in streams if stream.status == 'running'][::2]
+    try:
+        for stream in alive:
+            heartbeat.beat(stream.id, os.getpid())
+    except Exception:
+        # Without Redis the health check skips its sweep, which is still worth measuring
+        pass
@@ -0,0 +1,94 @@
+import logging
+import statistics
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from ._seed import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Time stream_status_api requests through Django's WSGI handler, as "
+        "gunicorn runs them, with a new database connection per request "
+        "(CONN_MAX_AGE=0) and with persistent connections. Run it against "
+        "PostgreSQL; SQLite's in-memory test database is never reconnected."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--max-age', type=int, default=300, help="CONN_MAX_AGE for the persistent run")
+
+    def handle(self, *args, **options):
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            data = seed(users=5, streams_per_user=5, media_per_user=1, logs_per_stream=0, expired_users=0)
+            client = Client()
+            client.force_login(data['user'])
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            path = reverse('stream_status_api', args=[data['stream'].id])
+            results = [
+                self.measure('per-request connections', 0, path, cookie, options['requests']),
+                self.measure('persistent connections', options['max_age'], path, cookie, options['requests']),
+            ]
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(f"{connection.vendor}, {options['requests']} requests to {path}")
+        self.stdout.write(f"{'mode':26} {'connects':>9} {'mean ms':>8} {'p50 ms':>7} {'p95 ms':>7}")
+        for r in results:
+            self.stdout.write(
+                f"{r['mode']:26} {r['connects']:>9} {r['mean']:>8.2f} {r['p50']:>7.2f} {r['p95']:>7.2f}"
+            )
+
+    def measure(self, mode, max_age, path, cookie, requests):
+        # Takes effect from the next connection the handler opens
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        handler = WSGIHandler()
+        factory = RequestFactory()
+        connects = []
+
+        def count(**kwargs):
+            connects.append(1)
+
+        def call():
+            environ = factory.get(path).environ
+            environ['HTTP_COOKIE'] = cookie
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers: None)
+            # The WSGI server closes the response, which ends the request
+            # and closes the connection unless it is persistent
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            return elapsed
+
+        call()  # warm-up: URL resolver, templates, first connection
+        connection_created.connect(count)
+        try:
+            timings = sorted(call() for _ in range(requests))
+        finally:
+            connection_created.disconnect(count)
+        return {
+            'mode': mode,
+            'connects': len(connects),
+            'mean': statistics.mean(timings),
+            'p50': timings[len(timings) // 2],
+            'p95': timings[int(len(timings) * 0.95)],
+        }
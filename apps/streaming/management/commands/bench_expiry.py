@@ -0,0 +1,83 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.utils import timezone
+
+from config import celery_app
+
+from ._seed import seed
+
+# The midnight expiry job must stay under this however many subscriptions exist
+TIME_BUDGET_MS = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with many subscriptions, some expired and some "
+        "about to expire, and time the daily check_subscription_expiry job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=100000)
+        parser.add_argument('--expired', type=int, default=1000)
+        parser.add_argument('--expiring', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        from apps.payments.models import Subscription
+        from apps.payments.tasks import check_subscription_expiry
+
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        # Queued jobs (stream stops, warning emails) run inline so they are timed too
+        celery_app.conf.task_always_eager = True
+        mail_override = override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+        mail_override.enable()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.perf_counter()
+            seed(
+                users=options['subscriptions'],
+                streams_per_user=0,
+                media_per_user=0,
+                logs_per_stream=0,
+                expired_users=options['expired'],
+            )
+            expiring_ids = list(
+                Subscription.objects.filter(end_date__gt=timezone.now())
+                .order_by('id').values_list('id', flat=True)[:options['expiring']]
+            )
+            Subscription.objects.filter(id__in=expiring_ids).update(
+                end_date=timezone.now() + timedelta(days=2, hours=12)
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            self.stdout.write(f"Seeded {options['subscriptions']} subscriptions in {time.perf_counter() - started:.1f}s")
+
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                result = check_subscription_expiry.apply().get()
+                elapsed = (time.perf_counter() - started) * 1000
+            expired = Subscription.objects.filter(status='expired').count()
+            warned = len(mail.outbox)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            mail_override.disable()
+            celery_app.conf.task_always_eager = False
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(result)
+        self.stdout.write(
+            f"{expired} expired, {warned} warnings sent, "
+            f"{len(ctx)} queries, {elapsed:.1f} ms (budget {TIME_BUDGET_MS} ms)"
+        )
+        if elapsed > TIME_BUDGET_MS:
+            raise CommandError(f"check_subscription_expiry took {elapsed:.0f} ms")
+        self.stdout.write(self.style.SUCCESS("Subscription expiry within time budget"))
@@ -0,0 +1,123 @@
+import logging
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from ._seed import seed
+
+# Migrations right before the hot-query indexes were added
+BEFORE_INDEXES = [('streaming', '0006_thumbnail_renditions'), ('payments', '0002_subscription_storage_limit')]
+
+# Most streams in a real deployment are stopped or idle; only a few are live
+STATUS_MIX = ['stopped'] * 30 + ['idle'] * 17 + ['error', 'running', 'starting']
+
+
+def access_path(plan):
+    """First line of an EXPLAIN output that says how the table is read."""
+    for line in plan.splitlines():
+        if 'scan' in line.lower() or 'search' in line.lower():
+            return line.strip()
+    return plan.splitlines()[0].strip()
+
+
+def existing_fields(model):
+    """Names of model's concrete fields whose columns exist in the database right now."""
+    with connection.cursor() as cursor:
+        columns = {
+            column.name for column in connection.introspection.get_table_description(cursor, model._meta.db_table)
+        }
+    return [field.name for field in model._meta.concrete_fields if field.column in columns]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and time the app's hot queries with and without "
+        "the hot-query indexes, printing the query plan used in each case."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--streams-per-user', type=int, default=50)
+        parser.add_argument('--media-per-user', type=int, default=60)
+        parser.add_argument('--logs-per-stream', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--plans', action='store_true', help="Print the full EXPLAIN output")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("--users must be at least 2")
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.perf_counter()
+            data = seed(
+                users=options['users'],
+                streams_per_user=options['streams_per_user'],
+                media_per_user=options['media_per_user'],
+                logs_per_stream=options['logs_per_stream'],
+                statuses=STATUS_MIX,
+            )
+            self.stdout.write(f"Seeded data in {time.perf_counter() - started:.1f}s")
+
+            for app_label, migration in BEFORE_INDEXES:
+                call_command('migrate', app_label, migration, verbosity=0)
+            before = self.run_queries(data, options)
+            call_command('migrate', verbosity=0)
+            after = self.run_queries(data, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(f"{'query':26} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+        for name, (before_ms, before_plan) in before.items():
+            after_ms, after_plan = after[name]
+            speedup = before_ms / after_ms if after_ms else float('inf')
+            self.stdout.write(f"{name:26} {before_ms:>10.3f} {after_ms:>10.3f} {speedup:>7.1f}x")
+            if options['plans']:
+                self.stdout.write(f"  before: {before_plan}")
+                self.stdout.write(f"  after:  {after_plan}")
+            else:
+                self.stdout.write(f"  before: {access_path(before_plan)}")
+                self.stdout.write(f"  after:  {access_path(after_plan)}")
+
+    def hot_queries(self, data):
+        from apps.payments.models import Subscription
+        from apps.streaming.models import MediaFile, Stream, StreamLog
+
+        user = data['user']
+        now = timezone.now()
+        return {
+            'active_subscription': Subscription.objects.filter(user=user, is_active=True, status='active')[:1],
+            'expired_subscriptions': Subscription.objects.filter(is_active=True, status='active', end_date__lt=now),
+            'user_live_streams': Stream.objects.filter(user=user, status__in=['running', 'starting']),
+            'health_check_streams': Stream.objects.filter(status__in=['running', 'starting']),
+            'stream_detail_logs': StreamLog.objects.filter(stream=data['stream'])[:50],
+            'old_logs': StreamLog.objects.filter(created_at__lt=now - timedelta(days=30)).values('id')[:1000],
+            'media_library': MediaFile.objects.filter(user=user),
+        }
+
+    def run_queries(self, data, options):
+        # Refresh planner statistics after the indexes were dropped or created
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        results = {}
+        for name, queryset in self.hot_queries(data).items():
+            if queryset._fields is None:
+                # Migrated back, the tables lack columns later migrations added
+                queryset = queryset.only(*existing_fields(queryset.model))
+            plan = queryset.explain()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = (statistics.median(timings), plan)
+        return results
@@ -0,0 +1,170 @@
+import json
+import logging
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+
+from config import celery_app
+
+from ._seed import seed
+
+# Maximum queries per view/task. These must not grow with data volume:
+# an N+1 shows up as hundreds of queries against the seeded data.
+QUERY_BUDGETS = {
+    'dashboard': 6,
+    'profile': 4,
+    'stream_list': 4,
+    'stream_detail': 6,
+    'stream_create': 9,
+    'stream_status_api': 3,
+    'media_list': 6,
+    'media_upload': 5,
+    'subscribe': 4,
+    'entitlement:warm': 0,  # cached by the views above
+    'dashboard:warm': 2,  # the user and the live stream count; the rest comes from cached fragments
+    'media_list:warm': 1,
+    'subscribe:warm': 1,
+    'admin:stream': 7,
+    'admin:streamlog': 7,
+    'admin:streamlogarchive': 7,
+    'admin:encoderprocess': 7,
+    'admin:mediafile': 7,
+    'admin:subscription': 7,
+    'admin:payment': 8,
+    'admin:youtubeaccount': 7,
+    'admin:userprofile': 7,
+    'task:check_stream_health': 6,  # including the stale slot sweep
+    'task:cleanup_old_logs': 25,  # per 5000 aged rows: one export and two deletes; SQLite batches the index inserts small
+    'task:check_subscription_expiry': 5,  # including the stop_user_streams job it queues
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with realistic volumes, run every view and "
+        "periodic task against it and fail if any exceeds its query budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--streams-per-user', type=int, default=40)
+        parser.add_argument('--media-per-user', type=int, default=60)
+        parser.add_argument('--logs-per-stream', type=int, default=10)
+        parser.add_argument('--report', help="Write results as JSON to this path")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("--users must be at least 2")
+        # The tasks log a line per stream/subscription, which would drown the report
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        # Archived log segments are written to media storage; keep them out of the project
+        media_root = tempfile.TemporaryDirectory()
+        # A private cache, so every run starts cold whatever a shared cache holds
+        media_override = override_settings(
+            MEDIA_ROOT=media_root.name,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+        media_override.enable()
+        # Tasks that the periodic tasks queue run inline and count towards their budget
+        celery_app.conf.task_always_eager = True
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.perf_counter()
+            data = seed(
+                users=options['users'],
+                streams_per_user=options['streams_per_user'],
+                media_per_user=options['media_per_user'],
+                logs_per_stream=options['logs_per_stream'],
+            )
+            self.stdout.write(f"Seeded data in {time.perf_counter() - started:.1f}s")
+            results = [self.measure(name, fn) for name, fn in self.cases(data)]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            media_override.disable()
+            celery_app.conf.task_always_eager = False
+            media_root.cleanup()
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        self.stdout.write(f"{'case':34} {'queries':>8} {'budget':>7} {'ms':>9}")
+        for r in results:
+            line = f"{r['name']:34} {r['queries']:>8} {r['budget']:>7} {r['ms']:>9.1f}"
+            self.stdout.write(self.style.ERROR(line) if r['over_budget'] else line)
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        over = [r['name'] for r in results if r['over_budget']]
+        if over:
+            raise CommandError(f"Query budget exceeded: {', '.join(over)}")
+        self.stdout.write(self.style.SUCCESS("All views and tasks within query budget"))
+
+    def measure(self, name, fn):
+        reset_queries()
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = fn()
+            elapsed = (time.perf_counter() - started) * 1000
+
+        status = getattr(response, 'status_code', None)
+        if status is not None and status >= 400:
+            raise CommandError(f"{name} returned HTTP {status}")
+
+        budget = QUERY_BUDGETS[name]
+        return {
+            'name': name,
+            'queries': len(ctx),
+            'budget': budget,
+            'ms': round(elapsed, 2),
+            'over_budget': len(ctx) > budget,
+        }
+
+    def cases(self, data):
+        from apps.payments.entitlements import get_entitlement
+        from apps.payments.tasks import check_subscription_expiry
+        from apps.streaming.tasks import check_stream_health, cleanup_old_logs
+
+        client = Client()
+        client.force_login(data['user'])
+        creator_client = Client()
+        creator_client.force_login(data['creator'])
+        admin_client = Client()
+        admin_client.force_login(data['admin'])
+        stream_id = data['stream'].id
+
+        yield 'dashboard', lambda: client.get('/accounts/dashboard/')
+        yield 'profile', lambda: client.get('/accounts/profile/')
+        yield 'stream_list', lambda: client.get('/streaming/streams/')
+        yield 'stream_detail', lambda: client.get(f'/streaming/streams/{stream_id}/')
+        yield 'stream_create', lambda: creator_client.get('/streaming/streams/create/')
+        yield 'stream_status_api', lambda: client.get(f'/streaming/streams/{stream_id}/status/')
+        yield 'media_list', lambda: client.get('/streaming/media/')
+        yield 'media_upload', lambda: client.get('/streaming/media/upload/')
+        yield 'subscribe', lambda: client.get('/payments/subscribe/')
+        yield 'entitlement:warm', lambda: get_entitlement(data['user'])
+        # Second renders, served from the cached fragments
+        yield 'dashboard:warm', lambda: client.get('/accounts/dashboard/')
+        yield 'media_list:warm', lambda: client.get('/streaming/media/')
+        yield 'subscribe:warm', lambda: client.get('/payments/subscribe/')
+
+        for app_label, model in [('streaming', 'stream'), ('streaming', 'streamlog'),
+                                 ('streaming', 'mediafile'), ('streaming', 'encoderprocess'),
+                                 ('payments', 'subscription'),
+                                 ('payments', 'payment'), ('accounts', 'youtubeaccount'),
+                                 ('accounts', 'userprofile')]:
+            url = f'/admin/{app_label}/{model}/'
+            yield f'admin:{model}', lambda url=url: admin_client.get(url)
+
+        yield 'task:check_stream_health', check_stream_health.apply
+        yield 'task:cleanup_old_logs', cleanup_old_logs.apply
+        yield 'task:check_subscription_expiry', check_subscription_expiry.apply
+        # Runs after cleanup_old_logs so there are archived segments to list
+        yield 'admin:streamlogarchive', lambda: admin_client.get('/admin/streaming/streamlogarchive/')
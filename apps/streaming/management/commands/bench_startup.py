@@ -0,0 +1,107 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a process does before it serves its first request or task
+BOOT = {
+    # A gunicorn worker loads config.wsgi, and its first request imports the
+    # URLconf and with it every view module
+    'web': (
+        "from config.wsgi import application\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n"
+    ),
+    # A Celery worker imports every tasks module before it takes a task
+    'worker': (
+        "import django\n"
+        "django.setup()\n"
+        "from config import celery_app\n"
+        "celery_app.loader.import_default_modules()\n"
+    ),
+}
+
+SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+{boot}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    'ms': elapsed * 1000,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+# Client libraries that only the code paths talking to those services may
+# import; none of them belongs in a freshly booted process. Not listed:
+# requests and Pillow, which DRF and Django's ImageField check import in every
+# process that runs system checks, as Celery workers do at startup
+HEAVY_MODULES = [
+    'googleapiclient.discovery',
+    'google_auth_oauthlib',
+    'google.oauth2.credentials',
+    'httplib2',
+    'razorpay',
+    'psutil',
+    'boto3',
+]
+
+# Per process: peak RSS in MB, with headroom over a boot on a developer
+# laptop; a new module-level import of a client library overshoots it. Boot
+# time is reported but not gated: it swings by a third between runs on a
+# shared machine, while RSS and the modules loaded don't
+BUDGETS = {
+    'web': {'rss_mb': 78},
+    'worker': {'rss_mb': 78},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Boot web and Celery worker processes as gunicorn and Celery do, and "
+        "report boot time, peak RSS and which heavy client libraries got "
+        "imported. Fails if a process imports one of them or exceeds its RSS budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        failures = []
+        self.stdout.write(f"{'process':8} {'boot ms':>8} {'RSS MB':>7} {'budget':>7}  heavy imports")
+        for role, boot in BOOT.items():
+            script = SCRIPT.format(boot=boot, heavy=HEAVY_MODULES)
+            runs = [self.run(script, env) for _ in range(options['runs'])]
+            # The fastest boot is the one least disturbed by whatever else runs
+            ms = min(run['ms'] for run in runs)
+            rss_mb = statistics.median(run['rss_kb'] for run in runs) / 1024
+            loaded = runs[0]['loaded']
+            budget = BUDGETS[role]
+            bad = loaded or rss_mb > budget['rss_mb']
+            if bad:
+                failures.append(role)
+            line = (
+                f"{role:8} {ms:>8.0f} {rss_mb:>7.1f} {budget['rss_mb']:>7}  "
+                f"{', '.join(loaded) or '-'}"
+            )
+            self.stdout.write(self.style.ERROR(line) if bad else line)
+
+        if failures:
+            raise CommandError(f"Over startup budget: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("All processes within startup budget"))
+
+    def run(self, script, env):
+        # A fresh interpreter each time, so nothing this process imported counts
+        result = subprocess.run(
+            [sys.executable, '-c', script], env=env, cwd=settings.BASE_DIR,
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Boot failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,435 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import psutil
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.accounts.models import YouTubeAccount
+from apps.payments.models import Subscription
+from apps.streaming import heartbeat, process_registry
+from apps.streaming.models import EncoderProcess, MediaFile, Stream, StreamLog
+from apps.streaming.stream_manager import ENCODER_PROFILES
+from apps.streaming.tasks import start_stream_async, stop_stream_async
+
+BENCH_USERNAME = 'bench_streamer'
+
+# A stream keeps up if its output timestamps advance at least this fast
+# relative to the wall clock; ffmpeg runs with -re, so never much faster
+REALTIME_RATIO = 0.95
+
+# Seconds to wait for the first FLV tag of a new stream
+FIRST_PACKET_TIMEOUT = 30
+
+# Metrics compared between reports, and whether lower is better
+COMPARED = {
+    'first_packet_s': True,
+    'stop_s': True,
+    'cpu_per_stream': True,
+    'rss_mb_per_stream': True,
+    'streams_per_core': False,
+}
+
+
+class _FakeYouTube(BaseHTTPRequestHandler):
+    """
+    Stand-in for the YouTube Data API calls StreamManager makes: broadcast and
+    stream insert, bind, transition and list. Every liveStreams.insert hands
+    out a new stream key on the server's ingest_url.
+    """
+
+    def do_GET(self):
+        self.respond('liveBroadcasts.list', {'kind': 'youtube#liveBroadcastListResponse', 'items': []})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        resource, _, action = urlsplit(self.path).path.removeprefix('/youtube/v3/').partition('/')
+        if resource == 'liveStreams':
+            key = uuid.uuid4().hex
+            body = {
+                'id': f"stream-{key[:12]}",
+                'cdn': {'ingestionInfo': {'streamName': key, 'ingestionAddress': self.server.ingest_url}},
+            }
+        else:
+            body = {'id': f"broadcast-{uuid.uuid4().hex[:12]}", 'status': {'lifeCycleStatus': 'ready'}}
+        self.respond(f"{resource}.{action or 'insert'}", body)
+
+    def respond(self, call, body):
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.calls[call] += 1
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FlvStream:
+    """What the ingest sink has received for one stream key."""
+
+    def __init__(self):
+        self.first_packet_at = None
+        self.closed_at = None
+        self.bytes = 0
+        self.timestamp = 0  # of the latest audio/video tag, in ms
+        self._buffer = bytearray()
+        self._header_left = 13  # FLV header and PreviousTagSize0
+
+    def feed(self, data):
+        self.bytes += len(data)
+        self._buffer += data
+        if self._header_left:
+            skip = min(self._header_left, len(self._buffer))
+            del self._buffer[:skip]
+            self._header_left -= skip
+        # Tag: type, 3-byte size, 3-byte timestamp + extension byte, 3-byte
+        # stream id, payload, then the 4-byte size of the tag just read
+        while len(self._buffer) >= 11:
+            end = 11 + int.from_bytes(self._buffer[1:4], 'big') + 4
+            if len(self._buffer) < end:
+                break
+            if self._buffer[0] in (8, 9):
+                if self.first_packet_at is None:
+                    self.first_packet_at = time.monotonic()
+                timestamp = int.from_bytes(self._buffer[4:7], 'big') | self._buffer[7] << 24
+                self.timestamp = max(self.timestamp, timestamp)
+            del self._buffer[:end]
+
+
+class _IngestSink(BaseHTTPRequestHandler):
+    """
+    Accepts the FLV output of the encoders. ffmpeg POSTs it here over HTTP
+    instead of publishing over RTMP: the same muxer, bytes and pacing,
+    without an RTMP server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        flv = _FlvStream()
+        self.server.streams[self.path.rsplit('/', 1)[-1]] = flv
+        try:
+            if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+                while size := int(self.rfile.readline().split(b';')[0], 16):
+                    flv.feed(self.rfile.read(size))
+                    self.rfile.readline()
+                self.rfile.readline()
+            else:
+                while chunk := self.rfile.read1(65536):
+                    flv.feed(chunk)
+        except (OSError, ValueError):
+            pass  # the encoder went away mid-stream
+        flv.closed_at = time.monotonic()
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(handler, **attributes):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _cpu_seconds(procs):
+    total = 0
+    for proc in procs:
+        try:
+            times = proc.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def _rss_bytes(procs):
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        "Start and stop streams through the real start_stream_async/"
+        "stop_stream_async path, with a local stand-in for the YouTube Data API "
+        "and a local sink for the encoder output, for each encoding profile. "
+        "Reports time to first packet, stop latency, CPU and RSS per stream and "
+        "how many streams per core keep real time, and writes the results to a "
+        "JSON report that --compare diffs against an earlier one. Creates and "
+        "removes its own user in the configured database, so run it against a "
+        "development database with local media storage, Redis and ffmpeg."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=list(ENCODER_PROFILES), default=list(ENCODER_PROFILES))
+        parser.add_argument('--max-streams', type=int, default=4, help="Stop ramping up at this many streams")
+        parser.add_argument('--resolution', default='1280x720', help="Size of the generated source video")
+        parser.add_argument('--fps', type=int, default=30)
+        parser.add_argument('--warmup', type=float, default=3, help="Seconds after a start before measuring")
+        parser.add_argument('--window', type=float, default=10, help="Seconds each ramp step is measured")
+        parser.add_argument('--api-delay', type=float, default=0, help="YouTube API response time in seconds")
+        parser.add_argument('--output', help="Report path (default: bench_streaming-<time>.json)")
+        parser.add_argument('--compare', help="Earlier report to compare this run with")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("bench_streaming writes to the configured database; run it with DEBUG on")
+        try:
+            default_storage.path('')
+        except NotImplementedError:
+            raise CommandError("bench_streaming needs local media storage; ffmpeg reads the files directly")
+        ffmpeg = shutil.which(settings.FFMPEG_PATH)
+        if not ffmpeg:
+            raise CommandError(f"ffmpeg not found: {settings.FFMPEG_PATH}")
+        heartbeat.get_redis().ping()
+
+        sink = _serve(_IngestSink, streams={})
+        api = _serve(
+            _FakeYouTube, calls=Counter(), lock=threading.Lock(), delay=options['api_delay'],
+            ingest_url=f"http://127.0.0.1:{sink.server_port}/live2",
+        )
+        workdir = tempfile.TemporaryDirectory()
+        User.objects.filter(username=BENCH_USERNAME).delete()
+        user = User.objects.create_user(BENCH_USERNAME, f"{BENCH_USERNAME}@example.com")
+        streams = []
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'host': {
+                'cpus': os.cpu_count(),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'ffmpeg': subprocess.run([ffmpeg, '-version'], capture_output=True, text=True).stdout.split('\n')[0],
+            },
+            'options': {
+                name: options[name]
+                for name in ('max_streams', 'resolution', 'fps', 'warmup', 'window', 'api_delay')
+            },
+            'profiles': {},
+        }
+        try:
+            streams = self.create_streams(user, ffmpeg, workdir.name, options)
+            with override_settings(YOUTUBE_API_URL=f"http://127.0.0.1:{api.server_port}/"):
+                for profile in options['profiles']:
+                    with override_settings(ENCODER_PROFILE=profile):
+                        report['profiles'][profile] = self.run_profile(profile, streams, sink, options)
+            report['youtube_calls'] = dict(api.calls)
+        finally:
+            for stream in streams:
+                process_registry.stop_encoder(stream.id)
+            for media in MediaFile.objects.filter(user=user):
+                media.file.delete(save=False)
+            user.delete()
+            api.shutdown()
+            sink.shutdown()
+            workdir.cleanup()
+
+        output = options['output'] or f"bench_streaming-{timezone.now():%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(
+            f"\n{report['host']['cpus']} CPUs, {options['resolution']}@{options['fps']} source, "
+            f"{options['window']:g}s windows"
+        )
+        self.stdout.write(
+            f"{'profile':10} {'first pkt s':>11} {'stop s':>7} {'CPU/stream':>10} "
+            f"{'RSS MB':>7} {'max streams':>11} {'per core':>8}"
+        )
+        for profile, r in report['profiles'].items():
+            self.stdout.write(
+                f"{profile:10} {r['first_packet_s']:>11.2f} {r['stop_s']:>7.2f} {r['cpu_per_stream']:>10.2f} "
+                f"{r['rss_mb_per_stream']:>7.1f} {r['max_streams']:>10}{'+' if r['capped'] else ' '} "
+                f"{r['streams_per_core']:>8.2f}"
+            )
+        for profile, r in report['profiles'].items():
+            if r['output_unclosed']:
+                self.stdout.write(self.style.WARNING(
+                    f"{profile}: {r['output_unclosed']} of {len(r['stops'])} stream(s) never closed "
+                    f"their output after the stop"
+                ))
+        self.stdout.write(f"Report written to {output}")
+        if options['compare']:
+            self.compare(options['compare'], report)
+
+    def create_streams(self, user, ffmpeg, workdir, options):
+        """A looping source clip, a YouTube account, a subscription and max_streams streams."""
+        clip = os.path.join(workdir, 'bench_source.mp4')
+        subprocess.run(
+            [
+                ffmpeg, '-v', 'error', '-y',
+                '-f', 'lavfi', '-i', f"testsrc2=size={options['resolution']}:rate={options['fps']}",
+                '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+                '-t', '10', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-shortest', clip,
+            ],
+            check=True,
+        )
+        with open(clip, 'rb') as f:
+            media = MediaFile.objects.create(
+                user=user, title='Bench source', media_type='video',
+                file=File(f, name='bench_source.mp4'), file_size=os.path.getsize(clip),
+            )
+        Subscription.objects.create(
+            user=user, plan_type='annual', razorpay_order_id=f"order_bench_streaming_{uuid.uuid4().hex}",
+            amount=0, max_streams=options['max_streams'], storage_limit=2 * 1024 ** 3,
+            end_date=timezone.now() + timedelta(days=1),
+        )
+        account = YouTubeAccount.objects.create(
+            user=user, channel_id=f"bench-streaming-{uuid.uuid4().hex}", channel_title='Bench channel',
+            access_token='bench-token', refresh_token='bench-refresh', is_active=True,
+        )
+        streams = []
+        for i in range(options['max_streams']):
+            stream = Stream.objects.create(user=user, youtube_account=account, title=f"Bench stream {i}")
+            stream.media_files.add(media)
+            streams.append(stream)
+        return streams
+
+    def run_profile(self, profile, streams, sink, options):
+        """Add streams one at a time until one falls behind real time, then stop them all."""
+        self.stdout.write(f"\n{profile}: {ENCODER_PROFILES[profile]}")
+        self.stdout.write(f"{'streams':>7} {'first pkt s':>11} {'min speed':>9} {'CPU/stream':>10} {'RSS MB':>7}")
+        running = []
+        steps = []
+        try:
+            for stream in streams:
+                running.append((stream, self.start(stream, sink)))
+                time.sleep(options['warmup'])
+                step = self.measure([stream for stream, _ in running], sink, options['window'])
+                step['first_packet_s'] = running[-1][1]
+                steps.append(step)
+                self.stdout.write(
+                    f"{len(running):>7} {step['first_packet_s']:>11.2f} {step['min_speed']:>9.2f} "
+                    f"{step['cpu_per_stream']:>10.2f} {step['rss_mb_per_stream']:>7.1f}"
+                )
+                if step['min_speed'] < REALTIME_RATIO:
+                    break
+        finally:
+            stops = [self.stop(stream, sink) for stream, _ in running]
+
+        sustained = [step for step in steps if step['min_speed'] >= REALTIME_RATIO]
+        # None when the sink never saw the upload end after the stop
+        closed = [stop['output_closed_s'] for stop in stops if stop['output_closed_s'] is not None]
+        max_streams = len(sustained)
+        return {
+            'definition': ENCODER_PROFILES[profile],
+            'first_packet_s': statistics.median(seconds for _, seconds in running),
+            'stop_s': statistics.median(stop['call_s'] for stop in stops),
+            'stop_max_s': max(stop['call_s'] for stop in stops),
+            'output_closed_s': statistics.median(closed) if closed else None,
+            'output_unclosed': len(stops) - len(closed),
+            # Measured with the encoder running alone
+            'cpu_per_stream': steps[0]['cpu_per_stream'],
+            'rss_mb_per_stream': steps[0]['rss_mb_per_stream'],
+            'max_streams': max_streams,
+            'capped': max_streams == len(streams),
+            'streams_per_core': max_streams / os.cpu_count(),
+            'steps': steps,
+            'stops': stops,
+        }
+
+    def start(self, stream, sink):
+        """Start stream as the stream-control worker would; returns seconds to its first packet."""
+        started = time.monotonic()
+        result = start_stream_async(str(stream.id))
+        stream.refresh_from_db()
+        if stream.status != 'running':
+            last_log = StreamLog.objects.filter(stream=stream).order_by('-id').first()
+            raise CommandError(f"{result}: {last_log.message if last_log else stream.error_message}")
+        deadline = started + FIRST_PACKET_TIMEOUT
+        while time.monotonic() < deadline:
+            flv = sink.streams.get(stream.stream_key)
+            if flv and flv.first_packet_at:
+                return flv.first_packet_at - started
+            time.sleep(0.01)
+        raise CommandError(f"No output from stream {stream.id} within {FIRST_PACKET_TIMEOUT}s")
+
+    def stop(self, stream, sink):
+        started = time.monotonic()
+        stop_stream_async(str(stream.id))
+        call_s = time.monotonic() - started
+        stream.refresh_from_db()
+        flv = sink.streams.get(stream.stream_key)
+        # The sink sees the end of the upload a moment after ffmpeg exits
+        deadline = time.monotonic() + 5
+        while flv and flv.closed_at is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return {
+            'call_s': call_s,
+            'output_closed_s': (flv.closed_at - started) if flv and flv.closed_at else None,
+            'status': stream.status,
+        }
+
+    def measure(self, streams, sink, window):
+        """Speed, CPU and RSS of the running streams' supervisors and encoders over window seconds."""
+        pids = dict(EncoderProcess.objects.filter(stream__in=streams).values_list('stream_id', 'pid'))
+        trees = {}
+        for stream in streams:
+            supervisor = psutil.Process(pids[stream.id])
+            trees[stream.id] = [supervisor] + supervisor.children(recursive=True)
+        flvs = {stream.id: sink.streams[stream.stream_key] for stream in streams}
+
+        started = time.monotonic()
+        cpu = {stream_id: _cpu_seconds(procs) for stream_id, procs in trees.items()}
+        timestamps = {stream_id: flv.timestamp for stream_id, flv in flvs.items()}
+        received = sum(flv.bytes for flv in flvs.values())
+        time.sleep(window)
+        elapsed = time.monotonic() - started
+        speeds = [(flv.timestamp - timestamps[stream_id]) / 1000 / elapsed for stream_id, flv in flvs.items()]
+        cpu_used = [(_cpu_seconds(procs) - cpu[stream_id]) / elapsed for stream_id, procs in trees.items()]
+        rss = [_rss_bytes(procs) / 1024 ** 2 for procs in trees.values()]
+        return {
+            'streams': len(streams),
+            'min_speed': min(speeds),
+            'cpu_per_stream': statistics.mean(cpu_used),
+            'rss_mb_per_stream': statistics.mean(rss),
+            'output_kbps': (sum(flv.bytes for flv in flvs.values()) - received) * 8 / 1000 / elapsed,
+        }
+
+    def compare(self, path, report):
+        with open(path) as f:
+            previous = json.load(f)
+        self.stdout.write(f"\nCompared with {path} ({previous['started_at']}, {previous['host']['cpus']} CPUs)")
+        for profile, current in report['profiles'].items():
+            before = previous['profiles'].get(profile)
+            if before is None:
+                continue
+            changes = []
+            for metric, lower_is_better in COMPARED.items():
+                old, new = before[metric], current[metric]
+                line = f"{metric} {old:.2f} -> {new:.2f}"
+                if old and abs(new - old) / old > 0.05 and (new < old) != lower_is_better:
+                    line = self.style.ERROR(line)
+                changes.append(line)
+            self.stdout.write(f"{profile:10} " + ', '.join(changes))
@@ -0,0 +1,120 @@
+import logging
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from config import celery_app
+
+# Messages are published here and the queue is deleted afterwards, so no
+# worker ever picks them up
+BENCH_QUEUE = 'bench-tasks'
+
+# (task name, args); arguments that make each task do no real work
+CASES = [
+    ('apps.streaming.tasks.check_stream_health', []),
+    ('apps.streaming.tasks.stop_stream_async', ['00000000-0000-0000-0000-000000000000']),
+    ('apps.streaming.tasks.end_lost_broadcasts', [[]]),
+    ('apps.streaming.tasks.bulk_start_streams', [[]]),
+    ('apps.streaming.tasks.stop_user_streams', [[]]),
+    ('apps.payments.tasks.check_subscription_expiry', []),
+    ('apps.payments.tasks.notify_expiring_subscriptions', [[]]),
+]
+
+
+def _redis_counters(client):
+    calls = sum(
+        stats['calls'] for command, stats in client.info('commandstats').items()
+        if command not in ('cmdstat_info', 'cmdstat_config|resetstat')
+    )
+    return calls, client.info('stats')['total_net_input_bytes']
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish and run each Celery task against the configured Redis broker and "
+        "result backend, and report the Redis commands, bytes and result keys per "
+        "task. Fails if a fire-and-forget task stores a result or a kept result "
+        "outlives CELERY_RESULT_EXPIRES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50)
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+        celery_app.loader.import_default_modules()
+        # Only the result backend's own client is counted; the broker and
+        # backend share one Redis here, as in docker-compose
+        client = celery_app.backend.client
+        try:
+            client.ping()
+        except redis.RedisError as e:
+            raise CommandError(f"Result backend unavailable: {e}")
+
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        # Run in this process, storing results exactly as a worker would
+        celery_app.conf.task_always_eager = False
+        celery_app.conf.task_store_eager_result = True
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        rows = []
+        try:
+            for name, task_args in CASES:
+                task = celery_app.tasks[name]
+                keys_before = set(client.scan_iter('celery-task-meta-*'))
+
+                calls, sent = _redis_counters(client)
+                for _ in range(runs):
+                    task.apply_async(task_args, queue=BENCH_QUEUE)
+                publish_calls, publish_sent = _redis_counters(client)
+
+                ids = [task.apply(task_args).id for _ in range(runs)]
+                run_calls, run_sent = _redis_counters(client)
+
+                new_keys = set(client.scan_iter('celery-task-meta-*')) - keys_before
+                ttls = [client.ttl(key) for key in new_keys]
+                rows.append({
+                    'task': name.rsplit('.', 1)[1],
+                    'ignore_result': task.ignore_result,
+                    'publish_cmds': (publish_calls - calls) / runs,
+                    'publish_bytes': (publish_sent - sent) / runs,
+                    'result_cmds': (run_calls - publish_calls) / runs,
+                    'result_bytes': (run_sent - publish_sent) / runs,
+                    'result_keys': len(new_keys),
+                    'max_ttl': max(ttls, default=None),
+                })
+                client.delete(*[f"celery-task-meta-{task_id}" for task_id in ids])
+        finally:
+            with celery_app.connection_for_write() as conn:
+                conn.default_channel.queue_delete(BENCH_QUEUE)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            celery_app.conf.task_store_eager_result = False
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+        expires = celery_app.backend.expires
+        failures = []
+        self.stdout.write(
+            f"{'task':30} {'result':>7} {'pub cmds':>9} {'pub B':>7} "
+            f"{'res cmds':>9} {'res B':>7} {'keys':>5} {'ttl':>6}"
+        )
+        for r in rows:
+            bad = (
+                (r['ignore_result'] and r['result_keys'])
+                or (r['max_ttl'] is not None and not 0 < r['max_ttl'] <= expires)
+            )
+            if bad:
+                failures.append(r['task'])
+            line = (
+                f"{r['task']:30} {'-' if r['ignore_result'] else 'kept':>7} "
+                f"{r['publish_cmds']:>9.1f} {r['publish_bytes']:>7.0f} "
+                f"{r['result_cmds']:>9.1f} {r['result_bytes']:>7.0f} "
+                f"{r['result_keys']:>5} {r['max_ttl'] if r['max_ttl'] is not None else '-':>6}"
+            )
+            self.stdout.write(self.style.ERROR(line) if bad else line)
+
+        if failures:
+            raise CommandError(f"Unexpected or long-lived task results: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("Only declared results stored, all expiring"))
@@ -0,0 +1,181 @@
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from apps.payments import gateway
+
+# gunicorn settings compared: the old sync workers and docker-compose.prod.yml's
+WORKER_CONFIGS = [
+    ('sync, 4 workers', {'worker_class': 'sync', 'workers': 4}),
+    ('gthread, 4 workers x 8 threads', {'worker_class': 'gthread', 'workers': 4, 'threads': 8}),
+]
+
+
+class _SlowRazorpay(BaseHTTPRequestHandler):
+    """Stand-in for the Razorpay orders API that answers after a fixed delay."""
+    delay = 0.5
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        body = json.dumps({'id': f"order_{uuid.uuid4().hex[:14]}", 'status': 'created'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve(port, options):
+    from gunicorn.app.base import BaseApplication
+
+    class App(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"127.0.0.1:{port}")
+            self.cfg.set('loglevel', 'warning')
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return WSGIHandler()
+
+    App().run()
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the app with gunicorn, first with sync workers and then with the "
+        "threaded workers used in production, while a local stand-in for "
+        "Razorpay answers every order after --delay seconds, and measure "
+        "create_order throughput under concurrent load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delay', type=float, default=0.5, help="Upstream response time in seconds")
+        parser.add_argument('--requests', type=int, default=64)
+        parser.add_argument('--concurrency', type=int, default=32)
+
+    def handle(self, *args, **options):
+        _SlowRazorpay.delay = options['delay']
+        upstream = ThreadingHTTPServer(('127.0.0.1', 0), _SlowRazorpay)
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+        base_url = gateway.client().base_url
+        gateway.client().base_url = f"http://127.0.0.1:{upstream.server_port}/v1"
+
+        logging.disable(logging.CRITICAL)
+        setup_test_environment()
+        # gunicorn's workers are forked from this process; an in-memory SQLite
+        # test database wouldn't be shared with them
+        sqlite_dir = tempfile.TemporaryDirectory()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(sqlite_dir.name, 'bench.sqlite3')
+        overrides = override_settings(
+            ALLOWED_HOSTS=['*'],
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+        overrides.enable()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        results = []
+        try:
+            user = User.objects.create_user('bench_buyer', 'bench_buyer@example.com')
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            path = reverse('create_order', args=['annual'])
+            for name, worker_options in WORKER_CONFIGS:
+                results.append((name, self.measure(worker_options, path, cookie, options)))
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            overrides.disable()
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+            sqlite_dir.cleanup()
+            gateway.client().base_url = base_url
+            upstream.shutdown()
+
+        self.stdout.write(
+            f"{options['requests']} create_order requests, {options['concurrency']} concurrent, "
+            f"upstream delay {options['delay']}s"
+        )
+        self.stdout.write(f"{'workers':32} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'errors':>7}")
+        for name, r in results:
+            self.stdout.write(f"{name:32} {r['rps']:>7.1f} {r['p50']:>7.2f} {r['p95']:>7.2f} {r['errors']:>7}")
+
+    def measure(self, worker_options, path, cookie, options):
+        port = _free_port()
+        # Forked workers must not share this process's database connection
+        connections.close_all()
+        server = multiprocessing.get_context('fork').Process(target=_serve, args=(port, worker_options))
+        server.start()
+        try:
+            self.wait_for(port)
+
+            def call(_):
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                started = time.perf_counter()
+                try:
+                    conn.request('GET', path, headers={'Cookie': cookie})
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                except OSError:
+                    ok = False
+                finally:
+                    conn.close()
+                return time.perf_counter() - started, ok
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                outcomes = list(pool.map(call, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        finally:
+            os.kill(server.pid, signal.SIGTERM)
+            server.join(30)
+
+        timings = sorted(duration for duration, _ in outcomes)
+        return {
+            'rps': len(outcomes) / elapsed,
+            'p50': statistics.median(timings),
+            'p95': timings[int(len(timings) * 0.95)],
+            'errors': sum(1 for _, ok in outcomes if not ok),
+        }
+
+    def wait_for(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f"gunicorn did not start on port {port}")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile the encoder process registry with the encoders running on this "
+        "node: adopt live ones, kill orphans and mark lost streams. Run at container start."
+    )
+
+    def handle(self, *args, **options):
+        from apps.streaming.process_registry import reconcile
+        from apps.streaming.tasks import end_lost_broadcasts
+
+        adopted, killed, lost_ids = reconcile()
+        if lost_ids:
+            end_lost_broadcasts.delay([str(stream_id) for stream_id in lost_ids])
+        self.stdout.write(f"Adopted {len(adopted)}, killed {len(killed)}, lost {len(lost_ids)} encoders")
@@ -0,0 +1,310 @@
+"""
+Prometheus metrics.
+
+Counters and histograms are recorded in process memory, which costs a dict
+update under a lock. A background thread in each process (gunicorn worker,
+Celery pool process) adds what was recorded to one Redis hash every
+FLUSH_INTERVAL seconds. Each hash field is one series, so processes on
+every node add up without coordinating. render() serves that
+hash in the Prometheus text format, together with gauges read at scrape
+time: streams by status, encoder speed and bitrate from the heartbeats,
+restarts of each live stream, and Celery queue depth. A scrape of any web worker therefore covers all of them.
+"""
+import atexit
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+
+import redis
+
+from . import heartbeat
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY = 'stream24:metrics'
+# stream id -> restarts since the stream was last stopped; a field per
+# stream at most, dropped when the stream stops
+RESTARTS_KEY = 'stream24:restarts'
+FLUSH_INTERVAL = 5  # seconds
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+# name -> (type, help, buckets for histograms)
+METRICS = {
+    'stream24_http_request_duration_seconds': (
+        'histogram', "Time to handle a request, by view", LATENCY_BUCKETS),
+    'stream24_celery_task_wait_seconds': (
+        'histogram', "Time a task spent queued before a worker started it", TASK_BUCKETS),
+    'stream24_celery_task_duration_seconds': (
+        'histogram', "Time a worker spent running a task", TASK_BUCKETS),
+    'stream24_youtube_api_calls_total': (
+        'counter', "YouTube Data API requests, by method", None),
+    'stream24_youtube_api_quota_units_total': (
+        'counter', "YouTube Data API quota units spent, by method", None),
+    'stream24_stream_restarts_total': (
+        'counter', "Stream restarts requested", None),
+    'stream24_thumbnail_rendition_lookups_total': (
+        'counter', "Thumbnail rendition lookups; a miss serves the original and queues "
+        "generation. The only media cache counted: fragment cache and storage hits are not", None),
+    'stream24_storage_bytes_read_total': (
+        'counter', "Media bytes read from storage (S3 in production), by purpose", None),
+}
+
+_lock = threading.Lock()
+_pending = {}
+_flusher = None
+_broker = None
+# Series names of each histogram label set seen, built once
+_histograms = {}
+
+_LE = re.compile(r',?le="([^"]+)"')
+
+# Every label value becomes a field of the shared hash for good, so labels
+# only take values from a fixed set; a client can send any method name
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    body = ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{body}}}"
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True)
+            _flusher.start()
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    if _flusher is None:
+        _start_flusher()
+    series = _series(name, labels)
+    with _lock:
+        _pending[series] = _pending.get(series, 0) + value
+
+
+def _histogram_series(name, labels):
+    """([(bucket bound, series)], series always counted, sum series) for a label set."""
+    key = (name, tuple(sorted(labels.items())))
+    series = _histograms.get(key)
+    if series is None:
+        bucket = f"{name}_bucket"
+        series = _histograms[key] = (
+            [(le, _series(bucket, {**labels, 'le': le})) for le in METRICS[name][2]],
+            [_series(bucket, {**labels, 'le': '+Inf'}), _series(f"{name}_count", labels)],
+            _series(f"{name}_sum", labels),
+        )
+    return series
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram."""
+    if _flusher is None:
+        _start_flusher()
+    buckets, always, total = _histogram_series(name, labels)
+    with _lock:
+        for le, series in buckets:
+            if value <= le:
+                _pending[series] = _pending.get(series, 0) + 1
+        for series in always:
+            _pending[series] = _pending.get(series, 0) + 1
+        _pending[total] = _pending.get(total, 0) + value
+
+
+def flush():
+    """Add everything recorded since the last flush to the shared hash."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    try:
+        pipe = heartbeat.get_redis().pipeline(transaction=False)
+        for series, value in pending.items():
+            pipe.hincrbyfloat(REDIS_KEY, series, value)
+        pipe.execute()
+    except redis.RedisError as e:
+        # Kept for the next flush rather than lost
+        with _lock:
+            for series, value in pending.items():
+                _pending[series] = _pending.get(series, 0) + value
+        logger.warning(f"Could not flush metrics: {e}")
+
+
+def _after_fork():
+    # A forked worker must not flush what its parent recorded, and has no
+    # flusher thread until it records something itself
+    global _lock, _pending, _flusher
+    _lock = threading.Lock()
+    _pending = {}
+    _flusher = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
+
+
+class RequestMetricsMiddleware:
+    """Times every request by view (its URL name), method and status class."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        observe(
+            'stream24_http_request_duration_seconds', time.perf_counter() - started,
+            view=match.view_name if match else 'unresolved',
+            method=request.method if request.method in HTTP_METHODS else 'other',
+            status=f"{response.status_code // 100}xx",
+        )
+        return response
+
+
+def count_restart(stream_id):
+    """Record a restart of stream_id, in the total and in the stream's own count."""
+    inc('stream24_stream_restarts_total')
+    try:
+        heartbeat.get_redis().hincrby(RESTARTS_KEY, str(stream_id), 1)
+    except redis.RedisError as e:
+        logger.warning(f"Could not count restart of stream {stream_id}: {e}")
+
+
+def forget_restarts(stream_ids):
+    """Drop the restart counts of streams that have been stopped."""
+    stream_ids = [str(stream_id) for stream_id in stream_ids]
+    if not stream_ids:
+        return
+    try:
+        heartbeat.get_redis().hdel(RESTARTS_KEY, *stream_ids)
+    except redis.RedisError as e:
+        logger.warning(f"Could not clear restart counts: {e}")
+
+
+def _queue_depths():
+    """Messages waiting in each Celery queue, from the Redis broker."""
+    from django.conf import settings
+
+    global _broker
+    if not settings.CELERY_BROKER_URL.startswith(('redis://', 'rediss://')):
+        return {}
+    if _broker is None:
+        _broker = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_timeout=2, socket_connect_timeout=2)
+    queues = sorted(
+        {settings.CELERY_TASK_DEFAULT_QUEUE} | {route['queue'] for route in settings.CELERY_TASK_ROUTES.values()}
+    )
+    # kombu keeps a list per queue and priority step; priority 0 uses the bare name
+    keys = {queue: [queue] + [f"{queue}\x06\x16{step}" for step in (3, 6, 9)] for queue in queues}
+    pipe = _broker.pipeline(transaction=False)
+    for queue in queues:
+        for key in keys[queue]:
+            pipe.llen(key)
+    lengths = iter(pipe.execute())
+    return {queue: sum(next(lengths) for _ in keys[queue]) for queue in queues}
+
+
+def scrape_allowed(request):
+    """
+    Whether request may read the metrics: it must carry METRICS_TOKEN as a
+    bearer token. Without a token configured, only DEBUG servers serve them.
+    """
+    from django.conf import settings
+
+    if not settings.METRICS_TOKEN:
+        return settings.DEBUG
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    return hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode())
+
+
+def _sort_key(series):
+    match = _LE.search(series)
+    le = match.group(1) if match else None
+    return (_LE.sub('', series), float(le) if le else 0)
+
+
+def _family(series):
+    name = series.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    from django.db.models import Count
+
+    from . import slots
+    from .models import Stream
+
+    flush()
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(f"{_series(name, labels)} {_format(value)}" for labels, value in samples)
+
+    counts = dict(Stream.objects.order_by().values_list('status').annotate(Count('id')))
+    gauge('stream24_streams', "Streams by status", [
+        ({'status': status}, counts.get(status, 0)) for status, _ in Stream.STATUS_CHOICES
+    ])
+
+    live_ids = list(Stream.objects.filter(status__in=slots.LIVE_STATUSES).values_list('id', flat=True))
+    beats = heartbeat.get_heartbeats(live_ids)
+    gauge('stream24_encoder_speed', "Encoding speed relative to real time, from the last heartbeat", [
+        ({'stream': stream_id}, beat['speed']) for stream_id, beat in beats.items() if 'speed' in beat
+    ])
+    gauge('stream24_encoder_bitrate_kbps', "Encoder output bitrate, from the last heartbeat", [
+        ({'stream': stream_id}, beat['bitrate_kbps']) for stream_id, beat in beats.items() if 'bitrate_kbps' in beat
+    ])
+
+    restarts = heartbeat.get_redis().hmget(RESTARTS_KEY, [str(stream_id) for stream_id in live_ids]) if live_ids else []
+    gauge('stream24_stream_restarts', "Restarts of each live stream since it was last stopped", [
+        ({'stream': stream_id}, int(count)) for stream_id, count in zip(live_ids, restarts) if count
+    ])
+
+    try:
+        depths = _queue_depths()
+    except redis.RedisError as e:
+        logger.warning(f"Could not read Celery queue depths: {e}")
+        depths = {}
+    gauge('stream24_celery_queue_depth', "Messages waiting in each Celery queue", [
+        ({'queue': queue}, depth) for queue, depth in depths.items()
+    ])
+
+    families = {}
+    for field, value in heartbeat.get_redis().hgetall(REDIS_KEY).items():
+        series = field.decode()
+        families.setdefault(_family(series), []).append((series, float(value)))
+    for name, (kind, help_text, _) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series, value in sorted(families.get(name, []), key=lambda item: _sort_key(item[0])):
+            lines.append(f"{series} {_format(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-19 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0005_stream_thumbnail"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mediafile",
+            name="thumbnail_renditions",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="stream",
+            name="thumbnail_renditions",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.0.14 on 2026-10-19 18:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_alter_youtubeaccount_is_active_and_more"),
+        ("streaming", "0006_thumbnail_renditions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="mediafile",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="media_files",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="stream",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="streams",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="streamlog",
+            name="stream",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="logs",
+                to="streaming.stream",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mediafile",
+            index=models.Index(
+                fields=["user", "sequence", "created_at"],
+                name="media_user_sequence_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stream",
+            index=models.Index(
+                fields=["user", "status"], name="stream_user_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stream",
+            index=models.Index(
+                condition=models.Q(("status__in", ["running", "starting"])),
+                fields=["status"],
+                name="stream_live_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="streamlog",
+            index=models.Index(
+                fields=["stream", "-created_at"], name="streamlog_stream_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="streamlog",
+            index=models.Index(fields=["created_at"], name="streamlog_created_idx"),
+        ),
+    ]
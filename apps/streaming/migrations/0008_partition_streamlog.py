@@ -0,0 +1,97 @@
+"""
+Rebuild streaming_streamlog as a PostgreSQL table range-partitioned by
+created_at, one partition per UTC day plus a DEFAULT partition.
+
+PostgreSQL needs the partition key in the primary key, so the table's key
+becomes (id, created_at); Django keeps treating id as the primary key, which
+stays unique because it comes from a single sequence. Other databases are
+left untouched.
+"""
+from datetime import datetime, time, timedelta, timezone
+
+from django.db import migrations
+
+# Existing rows older than this many days go to the DEFAULT partition, from
+# where the retention task deletes them.
+BACKFILL_DAYS = 30
+DAYS_AHEAD = 7
+
+
+def partition_streamlog(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    today = datetime.now(timezone.utc).date()
+    with schema_editor.connection.cursor() as cursor:
+        # Reversing this migration keeps the partitioned table, so migrating
+        # forwards again finds it already done
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'streaming_streamlog'::regclass"
+        )
+        if cursor.fetchone():
+            return
+
+        cursor.execute("LOCK TABLE streaming_streamlog IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM streaming_streamlog")
+        next_id = cursor.fetchone()[0]
+
+        # Free up the names the new table needs
+        cursor.execute("ALTER TABLE streaming_streamlog ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute("ALTER TABLE streaming_streamlog ALTER COLUMN id DROP DEFAULT")
+        cursor.execute("DROP SEQUENCE IF EXISTS streaming_streamlog_id_seq")
+        cursor.execute("DROP INDEX IF EXISTS streamlog_stream_created_idx")
+        cursor.execute("DROP INDEX IF EXISTS streamlog_created_idx")
+        cursor.execute(
+            "ALTER TABLE streaming_streamlog RENAME CONSTRAINT streaming_streamlog_pkey "
+            "TO streaming_streamlog_unpartitioned_pkey"
+        )
+        cursor.execute("ALTER TABLE streaming_streamlog RENAME TO streaming_streamlog_unpartitioned")
+
+        cursor.execute(f"CREATE SEQUENCE streaming_streamlog_id_seq START WITH {int(next_id)}")
+        cursor.execute(
+            """
+            CREATE TABLE streaming_streamlog (
+                id bigint NOT NULL DEFAULT nextval('streaming_streamlog_id_seq'),
+                level varchar(20) NOT NULL,
+                message text NOT NULL,
+                created_at timestamp with time zone NOT NULL,
+                stream_id uuid NOT NULL
+                    REFERENCES streaming_stream (id) DEFERRABLE INITIALLY DEFERRED,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+            """
+        )
+        cursor.execute("ALTER SEQUENCE streaming_streamlog_id_seq OWNED BY streaming_streamlog.id")
+        cursor.execute(
+            "CREATE INDEX streamlog_stream_created_idx ON streaming_streamlog (stream_id, created_at DESC)"
+        )
+        cursor.execute("CREATE INDEX streamlog_created_idx ON streaming_streamlog (created_at)")
+        cursor.execute("CREATE TABLE streaming_streamlog_default PARTITION OF streaming_streamlog DEFAULT")
+
+        for offset in range(-BACKFILL_DAYS, DAYS_AHEAD + 1):
+            day = today + timedelta(days=offset)
+            start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+            cursor.execute(
+                f"CREATE TABLE streaming_streamlog_p{day:%Y%m%d} PARTITION OF streaming_streamlog "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [start, start + timedelta(days=1)],
+            )
+
+        cursor.execute(
+            "INSERT INTO streaming_streamlog (id, level, message, created_at, stream_id) "
+            "SELECT id, level, message, created_at, stream_id FROM streaming_streamlog_unpartitioned"
+        )
+        cursor.execute("DROP TABLE streaming_streamlog_unpartitioned")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0007_alter_mediafile_user_alter_stream_user_and_more"),
+    ]
+
+    operations = [
+        # Reversing leaves the partitioned table in place; Django uses it like a
+        # plain table, and partition_streamlog skips it when run again
+        migrations.RunPython(partition_streamlog, migrations.RunPython.noop),
+    ]
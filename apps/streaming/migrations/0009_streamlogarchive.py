@@ -0,0 +1,56 @@
+# Generated by Django 5.0.14 on 2026-10-19 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0008_partition_streamlog"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StreamLogArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file", models.FileField(upload_to="archives/stream_logs/")),
+                ("first_at", models.DateTimeField()),
+                ("last_at", models.DateTimeField()),
+                ("last_log_id", models.BigIntegerField()),
+                ("row_count", models.PositiveIntegerField()),
+                ("levels", models.JSONField(default=list)),
+                ("size", models.BigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "stream",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="log_archives",
+                        to="streaming.stream",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Stream Log Archive",
+                "verbose_name_plural": "Stream Log Archives",
+                "ordering": ["stream", "first_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["stream", "first_at", "last_at"],
+                        name="logarchive_stream_range_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-19 19:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0009_streamlogarchive"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="stream",
+            name="process_id",
+        ),
+        migrations.CreateModel(
+            name="EncoderProcess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("node", models.CharField(db_index=True, max_length=255)),
+                ("pid", models.PositiveIntegerField()),
+                ("create_time", models.FloatField()),
+                ("fingerprint", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "stream",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="encoder",
+                        to="streaming.stream",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Encoder Process",
+                "verbose_name_plural": "Encoder Processes",
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.0.14 on 2026-10-19 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def reserve_live_streams(apps, schema_editor):
+    """Give streams that are already live the slots they are using."""
+    Stream = apps.get_model("streaming", "Stream")
+    StreamSlot = apps.get_model("streaming", "StreamSlot")
+    numbers = {}
+    slots = []
+    for stream in Stream.objects.filter(
+        status__in=["starting", "running", "stopping"]
+    ).order_by("started_at"):
+        number = numbers.get(stream.user_id, 0)
+        numbers[stream.user_id] = number + 1
+        slots.append(StreamSlot(user_id=stream.user_id, stream=stream, number=number))
+    StreamSlot.objects.bulk_create(slots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0010_encoderprocess"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StreamSlot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("number", models.PositiveSmallIntegerField()),
+                ("reserved_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "stream",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="slot",
+                        to="streaming.stream",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stream_slots",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Stream Slot",
+                "verbose_name_plural": "Stream Slots",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="streamslot",
+            constraint=models.UniqueConstraint(
+                fields=("user", "number"), name="stream_slot_user_number_uniq"
+            ),
+        ),
+        migrations.RunPython(reserve_live_streams, migrations.RunPython.noop),
+    ]
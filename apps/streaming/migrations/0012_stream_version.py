@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("streaming", "0011_streamslot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stream",
+            name="version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -9,10 +9,12 @@ class MediaFile(models.Model):
         ('audio', 'Audio'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_files')
+    # Indexed by the (user, sequence, created_at) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='media_files', db_index=False)
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to='uploads/media/')
     thumbnail = models.ImageField(upload_to='uploads/thumbnails/', blank=True, null=True)
+    thumbnail_renditions = models.JSONField(default=dict, blank=True, editable=False)
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
     sequence = models.PositiveIntegerField(default=0)
     duration = models.FloatField(default=0.0)  # in seconds
@@ -22,10 +24,19 @@ class MediaFile(models.Model):
     def __str__(self):
         return self.title
 
+    @property
+    def list_thumbnail_url(self):
+        from .thumbnails import rendition_url
+        return rendition_url(self, 'list')
+
     class Meta:
         verbose_name = 'Media File'
         verbose_name_plural = 'Media Files'
         ordering = ['sequence', 'created_at']
+        indexes = [
+            # Ordered media library listing
+            models.Index(fields=['user', 'sequence', 'created_at'], name='media_user_sequence_idx'),
+        ]
 
 class Stream(models.Model):
     STATUS_CHOICES = [
@@ -38,18 +49,21 @@ class Stream(models.Model):
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='streams')
+    # Indexed by the (user, status) index below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='streams', db_index=False)
     youtube_account = models.ForeignKey(YouTubeAccount, on_delete=models.CASCADE, related_name='streams')
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     thumbnail = models.ImageField(upload_to='uploads/stream_thumbnails/', blank=True, null=True)  # NEW FIELD
+    thumbnail_renditions = models.JSONField(default=dict, blank=True, editable=False)
     media_files = models.ManyToManyField(MediaFile, related_name='streams')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='idle')
+    # Bumped on every status change; see state.py
+    version = models.PositiveIntegerField(default=0, editable=False)
     stream_key = models.CharField(max_length=255, blank=True)
     broadcast_id = models.CharField(max_length=255, blank=True)
     stream_url = models.URLField(blank=True)
     loop_enabled = models.BooleanField(default=True)
-    process_id = models.IntegerField(null=True, blank=True)
     error_message = models.TextField(blank=True)
     started_at = models.DateTimeField(null=True, blank=True)
     stopped_at = models.DateTimeField(null=True, blank=True)
@@ -59,13 +73,31 @@ class Stream(models.Model):
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
+    @property
+    def preview_thumbnail_url(self):
+        from .thumbnails import rendition_url
+        return rendition_url(self, 'preview')
+
     class Meta:
         verbose_name = 'Stream'
         verbose_name_plural = 'Streams'
         ordering = ['-created_at']
+        indexes = [
+            # Per-user stream lists and concurrent stream limit checks
+            models.Index(fields=['user', 'status'], name='stream_user_status_idx'),
+            # Health checks only ever look at the handful of live streams
+            models.Index(
+                fields=['status'],
+                name='stream_live_status_idx',
+                condition=models.Q(status__in=['running', 'starting']),
+            ),
+        ]
 
 class StreamLog(models.Model):
-    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='logs')
+    # On PostgreSQL the table is partitioned by day on created_at (migration
+    # 0008, maintained by log_retention.py); filter on created_at where you can.
+    # Indexed by the (stream, created_at) index below
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='logs', db_index=False)
     level = models.CharField(max_length=20)  # INFO, WARNING, ERROR
     message = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
@@ -77,3 +109,79 @@ class StreamLog(models.Model):
         verbose_name = 'Stream Log'
         verbose_name_plural = 'Stream Logs'
         ordering = ['-created_at']
+        indexes = [
+            # Latest logs for the stream detail page
+            models.Index(fields=['stream', '-created_at'], name='streamlog_stream_created_idx'),
+            # Retention cleanup
+            models.Index(fields=['created_at'], name='streamlog_created_idx'),
+        ]
+
+
+class EncoderProcess(models.Model):
+    """
+    The encoder supervisor currently running a stream. PIDs are only unique
+    per host and get reused, so a process is identified by node, PID, its
+    start time and a hash of its command line together.
+    """
+    stream = models.OneToOneField(Stream, on_delete=models.CASCADE, related_name='encoder')
+    node = models.CharField(max_length=255, db_index=True)
+    pid = models.PositiveIntegerField()
+    create_time = models.FloatField()  # process start time, seconds since the epoch
+    fingerprint = models.CharField(max_length=64)  # sha256 of the command line
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.node}:{self.pid}"
+
+    class Meta:
+        verbose_name = 'Encoder Process'
+        verbose_name_plural = 'Encoder Processes'
+
+
+class StreamSlot(models.Model):
+    """
+    One of a user's concurrent-stream slots, numbered 0..max_streams-1 and
+    held by a stream from the moment it starts until it stops or dies. The
+    unique constraints make two starts unable to take the same slot, or one
+    stream to take two.
+    """
+    # Indexed by the (user, number) constraint below
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stream_slots', db_index=False)
+    number = models.PositiveSmallIntegerField()
+    stream = models.OneToOneField(Stream, on_delete=models.CASCADE, related_name='slot')
+    reserved_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id}#{self.number}"
+
+    class Meta:
+        verbose_name = 'Stream Slot'
+        verbose_name_plural = 'Stream Slots'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'number'], name='stream_slot_user_number_uniq'),
+        ]
+
+
+class StreamLogArchive(models.Model):
+    """One gzip-compressed JSONL segment of StreamLog rows rolled out of the live table"""
+    # Indexed by the (stream, first_at, last_at) index below
+    stream = models.ForeignKey(Stream, on_delete=models.CASCADE, related_name='log_archives', db_index=False)
+    file = models.FileField(upload_to='archives/stream_logs/')
+    first_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+    last_log_id = models.BigIntegerField()  # newest row id in the segment; last_at is the archive's high-water mark
+    row_count = models.PositiveIntegerField()
+    levels = models.JSONField(default=list)  # distinct levels present, e.g. ["ERROR", "INFO"]
+    size = models.BigIntegerField(default=0)  # compressed bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.stream_id} - {self.first_at:%Y-%m-%d} to {self.last_at:%Y-%m-%d}"
+
+    class Meta:
+        verbose_name = 'Stream Log Archive'
+        verbose_name_plural = 'Stream Log Archives'
+        ordering = ['stream', 'first_at']
+        indexes = [
+            models.Index(fields=['stream', 'first_at', 'last_at'], name='logarchive_stream_range_idx'),
+        ]
@@ -0,0 +1,309 @@
+"""
+Registry of running encoder processes.
+
+Every encoder supervisor gets an EncoderProcess row naming the node it runs
+on, its PID, the process start time and a hash of its command line. A
+process is only ever signalled after all four match what is running on this
+node, so a PID reused after a restart is never mistaken for an encoder.
+
+reconcile() runs when a node starts: it adopts encoders that are still
+running for live streams, kills encoders nobody should be running, and marks
+streams whose encoder disappeared as lost.
+
+Web processes import this module through StreamManager but seldom touch a
+process, so psutil is imported by the functions that use it.
+"""
+import hashlib
+import logging
+import os
+import selectors
+import signal
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import heartbeat, slots, state
+from .models import EncoderProcess, Stream, StreamLog
+
+logger = logging.getLogger(__name__)
+
+SUPERVISOR_MODULE = 'apps.streaming.supervisor'
+
+# Statuses in which a stream is supposed to have an encoder
+ACTIVE_STATUSES = ('starting', 'running', 'stopping')
+
+# Seconds a supervisor gets beyond ENCODER_STOP_TIMEOUT to record the exit
+# before its process group is SIGKILLed
+EXIT_GRACE = 2
+
+
+def remote_stop_timeout():
+    """
+    Seconds to wait for an encoder on another node to stop: it sees the
+    request at its next beat, then stops like a local one. A node that died
+    meanwhile lets its heartbeat expire sooner than this.
+    """
+    return heartbeat.HEARTBEAT_INTERVAL + settings.ENCODER_STOP_TIMEOUT + EXIT_GRACE
+
+
+def stop_remote(records, requested=False):
+    """
+    Ask the supervisors of records, all on other nodes, to stop (unless the
+    caller already has) and wait for them together until remote_stop_timeout(). Each supervisor records its
+    own exit and, for a stream still stopping, marks it stopped and frees
+    its slot. Returns {stream_id: {'remote': node, 'stopped': bool, 'exit': seconds}}.
+    """
+    started = time.monotonic()
+    if not requested:
+        for record in records:
+            heartbeat.request_stop(record.stream_id)
+    running = heartbeat.wait_stopped(
+        {record.stream_id: (record.node, record.pid) for record in records}, remote_stop_timeout()
+    )
+    elapsed = round(time.monotonic() - started, 3)
+    timings = {}
+    for record in records:
+        stopped = record.stream_id not in running
+        if stopped:
+            logger.info(f"Encoder for stream {record.stream_id} on {record.node} stopped in {elapsed}s")
+        else:
+            logger.warning(f"Encoder for stream {record.stream_id} on {record.node} has not stopped after {elapsed}s")
+        timings[record.stream_id] = {'remote': record.node, 'stopped': stopped, 'exit': elapsed}
+    return timings
+
+
+def fingerprint(cmdline):
+    return hashlib.sha256('\0'.join(cmdline).encode('utf-8')).hexdigest()
+
+
+def register(stream, pid):
+    """Record the supervisor just started for stream on this node."""
+    import psutil
+
+    proc = psutil.Process(pid)
+    with proc.oneshot():
+        create_time = proc.create_time()
+        cmdline = proc.cmdline()
+    record, _ = EncoderProcess.objects.update_or_create(
+        stream=stream,
+        defaults={
+            'node': settings.NODE_ID,
+            'pid': pid,
+            'create_time': create_time,
+            'fingerprint': fingerprint(cmdline),
+        },
+    )
+    return record
+
+
+def unregister(stream_id):
+    EncoderProcess.objects.filter(stream_id=stream_id).delete()
+
+
+def get_process(record):
+    """
+    The psutil.Process for a registry row if it is running on this node and
+    really is that encoder, otherwise None.
+    """
+    import psutil
+
+    if record.node != settings.NODE_ID:
+        return None
+    try:
+        proc = psutil.Process(record.pid)
+        with proc.oneshot():
+            if abs(proc.create_time() - record.create_time) > 0.01:
+                return None
+            if fingerprint(proc.cmdline()) != record.fingerprint:
+                return None
+        return proc
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        return None
+
+
+def _wait_exit(procs, deadline):
+    """
+    Wait until every process in procs has exited or deadline (monotonic)
+    passes, returning as each one exits. Returns {pid: seconds waited} for
+    the processes that exited.
+    """
+    import psutil
+
+    started = time.monotonic()
+    exited = {}
+    selector = selectors.DefaultSelector()
+    fallback = []
+    try:
+        for proc in procs:
+            try:
+                selector.register(os.pidfd_open(proc.pid), selectors.EVENT_READ, proc)
+            except (AttributeError, OSError):
+                fallback.append(proc)  # no pidfd support, or already gone
+
+        while selector.get_map() and time.monotonic() < deadline:
+            for key, _ in selector.select(timeout=deadline - time.monotonic()):
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                exited[key.data.pid] = time.monotonic() - started
+
+        if fallback:
+            gone, _ = psutil.wait_procs(fallback, timeout=max(deadline - time.monotonic(), 0))
+            for proc in gone:
+                exited[proc.pid] = time.monotonic() - started
+    finally:
+        for key in list(selector.get_map().values()):
+            os.close(key.fd)
+        selector.close()
+    return exited
+
+
+def stop_processes(procs, timeout=None):
+    """
+    Ask each encoder supervisor to stop its encoder cleanly (see
+    supervisor.py) and wait for them together, returning as soon as they
+    have all exited. Supervisors still running timeout + EXIT_GRACE seconds
+    later have their whole process group SIGKILLed.
+
+    Returns {pid: {'exit': seconds until it exited, 'killed': bool}}.
+    """
+    import psutil
+
+    timeout = settings.ENCODER_STOP_TIMEOUT if timeout is None else timeout
+    for proc in procs:
+        try:
+            proc.send_signal(signal.SIGTERM)
+        except psutil.NoSuchProcess:
+            pass
+
+    exited = _wait_exit(procs, time.monotonic() + timeout + EXIT_GRACE)
+
+    timings = {}
+    for proc in procs:
+        if proc.pid in exited:
+            timings[proc.pid] = {'exit': round(exited[proc.pid], 3), 'killed': False}
+            continue
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        timings[proc.pid] = {'exit': round(timeout + EXIT_GRACE, 3), 'killed': True}
+    return timings
+
+
+def stop_encoder(stream_id):
+    """
+    Stop the encoder registered for stream_id. Local encoders are stopped
+    after checking their identity and the call returns their stop timings;
+    encoders on another node are asked to stop through their heartbeat and
+    waited for (see stop_remote). Returns None if no encoder was found.
+    """
+    record = EncoderProcess.objects.filter(stream_id=stream_id).first()
+    if record is None:
+        return None
+
+    if record.node != settings.NODE_ID:
+        return stop_remote([record])[stream_id]
+
+    proc = get_process(record)
+    if proc is None:
+        logger.warning(f"Encoder {record} for stream {stream_id} is no longer running")
+        record.delete()
+        return None
+
+    timings = stop_processes([proc])[proc.pid]
+    record.delete()
+    if timings['killed']:
+        logger.warning(f"Encoder for stream {stream_id} ignored the stop request for {timings['exit']}s and was killed")
+    else:
+        logger.info(f"Encoder for stream {stream_id} stopped in {timings['exit']}s")
+    return timings
+
+
+def _local_supervisors():
+    """Supervisor processes running on this node, as {pid: (process, stream id)}."""
+    import psutil
+
+    found = {}
+    for proc in psutil.process_iter(['cmdline']):
+        cmdline = proc.info['cmdline'] or []
+        if SUPERVISOR_MODULE in cmdline and proc.pid != os.getpid():
+            args = cmdline[cmdline.index(SUPERVISOR_MODULE) + 1:]
+            found[proc.pid] = (proc, args[0] if args else None)
+    return found
+
+
+def _valid_uuids(values):
+    valid = []
+    for value in values:
+        try:
+            valid.append(uuid.UUID(value))
+        except ValueError:
+            continue
+    return valid
+
+
+def reconcile():
+    """
+    Bring this node's registry rows in line with the processes that are
+    actually running. Returns (adopted, killed, lost stream ids).
+    """
+    records = list(EncoderProcess.objects.filter(node=settings.NODE_ID).select_related('stream'))
+    running = _local_supervisors()
+
+    adopted = []
+    orphans = []
+    lost_ids = []
+    stale_record_ids = []
+    for record in records:
+        proc = get_process(record)
+        if proc is None:
+            stale_record_ids.append(record.id)
+            if record.stream.status in ACTIVE_STATUSES:
+                lost_ids.append(record.stream_id)
+        elif record.stream.status in ACTIVE_STATUSES:
+            adopted.append(record)
+            running.pop(proc.pid, None)
+        else:
+            orphans.append(proc)
+            stale_record_ids.append(record.id)
+            running.pop(proc.pid, None)
+
+    # Supervisors without a row here: leave the ones whose stream is active,
+    # which are being started right now or belong to another node id on
+    # this host, and kill the rest
+    if running:
+        unregistered_ids = {stream_id for _, stream_id in running.values() if stream_id}
+        active_ids = {
+            str(stream_id) for stream_id in Stream.objects.filter(
+                id__in=_valid_uuids(unregistered_ids), status__in=ACTIVE_STATUSES
+            ).values_list('id', flat=True)
+        }
+        orphans.extend(proc for proc, stream_id in running.values() if stream_id not in active_ids)
+
+    for proc in orphans:
+        logger.warning(f"Stopping orphaned encoder process {proc.pid}")
+    stop_processes(orphans)
+
+    now = timezone.now()
+    with transaction.atomic():
+        EncoderProcess.objects.filter(id__in=stale_record_ids).delete()
+        if lost_ids:
+            state.transition_many(
+                lost_ids, 'error', from_statuses=ACTIVE_STATUSES,
+                error_message='Encoder process was lost',
+                stopped_at=now,
+            )
+            StreamLog.objects.bulk_create([
+                StreamLog(stream_id=stream_id, level='ERROR', message=f'Encoder lost on {settings.NODE_ID} - detected at startup')
+                for stream_id in lost_ids
+            ])
+            slots.release(lost_ids)
+
+    logger.info(
+        f"Reconciled encoders on {settings.NODE_ID}: adopted {len(adopted)}, "
+        f"killed {len(orphans)}, lost {len(lost_ids)}"
+    )
+    return adopted, orphans, lost_ids
@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import StreamLogArchive
+
+
+# A segment is only reachable through its index row, so it goes with it,
+# including when a stream is deleted with its archives; only once the delete
+# has committed, so a rolled-back one keeps its file
+@receiver(post_delete, sender=StreamLogArchive)
+def delete_archive_segment(sender, instance, **kwargs):
+    if instance.file:
+        storage, name = instance.file.storage, instance.file.name
+        transaction.on_commit(lambda: storage.delete(name))
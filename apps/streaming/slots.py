@@ -0,0 +1,77 @@
+"""
+Concurrent-stream slots.
+
+A user may have at most max_streams streams live at once. Starting a stream
+reserves one of the user's numbered StreamSlot rows and stopping it, or its
+encoder dying, releases it. The unique constraints on StreamSlot do the
+locking: of two starts racing for the same slot, or two clicks starting the
+same stream, exactly one insert succeeds, so no duplicate encoder is ever
+launched. A reservation reads at most max_streams rows, however many
+streams the user has.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import state
+from .models import StreamSlot
+
+logger = logging.getLogger(__name__)
+
+# Statuses in which a stream holds its slot
+LIVE_STATUSES = ['starting', 'running', 'stopping']
+
+# Slots of streams that are no longer live are swept this long after they
+# were reserved, in case whatever ended the stream didn't release them
+STALE_AFTER = timedelta(seconds=30)
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+def reserve(stream, max_streams):
+    """
+    Take a free slot for stream and mark it starting, or raise
+    SlotUnavailable if the stream already holds one or all are in use
+    (StreamBusy/InvalidTransition if its status doesn't allow a start).
+    """
+    for _ in range(max_streams + 1):
+        taken = list(StreamSlot.objects.filter(user_id=stream.user_id).values_list('number', 'stream_id'))
+        if any(stream_id == stream.id for _, stream_id in taken):
+            raise SlotUnavailable('Stream is already starting or running')
+        # Also counts slots above a lowered limit, e.g. after a downgrade
+        if len(taken) >= max_streams:
+            raise SlotUnavailable(
+                f'You have reached your stream limit ({max_streams} concurrent streams). '
+                f'Stop a running stream first.'
+            )
+        number = min(set(range(max_streams)) - {number for number, _ in taken})
+        try:
+            with transaction.atomic():
+                slot = StreamSlot.objects.create(user_id=stream.user_id, stream=stream, number=number)
+                state.transition(stream, 'starting')
+        except IntegrityError:
+            continue  # another start got there first; look again
+        return slot
+    raise SlotUnavailable('Could not reserve a stream slot, please try again')
+
+
+def release(stream_ids):
+    """Free the slots held by stream_ids."""
+    return StreamSlot.objects.filter(stream_id__in=stream_ids).delete()[0]
+
+
+def release_stale():
+    """Free slots still held by streams that are no longer live."""
+    stale_ids = list(
+        StreamSlot.objects.filter(reserved_at__lt=timezone.now() - STALE_AFTER)
+        .exclude(stream__status__in=LIVE_STATUSES)
+        .values_list('id', flat=True)
+    )
+    if stale_ids:
+        StreamSlot.objects.filter(id__in=stale_ids).delete()
+        logger.warning(f"Released {len(stale_ids)} stream slots left behind by ended streams")
+    return len(stale_ids)
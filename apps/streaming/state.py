@@ -0,0 +1,213 @@
+"""
+Stream state machine.
+
+Every status change goes through transition() or transition_many(), which
+only allow the moves listed in TRANSITIONS and bump Stream.version. A
+single-stream transition is a compare-and-swap on the version the caller
+read, so of two requests acting on the same stream only the first write
+wins and the other gets StreamBusy instead of silently overwriting it.
+
+Starts and stops, which launch or kill encoders and call YouTube, also run
+under stream_lock(): a short-lived Redis lock per stream, so a second start,
+stop or restart arriving meanwhile is turned away at once rather than
+racing the first one. The holder keeps extending the lock for as long as it
+runs, however long YouTube or S3 take, and a holder that dies lets it expire.
+"""
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+
+import redis
+from django.db.models import F
+from django.utils import timezone
+
+from . import heartbeat
+from .models import Stream
+
+logger = logging.getLogger(__name__)
+
+# status -> statuses it may move to
+TRANSITIONS = {
+    'idle': {'starting'},
+    'starting': {'running', 'stopping', 'error'},
+    'running': {'stopping', 'stopped', 'error'},  # stopped/error: the encoder ended on its own
+    'stopping': {'stopped', 'error'},
+    'stopped': {'starting'},
+    'error': {'starting', 'stopping'},
+}
+
+LOCK_PREFIX = 'stream:lock:'
+# A held lock is extended every LOCK_TTL / 3 seconds, so this only bounds how
+# long a holder that died blocks the stream
+LOCK_TTL = 30
+
+_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class StreamBusy(Exception):
+    """Another request is starting or stopping the stream, or changed it first."""
+
+
+def can_transition(current, to):
+    return to in TRANSITIONS.get(current, ())
+
+
+def sources(to):
+    """Statuses from which a stream may move to `to`."""
+    return [status for status, targets in TRANSITIONS.items() if to in targets]
+
+
+def transition(stream, to, **fields):
+    """
+    Move stream to status `to`, writing `fields` along with it, provided
+    nobody has changed the stream since it was read. Updates the instance
+    in place. Raises InvalidTransition or StreamBusy.
+    """
+    if not can_transition(stream.status, to):
+        raise InvalidTransition(f"Stream {stream.id} cannot go from {stream.status} to {to}")
+    now = timezone.now()
+    updated = Stream.objects.filter(id=stream.id, version=stream.version).update(
+        status=to, version=F('version') + 1, updated_at=now, **fields
+    )
+    if not updated:
+        raise StreamBusy('This stream was changed by another request, please try again')
+    stream.status = to
+    stream.version += 1
+    stream.updated_at = now
+    for name, value in fields.items():
+        setattr(stream, name, value)
+
+
+def transition_many(stream_ids, to, from_statuses=None, **fields):
+    """
+    Move every stream in stream_ids that is in one of from_statuses (by
+    default, any status allowed to move to `to`) to `to` in one UPDATE.
+    Returns the number of streams moved.
+    """
+    allowed = sources(to)
+    if from_statuses is not None:
+        allowed = [status for status in from_statuses if status in allowed]
+    return Stream.objects.filter(id__in=stream_ids, status__in=allowed).update(
+        status=to, version=F('version') + 1, updated_at=timezone.now(), **fields
+    )
+
+
+def fail(stream, message):
+    """
+    Put stream into error with message, unless another request has moved it
+    on in the meantime. Returns True if this call recorded the failure.
+    """
+    try:
+        if stream.status == 'error':
+            return bool(
+                Stream.objects.filter(id=stream.id, version=stream.version).update(error_message=message)
+            )
+        transition(stream, 'error', error_message=message)
+        return True
+    except (InvalidTransition, StreamBusy):
+        return False
+
+
+def lock_key(stream_id):
+    return f"{LOCK_PREFIX}{stream_id}"
+
+
+def acquire_lock(stream_id, ttl=LOCK_TTL):
+    """
+    Take the stream's lock and return its token, or raise StreamBusy. Returns
+    None without locking when Redis is unavailable; the version check still
+    keeps concurrent writes apart.
+    """
+    token = uuid.uuid4().hex
+    try:
+        acquired = heartbeat.get_redis().set(lock_key(stream_id), token, nx=True, px=int(ttl * 1000))
+    except redis.RedisError as e:
+        logger.warning(f"Stream lock unavailable for {stream_id}, continuing without it: {e}")
+        return None
+    if not acquired:
+        raise StreamBusy('This stream is already being started or stopped')
+    return token
+
+
+def locked_stream_ids(stream_ids):
+    """The streams in stream_ids whose lock somebody holds, in one round trip."""
+    stream_ids = list(stream_ids)
+    if not stream_ids:
+        return set()
+    pipe = heartbeat.get_redis().pipeline(transaction=False)
+    for stream_id in stream_ids:
+        pipe.exists(lock_key(stream_id))
+    return {stream_id for stream_id, held in zip(stream_ids, pipe.execute()) if held}
+
+
+def release_lock(stream_id, token):
+    """Release the lock if token still holds it; an expired lock may belong to someone else by now."""
+    if token is None:
+        return
+    try:
+        heartbeat.get_redis().eval(_UNLOCK_SCRIPT, 1, lock_key(stream_id), token)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release stream lock for {stream_id}: {e}")
+
+
+def _extend_locks(locks, ttl, done):
+    while not done.wait(ttl / 3):
+        try:
+            pipe = heartbeat.get_redis().pipeline(transaction=False)
+            for stream_id, token in locks.items():
+                pipe.eval(_EXTEND_SCRIPT, 1, lock_key(stream_id), token, int(ttl * 1000))
+            extended = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to extend stream locks, retrying: {e}")
+            continue
+        for stream_id, ok in zip(list(locks), extended):
+            if not ok:
+                logger.warning(f"Stream lock for {stream_id} expired while held")
+                del locks[stream_id]
+
+
+@contextmanager
+def keep_locks(locks, ttl=LOCK_TTL):
+    """
+    Keep extending the locks in `locks` ({stream_id: token}, as returned by
+    acquire_lock) while the block runs. Releasing them is up to the caller.
+    """
+    held = {stream_id: token for stream_id, token in locks.items() if token is not None}
+    if not held:
+        yield
+        return
+    done = threading.Event()
+    keeper = threading.Thread(target=_extend_locks, args=(held, ttl, done), name='stream-lock-keeper', daemon=True)
+    keeper.start()
+    try:
+        yield
+    finally:
+        done.set()
+        keeper.join()
+
+
+@contextmanager
+def stream_lock(stream_id, ttl=LOCK_TTL):
+    token = acquire_lock(stream_id, ttl)
+    try:
+        with keep_locks({stream_id: token}, ttl):
+            yield
+    finally:
+        release_lock(stream_id, token)
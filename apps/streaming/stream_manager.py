@@ -2,11 +2,12 @@ import subprocess
 import os
 import signal
 from django.conf import settings
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from datetime import datetime, timedelta
 import logging
-import subprocess, os, signal, psutil
+import sys
+from django.utils import timezone
+from . import heartbeat, metrics, process_registry, slots, state
+from .youtube import account_credentials, build_youtube
 logger = logging.getLogger(__name__)
 
 import os
@@ -18,19 +19,38 @@ from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
-import requests
 import tempfile
 
 def download_s3_file(mediafile):
+    import requests
+
     url = mediafile.file.url
-    resp = requests.get(url, stream=True)
+    resp = requests.get(url, stream=True, timeout=settings.EXTERNAL_API_TIMEOUT)
     tmp = tempfile.NamedTemporaryFile(delete=False)
     for chunk in resp.iter_content(chunk_size=1024*1024):
         tmp.write(chunk)
     tmp.close()
+    metrics.inc('stream24_storage_bytes_read_total', os.path.getsize(tmp.name), purpose='encoder')
     return tmp.name
 
 
+def local_media_path(media_file):
+    """A path ffmpeg can read media_file from, downloading it from S3 if needed."""
+    try:
+        return media_file.file.path
+    except NotImplementedError:
+        return download_s3_file(media_file)
+
+
+# x264 preset and video bitrate (kbit/s) per encoding profile; ENCODER_PROFILE
+# picks the one streams use. bench_streaming compares them
+ENCODER_PROFILES = {
+    'light': {'preset': 'ultrafast', 'video_bitrate': 1500},
+    'standard': {'preset': 'veryfast', 'video_bitrate': 3000},
+    'quality': {'preset': 'faster', 'video_bitrate': 4500},
+}
+
+
 def _resolve_binary(requested: str) -> str:
     """
     Resolve the ffmpeg binary to use:
@@ -121,15 +141,7 @@ class StreamManager:
         """Authenticate with YouTube API using stored credentials"""
         try:
             youtube_account = self.stream.youtube_account
-            credentials = Credentials(
-                token=youtube_account.access_token,
-                refresh_token=youtube_account.refresh_token,
-                token_uri='https://oauth2.googleapis.com/token',
-                client_id=settings.GOOGLE_CLIENT_ID,
-                client_secret=settings.GOOGLE_CLIENT_SECRET
-            )
-            
-            self.youtube = build('youtube', 'v3', credentials=credentials)
+            self.youtube = build_youtube(account_credentials(youtube_account))
             return True
         except Exception as e:
             logger.error(f"YouTube authentication failed: {str(e)}")
@@ -201,15 +213,14 @@ class StreamManager:
             self.stream.broadcast_id = broadcast_id
             self.stream.stream_key = stream_key
             self.stream.stream_url = f"{ingestion_address}/{stream_key}"
-            self.stream.save()
+            # Status is left to the state machine, which may have moved on meanwhile
+            self.stream.save(update_fields=['broadcast_id', 'stream_key', 'stream_url', 'updated_at'])
             
             return broadcast_id
             
         except Exception as e:
             logger.error(f"Failed to create broadcast: {str(e)}")
-            self.stream.status = 'error'
-            self.stream.error_message = str(e)
-            self.stream.save()
+            state.fail(self.stream, str(e))
             return None
     
     def start_ffmpeg_stream(self):
@@ -223,7 +234,7 @@ class StreamManager:
             input_list_path = f'/tmp/stream_{self.stream.id}_inputs.txt'
             with open(input_list_path, 'w') as f:
                 for media_file in media_files:
-                    file_path = download_s3_file(mediafile)
+                    file_path = local_media_path(media_file)
                     
                     # If it's audio, create a static image video
                     if media_file.media_type == 'audio':
@@ -236,6 +247,8 @@ class StreamManager:
                         f.write(f"file '{file_path}'\n")
             
             # FFmpeg command for streaming
+            profile = ENCODER_PROFILES[settings.ENCODER_PROFILE]
+            video_bitrate = profile['video_bitrate']
             ffmpeg_cmd = [
                 settings.FFMPEG_PATH,
                 '-re',  # Read input at native frame rate
@@ -244,10 +257,10 @@ class StreamManager:
                 '-safe', '0',
                 '-i', input_list_path,
                 '-c:v', 'libx264',  # Video codec
-                '-preset', 'veryfast',  # Encoding speed
-                '-b:v', '3000k',  # Video bitrate
-                '-maxrate', '3000k',
-                '-bufsize', '6000k',
+                '-preset', profile['preset'],  # Encoding speed
+                '-b:v', f'{video_bitrate}k',  # Video bitrate
+                '-maxrate', f'{video_bitrate}k',
+                '-bufsize', f'{video_bitrate * 2}k',
                 '-pix_fmt', 'yuv420p',
                 '-g', '60',  # GOP size
                 '-c:a', 'aac',  # Audio codec
@@ -257,51 +270,50 @@ class StreamManager:
                 self.stream.stream_url
             ] 
            
-            # Start FFmpeg process
+            # A stop request left for the previous encoder must not stop this one
+            try:
+                heartbeat.cancel_stop(self.stream.id)
+            except Exception as e:
+                logger.warning(f"Failed to clear stop request for stream {self.stream.id}: {e}")
+
+            # Start FFmpeg under the encoder supervisor, which leads the process group
+            # The supervisor reads ffmpeg's stderr itself and records the exit in the
+            # database, so nothing here has to keep pipes open or wait on it.
+            # start_new_session rather than preexec_fn=os.setsid: the stream_start
+            # view runs this on a gthread web worker and bulk starts on pool
+            # threads, and Python code in a child forked from a threaded process
+            # can deadlock before exec
             process = subprocess.Popen(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid,
-                universal_newlines=True
+                [sys.executable, '-m', 'apps.streaming.supervisor', str(self.stream.id), '--'] + ffmpeg_cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+                cwd=settings.BASE_DIR,
             )
-            
-            self.stream.process_id = process.pid
-            self.stream.status = 'running'
-            self.stream.started_at = datetime.now()
-            self.stream.save()
+            process_registry.register(self.stream, process.pid)
+            # Count the stream as alive until the supervisor's own first beat
+            try:
+                heartbeat.beat(self.stream.id, process.pid)
+            except Exception as e:
+                logger.warning(f"Failed to record first heartbeat for stream {self.stream.id}: {e}")
+
+            try:
+                state.transition(self.stream, 'running', started_at=timezone.now())
+            except state.StreamBusy:
+                # Stopped while it was starting; don't leave this encoder behind
+                logger.warning(f"Stream {self.stream.id} changed while starting, stopping its new encoder")
+                process_registry.stop_encoder(self.stream.id)
+                return None
             
             logger.info(f"Stream {self.stream.id} started with PID {process.pid}")
             return process.pid
             
         except Exception as e:
             logger.error(f"Failed to start FFmpeg: {str(e)}")
-            self.stream.status = 'error'
-            self.stream.error_message = str(e)
-            self.stream.save()
+            state.fail(self.stream, str(e))
             return None
     
-    def stop_ffmpeg_gracefully(self, pid):
-        """Stop FFmpeg process group"""
-        try:
-            import sys
-            if sys.platform != 'win32':
-                # Linux/Mac: Kill entire process group
-                os.killpg(os.getpgid(pid), signal.SIGTERM)
-                time.sleep(2)
-                # Force kill if still alive
-                try:
-                    os.killpg(os.getpgid(pid), signal.SIGKILL)
-                except ProcessLookupError:
-                    pass  # Already dead
-            else:
-                # Windows: Use taskkill
-                subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)])
-        
-            return True
-        except Exception as e:
-            logger.error(f"Failed to stop process group: {e}")
-            return False
     '''
     def stop_stream(self):
         """Stop the streaming process"""
@@ -350,17 +362,24 @@ class StreamManager:
         except ProcessLookupError:
             return 'stopped'
     '''
-    def stop_stream(self):
-        """Completely stop FFmpeg and end YouTube broadcast cleanly"""
+    def stop_stream(self, restart=False):
+        """
+        Completely stop FFmpeg and end YouTube broadcast cleanly. Raises
+        state.StreamBusy if another request changed the stream first.
+        restart=True keeps the stream's restart count for the start that follows.
+        """
         try:
-            # 1️⃣ Kill FFmpeg process locally
-            if self.stream.process_id:
-                success = self.stop_ffmpeg_gracefully(self.stream.process_id)
-                if success:
-                    logger.info(f"Stopped FFmpeg process for stream {self.stream.id}")
-                else:
-                    logger.warning(f"Manual termination required for PID {self.stream.process_id}")
-                self.stream.process_id = None
+            started = time.monotonic()
+            if not restart:
+                metrics.forget_restarts([self.stream.id])
+            # So the supervisor reports the encoder's exit as a stop, not a crash
+            if state.can_transition(self.stream.status, 'stopping'):
+                state.transition(self.stream, 'stopping')
+
+            # 1️⃣ Stop the encoder, wherever the registry says it runs; this returns
+            # as soon as ffmpeg has flushed and exited
+            encoder = process_registry.stop_encoder(self.stream.id) or {}
+            encoder_done = time.monotonic()
 
             # 2️⃣ Make sure YouTube API client is ready
             if not hasattr(self, 'youtube') or not self.youtube:
@@ -378,15 +397,34 @@ class StreamManager:
                 except Exception as e:
                     logger.error(f"YouTube broadcast completion failed: {e}")
 
+            broadcast_done = time.monotonic()
+
             # 4️⃣ Update database
-            self.stream.status = 'stopped'
-            self.stream.stopped_at = datetime.now()
-            self.stream.save(update_fields=['status', 'stopped_at', 'process_id'])
+            if encoder.get('remote'):
+                if not encoder['stopped']:
+                    # Its supervisor marks the stream stopped once it exits;
+                    # until then the stream keeps its slot, so nothing starts
+                    # a second encoder next to it
+                    logger.warning(f"Stream {self.stream.id} stays stopping until its encoder on {encoder['remote']} exits")
+                    return True
+                # The remote supervisor may have marked it stopped already
+                self.stream.refresh_from_db(fields=['status', 'version', 'stopped_at', 'updated_at'])
+            if self.stream.status == 'stopping':
+                state.transition(self.stream, 'stopped', stopped_at=timezone.now())
+            slots.release([self.stream.id])
+            logger.info(
+                f"Stopped stream {self.stream.id} in {time.monotonic() - started:.2f}s "
+                f"(encoder {encoder_done - started:.2f}s, broadcast {broadcast_done - encoder_done:.2f}s)"
+            )
             return True
 
+        except state.StreamBusy:
+            raise
         except Exception as e:
-            self.stream.status = 'error'
-            self.stream.error_message = str(e)
-            self.stream.save(update_fields=['status', 'error_message'])
+            state.fail(self.stream, str(e))
             logger.error(f"Error stopping stream {self.stream.id}: {e}")
             return False
+
+    def get_stream_status(self):
+        """Check if the stream is still running, from its heartbeat rather than a local PID"""
+        return 'running' if heartbeat.get_heartbeat(self.stream.id) else 'stopped'
@@ -0,0 +1,248 @@
+"""
+Encoder supervisor.
+
+FFmpeg is not launched directly: it runs under this small process
+(`python -m apps.streaming.supervisor <stream_id> -- ffmpeg ...`), which leads
+the process group so stopping the group stops both. The supervisor sleeps in
+a single event loop until one of three things happens:
+
+* the encoder exits, signalled by its Linux pidfd (or, where pidfds are not
+  available, by its stderr reaching EOF), and is reaped at once;
+* ffmpeg writes to stderr, whose last lines are kept for the exit report;
+* a stop is requested (SIGTERM, or through the heartbeat), or the deadline
+  for a requested stop passes;
+* the next heartbeat is due (see heartbeat.py).
+
+On exit the Stream row and a StreamLog are updated straight away with the
+exit code and stderr tail, so a crash is acted on within milliseconds
+instead of waiting for the next health sweep. Django is set up before the
+encoder starts so that nothing slow stands between the exit and the write.
+"""
+import os
+import re
+import selectors
+import signal
+import subprocess
+import sys
+import time
+from collections import deque
+
+STDERR_TAIL_LINES = 20
+
+_LINE_SPLIT = re.compile(rb'[\r\n]+')
+
+# ffmpeg's status line: "frame= ... bitrate=2987.4kbits/s speed=1.00x"
+_PROGRESS = re.compile(r'bitrate=\s*([\d.]+)kbits/s.*speed=\s*([\d.]+)x')
+
+
+def _open_pidfd(pid):
+    """A pidfd for pid, or None where the platform doesn't support them."""
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _progress(lines):
+    """Bitrate and speed from the latest ffmpeg status line in lines, or None."""
+    for line in reversed(lines):
+        match = _PROGRESS.search(line)
+        if match:
+            return {'bitrate_kbps': float(match.group(1)), 'speed': float(match.group(2))}
+    return None
+
+
+def supervise(stream_id, cmd, stop_timeout):
+    """
+    Run cmd, beating while it is alive. Returns (exit code, last stderr lines,
+    stop timings or None); an encoder killed by a signal is reported as
+    -signum, like Popen.returncode.
+
+    SIGTERM/SIGINT (or a stop requested through the heartbeat) asks ffmpeg to
+    finish by sending 'q' on its stdin, which lets it flush and write the
+    FLV trailer. Only if it is still running stop_timeout seconds later is
+    it killed.
+    """
+    from . import heartbeat
+
+    # Signals only wake the loop below, which then stops the encoder cleanly
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    signal.signal(signal.SIGINT, lambda signum, frame: None)
+
+    child = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    partial = b''
+
+    selector = selectors.DefaultSelector()
+    pidfd = _open_pidfd(child.pid)
+    if pidfd is not None:
+        selector.register(pidfd, selectors.EVENT_READ, 'exit')
+    selector.register(child.stderr, selectors.EVENT_READ, 'stderr')
+    selector.register(wakeup_r, selectors.EVENT_READ, 'signal')
+
+    next_beat = 0
+    stop_started = None
+    killed_at = None
+
+    stop_remote = False
+
+    def request_stop(remote=False):
+        nonlocal stop_started, stop_remote
+        if stop_started is not None:
+            return
+        stop_started = time.monotonic()
+        stop_remote = remote
+        try:
+            child.stdin.write(b'q')
+            child.stdin.close()
+        except OSError:
+            pass  # already exiting
+
+    try:
+        while child.returncode is None:
+            now = time.monotonic()
+            if now >= next_beat:
+                try:
+                    if heartbeat.beat(stream_id, os.getpid(), _progress(tail)):
+                        # Stopped from another node, which can't signal us directly
+                        request_stop(remote=True)
+                except Exception as e:
+                    # A missed beat is recovered on the next one; never kill the stream over it
+                    tail.append(f"[supervisor] heartbeat failed: {e}")
+                next_beat = now + heartbeat.HEARTBEAT_INTERVAL
+
+            wake_at = next_beat
+            if stop_started is not None and killed_at is None:
+                deadline = stop_started + stop_timeout
+                if now >= deadline:
+                    # Didn't finish flushing in time
+                    killed_at = now
+                    child.kill()
+                wake_at = min(wake_at, deadline)
+
+            for key, _ in selector.select(timeout=max(wake_at - time.monotonic(), 0)):
+                if key.data == 'exit':
+                    child.wait()
+                    break
+                if key.data == 'signal':
+                    os.read(wakeup_r, 512)
+                    request_stop()
+                    continue
+                chunk = os.read(child.stderr.fileno(), 65536)
+                if not chunk:
+                    # EOF: the encoder is gone (or closed stderr); reap it
+                    selector.unregister(child.stderr)
+                    child.wait()
+                    break
+                *lines, partial = _LINE_SPLIT.split(partial + chunk)
+                tail.extend(line.decode('utf-8', 'replace').strip() for line in lines if line.strip())
+                partial = partial[-4096:]
+
+        stop = None
+        if stop_started is not None:
+            stop = {
+                'flush': round(time.monotonic() - stop_started, 3),
+                'killed': killed_at is not None,
+                'remote': stop_remote,
+            }
+
+        # Whatever ffmpeg wrote just before dying is usually the reason
+        rest = child.stderr.read() or b''
+        tail.extend(line.decode('utf-8', 'replace').strip() for line in _LINE_SPLIT.split(partial + rest) if line.strip())
+        return child.returncode, list(tail), stop
+    finally:
+        signal.set_wakeup_fd(-1)
+        selector.close()
+        child.stderr.close()
+        for fd in (wakeup_r, wakeup_w):
+            os.close(fd)
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def record_exit(stream_id, returncode, stderr_tail, stop=None):
+    """
+    Update the Stream and write a StreamLog for an encoder that just exited.
+    A stream still marked running ended on its own: status becomes 'stopped'
+    for a clean exit and 'error' otherwise. A stop requested from another
+    node is completed here (stopping -> stopped), since the node that asked
+    can't see the exit; other stops are only logged, with how long the
+    encoder took to finish. The stream is only touched while this
+    supervisor is still its registered encoder, never once a restart has
+    replaced it.
+    """
+    from django.conf import settings
+    from django.utils import timezone
+
+    from . import slots, state
+    from .models import EncoderProcess, StreamLog
+
+    if stop is not None:
+        if stop['killed']:
+            outcome = f"did not finish within {stop['flush']:.2f}s and was killed"
+        else:
+            outcome = f"finished cleanly {stop['flush']:.2f}s after the stop request"
+    elif returncode < 0:
+        outcome = f"was killed by signal {-returncode}"
+    else:
+        outcome = f"exited with code {returncode}"
+    crashed = returncode != 0 and stop is None
+    detail = '\n'.join(stderr_tail[-5:])
+    message = f"Encoder {outcome}" + (f": {detail}" if detail and crashed else '')
+
+    now = timezone.now()
+    # Only this supervisor's own row; a restart may already have registered a new one
+    current = EncoderProcess.objects.filter(stream_id=stream_id, node=settings.NODE_ID, pid=os.getpid()).delete()[0]
+    updated = 0
+    if current:
+        updated = state.transition_many(
+            [stream_id], 'error' if crashed else 'stopped',
+            from_statuses=['running', 'stopping'] if stop and stop['remote'] else ['running'],
+            error_message=message if crashed else '',
+            stopped_at=now,
+        )
+    if updated:
+        # Ended on its own or stopped from another node; a local stop releases the slot itself
+        slots.release([stream_id])
+        level = 'ERROR' if crashed else 'INFO'
+    else:
+        level = 'WARNING' if stop and stop['killed'] else 'INFO'
+        if stop is None:
+            message = f"{message} after the stream was stopped"
+    StreamLog.objects.create(stream_id=stream_id, level=level, message=message)
+    return updated
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 3 or argv[1] != '--':
+        print("usage: python -m apps.streaming.supervisor <stream_id> -- <command> [args...]", file=sys.stderr)
+        return 2
+    stream_id, cmd = argv[0], argv[2:]
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+    import django
+    django.setup()
+    from . import heartbeat
+
+    from django.conf import settings
+
+    returncode, stderr_tail, stop = supervise(stream_id, cmd, settings.ENCODER_STOP_TIMEOUT)
+    try:
+        record_exit(stream_id, returncode, stderr_tail, stop)
+    finally:
+        # Cleared only after the database knows, so the health sweep never
+        # reports a generic death for an exit that is being recorded
+        try:
+            heartbeat.clear(stream_id, pid=os.getpid())
+        except Exception:
+            pass
+    # Shell convention for a child killed by a signal
+    return 128 - returncode if returncode < 0 else returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
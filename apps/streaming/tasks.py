@@ -1,141 +1,218 @@
-from celery import shared_task
+from celery import chain, shared_task
+from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 from datetime import timedelta
 import logging
 import os
 import signal
 
+from apps.payments.entitlements import get_entitlement
+
+from . import heartbeat, metrics, slots, state
+from .bulk import start_streams, stop_streams
 from .models import Stream, StreamLog
 from .stream_manager import StreamManager
 
 logger = logging.getLogger(__name__)
 
+# Seconds between health sweeps; with the heartbeat TTL this bounds how long
+# a dead stream can still show as running
+HEALTH_CHECK_INTERVAL = 10
+
+# Seconds between a restart's stop and its start, so YouTube sees the old
+# broadcast end before the new one begins
+RESTART_DELAY = 5
+
+# A stream still starting this long after its last change, with no encoder
+# heartbeat and nobody holding its lock, was left behind by a start whose
+# process died; its lock has long expired by then
+STALE_START_AFTER = timedelta(minutes=2)
+
 
 @shared_task
 def check_stream_health():
     """
     Periodic task to check health of all running streams
-    Runs every 5 minutes via Celery Beat
+    Runs every HEALTH_CHECK_INTERVAL seconds via Celery Beat; a running stream
+    whose encoder heartbeat has expired in Redis is marked as dead, and so is
+    a start that was abandoned halfway
     """
-    running_streams = Stream.objects.filter(status__in=['running', 'starting'])
-    
+    running_streams = list(Stream.objects.filter(status__in=['running', 'starting']))
+    now = timezone.now()
+    try:
+        alive = heartbeat.live_stream_ids([stream.id for stream in running_streams])
+        stale_starts = [
+            stream for stream in running_streams
+            if stream.status == 'starting' and stream.id not in alive and stream.updated_at < now - STALE_START_AFTER
+        ]
+        locked = state.locked_stream_ids(stream.id for stream in stale_starts)
+    except Exception as e:
+        # Without Redis every stream would look dead; check again next sweep
+        logger.error(f"Stream health check skipped, heartbeats unavailable: {str(e)}")
+        return f"Skipped: {str(e)}"
+
+    dead_ids = []
+    logs = []
+
     for stream in running_streams:
-        try:
-            manager = StreamManager(stream)
-            status = manager.get_stream_status()
-            
-            # If process is dead but status is running, update it
-            if status == 'stopped' and stream.status == 'running':
-                stream.status = 'error'
-                stream.error_message = 'Stream process died unexpectedly'
-                stream.stopped_at = timezone.now()
-                stream.process_id = None
-                stream.save()
-                
-                StreamLog.objects.create(
+        # If the heartbeat expired but status is running, update it
+        if stream.id not in alive and stream.status == 'running':
+            dead_ids.append(stream.id)
+            logs.append(StreamLog(
+                stream=stream,
+                level='ERROR',
+                message='Stream process died unexpectedly - auto-detected'
+            ))
+            logger.error(f"Stream {stream.id} process died unexpectedly")
+
+        elif stream.id in alive and stream.started_at:
+            running_duration = now - stream.started_at
+
+            # Log every 6 hours that stream is healthy
+            if running_duration.total_seconds() % 21600 < HEALTH_CHECK_INTERVAL:
+                logs.append(StreamLog(
                     stream=stream,
-                    level='ERROR',
-                    message='Stream process died unexpectedly - auto-detected'
-                )
-                
-                logger.error(f"Stream {stream.id} process died unexpectedly")
-            
-            # Check if stream has been running too long without issues (health check)
-            elif status == 'running' and stream.started_at:
-                running_duration = timezone.now() - stream.started_at
-                
-                # Log every 6 hours that stream is healthy
-                if running_duration.total_seconds() % 21600 < 300:  # Within 5 min window
-                    StreamLog.objects.create(
-                        stream=stream,
-                        level='INFO',
-                        message=f'Stream healthy - running for {running_duration}'
-                    )
-                    
-        except Exception as e:
-            logger.error(f"Error checking stream {stream.id}: {str(e)}")
-            StreamLog.objects.create(
+                    level='INFO',
+                    message=f'Stream healthy - running for {running_duration}'
+                ))
+
+    # One UPDATE and one INSERT for the whole sweep instead of two writes per stream
+    if dead_ids:
+        state.transition_many(
+            dead_ids, 'error', from_statuses=['running'],
+            error_message='Stream process died unexpectedly',
+            stopped_at=now,
+        )
+    # Rare, so one compare-and-swap each; a start that picked the stream up
+    # again since it was read wins
+    for stream in stale_starts:
+        if stream.id not in locked and state.fail(stream, 'Stream start was interrupted'):
+            logs.append(StreamLog(
                 stream=stream,
                 level='ERROR',
-                message=f'Health check failed: {str(e)}'
-            )
-    
-    logger.info(f"Checked health of {running_streams.count()} streams")
-    return f"Checked {running_streams.count()} streams"
+                message='Stream start was interrupted - auto-detected'
+            ))
+            logger.error(f"Stream {stream.id} start was interrupted")
+    StreamLog.objects.bulk_create(logs)
+    metrics.forget_restarts(dead_ids + [stream.id for stream in stale_starts if stream.status == 'error'])
+    # Frees the dead streams' slots along with any a crash left behind
+    slots.release_stale()
+
+    logger.info(f"Checked health of {len(running_streams)} streams")
+    return f"Checked {len(running_streams)} streams"
 
 
 @shared_task
 def cleanup_old_logs():
     """
-    Clean up stream logs older than 30 days
-    Runs weekly via Celery Beat
+    Archive stream logs older than 30 days, then remove them from the live table
+    Runs daily via Celery Beat; on PostgreSQL this drops whole daily
+    partitions and creates the ones for the coming week
     """
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    deleted_count, _ = StreamLog.objects.filter(created_at__lt=thirty_days_ago).delete()
-    
-    logger.info(f"Cleaned up {deleted_count} old log entries")
-    return f"Deleted {deleted_count} old logs"
+    from .log_archive import archive_logs_before
+    from .log_retention import expire_logs, start_of_day
 
+    # Whole UTC days, so archiving and partition drops cover exactly the same rows
+    cutoff = start_of_day(timezone.now() - timedelta(days=30))
+    segments, archived_count = archive_logs_before(cutoff)
+    dropped, deleted_count = expire_logs(cutoff)
 
-@shared_task
+    logger.info(
+        f"Cleaned up old logs: archived {archived_count} rows into {segments} segments, "
+        f"dropped {len(dropped)} partitions, deleted {deleted_count} rows"
+    )
+    return f"Archived {archived_count} logs, dropped {len(dropped)} log partitions, deleted {deleted_count} old logs"
+
+
+def _start_interrupted(stream):
+    """Whether a starting stream has no encoder, i.e. the start that set it starting died."""
+    try:
+        return heartbeat.get_heartbeat(stream.id) is None
+    except Exception as e:
+        logger.warning(f"Could not read heartbeat of stream {stream.id}: {str(e)}")
+        return False
+
+
+# Stream control tasks are acknowledged only once they have run
+# (acks_late), so one lost with its worker is redelivered rather than
+# dropped; the slots and stream locks make running one twice harmless, and
+# a redelivered start picks up a stream its first delivery left starting
+@shared_task(acks_late=True)
 def start_stream_async(stream_id):
     """
     Async task to start a stream
     """
     try:
         stream = Stream.objects.get(id=stream_id)
-        manager = StreamManager(stream)
-        
-        # Create YouTube broadcast
-        broadcast_id = manager.create_broadcast()
-        if not broadcast_id:
-            raise Exception("Failed to create YouTube broadcast")
-        
-        # Start FFmpeg streaming
-        process_id = manager.start_ffmpeg_stream()
-        if not process_id:
-            raise Exception("Failed to start streaming process")
-        
-        StreamLog.objects.create(
-            stream=stream,
-            level='INFO',
-            message='Stream started successfully via async task'
-        )
-        
-        return f"Stream {stream_id} started successfully"
-        
     except Stream.DoesNotExist:
         logger.error(f"Stream {stream_id} not found")
         return f"Stream {stream_id} not found"
-    except Exception as e:
-        logger.error(f"Failed to start stream {stream_id}: {str(e)}")
-        
-        try:
-            stream = Stream.objects.get(id=stream_id)
-            stream.status = 'error'
-            stream.error_message = str(e)
-            stream.save()
-            
-            StreamLog.objects.create(
-                stream=stream,
-                level='ERROR',
-                message=f'Failed to start stream: {str(e)}'
-            )
-        except:
-            pass
-        
-        return f"Failed to start stream: {str(e)}"
 
+    entitlement = get_entitlement(stream.user_id)
+    if not entitlement:
+        return f"Stream {stream_id} not started: no active subscription"
 
-@shared_task
-def stop_stream_async(stream_id):
+    try:
+        with state.stream_lock(stream.id):
+            stream.refresh_from_db()
+            if stream.status == 'starting' and _start_interrupted(stream):
+                # Nobody else is starting it while this task holds the lock, so
+                # the start that left it starting died, most likely an earlier
+                # delivery of this task
+                logger.warning(f"Stream {stream_id} was left starting by an interrupted start, starting it again")
+                state.fail(stream, 'Stream start was interrupted')
+                slots.release([stream.id])
+
+            try:
+                slots.reserve(stream, entitlement.max_streams)
+            except (slots.SlotUnavailable, state.InvalidTransition) as e:
+                logger.warning(f"Stream {stream_id} not started: {str(e)}")
+                return f"Stream {stream_id} not started: {str(e)}"
+
+            try:
+                manager = StreamManager(stream)
+
+                # Create YouTube broadcast
+                broadcast_id = manager.create_broadcast()
+                if not broadcast_id:
+                    raise Exception("Failed to create YouTube broadcast")
+
+                # Start FFmpeg streaming
+                process_id = manager.start_ffmpeg_stream()
+                if not process_id:
+                    raise Exception("Failed to start streaming process")
+            except Exception as e:
+                logger.error(f"Failed to start stream {stream_id}: {str(e)}")
+                state.fail(stream, str(e))
+                slots.release([stream.id])
+                StreamLog.objects.create(
+                    stream=stream,
+                    level='ERROR',
+                    message=f'Failed to start stream: {str(e)}'
+                )
+                return f"Failed to start stream: {str(e)}"
+    except state.StreamBusy as e:
+        logger.warning(f"Stream {stream_id} not started: {str(e)}")
+        return f"Stream {stream_id} not started: {str(e)}"
+
+    StreamLog.objects.create(
+        stream=stream,
+        level='INFO',
+        message='Stream started successfully via async task'
+    )
+    return f"Stream {stream_id} started successfully"
+
+
+@shared_task(acks_late=True)
+def stop_stream_async(stream_id, restart=False):
     """
-    Async task to stop a stream
+    Async task to stop a stream; restart=True when a start follows
     """
     try:
         stream = Stream.objects.get(id=stream_id)
-        manager = StreamManager(stream)
-        manager.stop_stream()
+        with state.stream_lock(stream.id):
+            manager = StreamManager(stream)
+            manager.stop_stream(restart=restart)
         
         StreamLog.objects.create(
             stream=stream,
@@ -153,24 +230,84 @@ def stop_stream_async(stream_id):
         return f"Failed to stop stream: {str(e)}"
 
 
-@shared_task
+@shared_task(acks_late=True)
 def restart_stream_async(stream_id):
     """
-    Async task to restart a stream
+    Async task to restart a stream: queues the stop, then the start
+    RESTART_DELAY seconds after the stop finishes, without holding a worker
+    """
+    metrics.count_restart(stream_id)
+    chain(
+        stop_stream_async.si(stream_id, restart=True),
+        start_stream_async.si(stream_id).set(countdown=RESTART_DELAY),
+    ).apply_async()
+    return f"Stream {stream_id} restart queued"
+
+
+@shared_task
+def generate_thumbnail_renditions(model_label, pk):
+    """
+    Generate resized thumbnail renditions for a MediaFile or Stream
+    Queued lazily the first time a page asks for a missing rendition
     """
+    from django.apps import apps
+    from .thumbnails import generate_renditions
+
     try:
-        # Stop the stream first
-        stop_result = stop_stream_async(stream_id)
-        
-        # Wait a bit
-        import time
-        time.sleep(5)
-        
-        # Start it again
-        start_result = start_stream_async(stream_id)
-        
-        return f"Stream {stream_id} restarted: Stop={stop_result}, Start={start_result}"
-        
+        model = apps.get_model(model_label)
+        instance = model.objects.get(pk=pk)
+        generate_renditions(instance)
+        return f"Generated thumbnail renditions for {model_label} {pk}"
+
+    except ObjectDoesNotExist:
+        logger.warning(f"{model_label} {pk} not found for thumbnail renditions")
+        return f"{model_label} {pk} not found"
     except Exception as e:
-        logger.error(f"Failed to restart stream {stream_id}: {str(e)}")
-        return f"Failed to restart stream: {str(e)}"
+        logger.error(f"Failed to generate thumbnail renditions for {model_label} {pk}: {str(e)}")
+        return f"Failed to generate renditions: {str(e)}"
+
+
+@shared_task(acks_late=True)
+def end_lost_broadcasts(stream_ids):
+    """
+    Mark the YouTube broadcasts of streams whose encoder was lost as complete
+    Queued by the encoder reconciliation when a worker starts
+    """
+    streams = Stream.objects.filter(id__in=stream_ids).exclude(broadcast_id='').select_related('youtube_account')
+    ended = 0
+    for stream in streams:
+        manager = StreamManager(stream)
+        if not manager.authenticate_youtube():
+            continue
+        try:
+            manager.youtube.liveBroadcasts().transition(
+                broadcastStatus='complete',
+                id=stream.broadcast_id,
+                part='status'
+            ).execute()
+            ended += 1
+        except Exception as e:
+            logger.error(f"Failed to end broadcast of lost stream {stream.id}: {str(e)}")
+    return f"Ended {ended} of {len(stream_ids)} lost broadcasts"
+
+
+@shared_task(acks_late=True, ignore_result=False)
+def bulk_start_streams(stream_ids):
+    """
+    Start many streams at once, e.g. from an admin action
+    The aggregate result is kept for whoever queued the job to check
+    """
+    return start_streams(stream_ids)
+
+
+@shared_task(acks_late=True, ignore_result=False)
+def stop_user_streams(user_ids, reason='Stream stopped', level='INFO'):
+    """
+    Stop every active stream of the given users as one bulk operation
+    The aggregate result is kept for whoever queued the job to check
+    """
+    stream_ids = list(
+        Stream.objects.filter(user_id__in=user_ids, status__in=['running', 'starting'])
+        .values_list('id', flat=True)
+    )
+    return stop_streams(stream_ids, reason=reason, level=level)
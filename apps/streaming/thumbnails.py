@@ -0,0 +1,159 @@
+"""
+Resized renditions of uploaded thumbnails (MediaFile.thumbnail, Stream.thumbnail).
+
+Uploads are stored untouched; the renditions below are generated in the
+background the first time a page asks for them and saved under content-hash
+names in the 'renditions' storage, served with an immutable cache header by
+nginx from local disk, or from S3 under an unsigned URL in production. Only the
+media-processing worker decodes images; Pillow is imported there, on first use.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.utils.functional import LazyObject
+
+from apps.accounts import fragments
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'uploads/renditions/'
+
+# name -> (width, height, jpeg quality)
+RENDITIONS = {
+    'list': (160, 120, 80),       # media library rows (shown at 80x60, 2x for HiDPI)
+    'preview': (640, 360, 82),    # stream detail page
+    'youtube': (1280, 720, 90),   # thumbnails.set upload
+}
+
+# YouTube rejects custom thumbnails larger than 2 MB
+YOUTUBE_MAX_BYTES = 2 * 1024 * 1024
+
+# Don't enqueue the same generation job on every page render while it is
+# pending; keyed on the upload too, so a replaced thumbnail is queued at once
+ENQUEUE_DEBOUNCE_SECONDS = 300
+
+
+class RenditionStorage(LazyObject):
+    # Built on first use, so S3 client libraries aren't imported at boot
+    def _setup(self):
+        self._wrapped = storages['renditions']
+
+
+rendition_storage = RenditionStorage()
+
+
+def _render(source, rendition):
+    """Return JPEG bytes for one rendition of an open PIL image."""
+    from PIL import Image, ImageOps
+
+    width, height, quality = RENDITIONS[rendition]
+    image = ImageOps.fit(source, (width, height), Image.LANCZOS)
+
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+        data = buffer.getvalue()
+        if rendition != 'youtube' or len(data) <= YOUTUBE_MAX_BYTES or quality <= 40:
+            return data
+        quality -= 10
+
+
+def _open_source(field_file, size):
+    """Open an uploaded image for resizing, decoding JPEGs at reduced scale."""
+    from PIL import Image, ImageOps
+
+    with field_file.open('rb') as fh:
+        data = fh.read()
+    metrics.inc('stream24_storage_bytes_read_total', len(data), purpose='thumbnail')
+    image = Image.open(io.BytesIO(data))
+    # Lets the JPEG decoder skip most of a multi-MB phone photo
+    image.draft('RGB', size)
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def _save_rendition(data, rendition):
+    """Store rendition bytes under a content-hash name and return the name."""
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    name = f"{RENDITION_DIR}{digest}-{rendition}.jpg"
+    if not rendition_storage.exists(name):
+        name = rendition_storage.save(name, ContentFile(data))
+    return name
+
+
+def generate_renditions(instance, names=None):
+    """
+    Generate the requested renditions (all by default) for instance.thumbnail,
+    persist the name map on instance.thumbnail_renditions and return it.
+    """
+    field_file = instance.thumbnail
+    if not field_file:
+        return {}
+
+    names = list(names or RENDITIONS)
+    renditions = dict(instance.thumbnail_renditions or {})
+    if renditions.get('source') != field_file.name:
+        renditions = {'source': field_file.name}
+
+    largest = max((RENDITIONS[n][0], RENDITIONS[n][1]) for n in names)
+    source = _open_source(field_file, largest)
+    for name in names:
+        renditions[name] = _save_rendition(_render(source, name), name)
+
+    instance.thumbnail_renditions = renditions
+    type(instance).objects.filter(pk=instance.pk).update(thumbnail_renditions=renditions)
+    # update() sends no post_save, so the cached media list would keep
+    # showing the original upload
+    fragments.bump(instance.user_id)
+    return renditions
+
+
+def get_rendition_name(instance, rendition):
+    """Return the stored rendition name, or None if it has not been generated yet."""
+    renditions = instance.thumbnail_renditions or {}
+    if not instance.thumbnail or renditions.get('source') != instance.thumbnail.name:
+        return None
+    return renditions.get(rendition)
+
+
+def rendition_url(instance, rendition):
+    """
+    URL of a rendition for templates. Falls back to the original upload and
+    queues generation in the background when the rendition doesn't exist yet.
+    """
+    if not instance.thumbnail:
+        return ''
+
+    name = get_rendition_name(instance, rendition)
+    metrics.inc('stream24_thumbnail_rendition_lookups_total', result='hit' if name else 'miss')
+    if name:
+        return rendition_storage.url(name)
+
+    label = instance._meta.label_lower
+    source = hashlib.sha256(instance.thumbnail.name.encode()).hexdigest()[:16]
+    if cache.add(f"thumbnail-renditions:{label}:{instance.pk}:{source}", 1, ENQUEUE_DEBOUNCE_SECONDS):
+        from .tasks import generate_thumbnail_renditions
+        try:
+            generate_thumbnail_renditions.delay(label, str(instance.pk))
+        except Exception as e:
+            logger.warning(f"Could not queue thumbnail renditions for {label} {instance.pk}: {e}")
+    return instance.thumbnail.url
+
+
+def read_rendition(instance, rendition):
+    """Return rendition bytes, generating the rendition synchronously if needed."""
+    name = get_rendition_name(instance, rendition)
+    if not name or not rendition_storage.exists(name):
+        name = generate_renditions(instance, [rendition])[rendition]
+    with rendition_storage.open(name, 'rb') as fh:
+        data = fh.read()
+    metrics.inc('stream24_storage_bytes_read_total', len(data), purpose='thumbnail')
+    return data
@@ -18,6 +18,7 @@ urlpatterns = [
     # Media
     path('media/', views.media_list_view, name='media_list'),
     path('media/upload/', views.media_upload_view, name='media_upload'),
+    path('media/<int:media_id>/file/', views.media_file_view, name='media_file'),
     path('media/delete/<int:media_id>/', views.media_delete_view, name='media_delete'),
     path('media/reorder/', views.media_reorder_view, name='media_reorder'),
 
@@ -1,54 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from django.http import HttpResponse, JsonResponse
 from django.conf import settings
 from datetime import datetime, timedelta
+import logging
 import os
 from .models import Stream, MediaFile, StreamLog
+from apps.accounts import fragments
 from apps.accounts.models import YouTubeAccount
-from apps.payments.models import Subscription
+from apps.payments.entitlements import get_entitlement
+from . import media_delivery, metrics, slots, state
 from .stream_manager import StreamManager
+from .thumbnails import read_rendition
+from .youtube import account_credentials, build_youtube, jpeg_upload, oauth_flow
 import json
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+from django.db.models import Case, IntegerField, Sum, Value, When
+
+logger = logging.getLogger(__name__)
 
 # NEW: Helper function to get user's total storage used
 def get_user_storage_usage(user):
     """Calculate total storage used by user in bytes"""
-    total_size = 0
-    media_files = MediaFile.objects.filter(user=user)
-    for media in media_files:
-        if media.file:
-            try:
-                total_size += media.file.size
-            except:
-                pass
-    return total_size
+    # file_size is recorded at upload, so this never has to stat files in storage
+    total_size = MediaFile.objects.filter(user=user).aggregate(total=Sum('file_size'))['total']
+    return total_size or 0
 
 # NEW: Helper function to check if user has storage available
 def has_storage_available(user, file_size):
     """Check if user has storage available for new file"""
-    subscription = Subscription.objects.filter(
-        user=user,
-        is_active=True,
-        status='active'
-    ).first()
+    entitlement = get_entitlement(user)
 
-    if not subscription:
+    if not entitlement:
         return False, 0, 0
 
-    current_usage = get_user_storage_usage(user)
-    available_storage = subscription.storage_limit - current_usage
-
-    if file_size > available_storage:
-        return False, current_usage, subscription.storage_limit
-
-    return True, current_usage, subscription.storage_limit
+    return entitlement.has_storage_for(file_size), entitlement.storage_used, entitlement.storage_limit
 
 # NEW: Convert bytes to readable format
 def format_bytes(bytes_size):
@@ -59,37 +48,86 @@ def format_bytes(bytes_size):
         bytes_size /= 1024
     return f"{bytes_size:.2f} TB"
 
+# Spacing between media sequence numbers, so moving one item only rewrites that item
+SEQUENCE_GAP = 1024
+
+def _apply_sequences(user, sequences):
+    """Write {media_id: sequence} for the user's media as a single CASE update"""
+    if not sequences:
+        return 0
+    whens = [When(id=media_id, then=Value(seq)) for media_id, seq in sequences.items()]
+    updated = MediaFile.objects.filter(user=user, id__in=sequences.keys()).update(
+        sequence=Case(*whens, output_field=IntegerField())
+    )
+    # The cached media list shows the old order
+    fragments.bump(user.id)
+    return updated
+
+def _renumber_sequences(user, ordered_ids):
+    """Spread the given order out to SEQUENCE_GAP steps, writing only rows that change"""
+    current = dict(MediaFile.objects.filter(user=user, id__in=ordered_ids).values_list('id', 'sequence'))
+    wanted = {media_id: (index + 1) * SEQUENCE_GAP for index, media_id in enumerate(ordered_ids) if media_id in current}
+    return _apply_sequences(user, {media_id: seq for media_id, seq in wanted.items() if current[media_id] != seq})
+
+def _move_media(user, media_id, after_id):
+    """
+    Place media_id directly after after_id (or first when after_id is None).
+    Takes the midpoint of the neighbouring sequence numbers; only when there is
+    no room left between them is the whole library renumbered.
+    """
+    rows = list(
+        MediaFile.objects.select_for_update()
+        .filter(user=user)
+        .order_by('sequence', 'created_at')
+        .values_list('id', 'sequence')
+    )
+    ids = [row_id for row_id, _ in rows]
+    if media_id not in ids or (after_id is not None and after_id not in ids):
+        raise MediaFile.DoesNotExist("Unknown media file")
+
+    rows = [row for row in rows if row[0] != media_id]
+    position = 0 if after_id is None else [row_id for row_id, _ in rows].index(after_id) + 1
+
+    lower = rows[position - 1][1] if position > 0 else 0
+    if position < len(rows):
+        upper = rows[position][1]
+    else:
+        upper = lower + 2 * SEQUENCE_GAP
+
+    if upper - lower > 1:
+        return _apply_sequences(user, {media_id: (lower + upper) // 2})
+
+    ordered_ids = [row_id for row_id, _ in rows]
+    ordered_ids.insert(position, media_id)
+    return _renumber_sequences(user, ordered_ids)
+
 @login_required
 @require_POST
 def media_reorder_view(request):
+    """
+    Reorder the media library in one transaction.
+    Accepts either {"move": {"id": 5, "after": 3}} for a single drag ("after": null
+    moves to the top) or the full {"order": [{"id": 5, "sequence": 0}, ...]} list.
+    """
     try:
         data = json.loads(request.body)
-        order = data.get('order', [])
-        for item in order:
-            media_id = item['id']
-            sequence = item['sequence']
-            MediaFile.objects.filter(id=media_id, user=request.user).update(sequence=sequence)
+        with transaction.atomic():
+            if 'move' in data:
+                move = data['move']
+                after_id = move.get('after')
+                _move_media(request.user, int(move['id']), int(after_id) if after_id is not None else None)
+            else:
+                order = sorted(data.get('order', []), key=lambda item: int(item['sequence']))
+                _renumber_sequences(request.user, [int(item['id']) for item in order])
         return JsonResponse({'status': 'success'})
     except Exception as e:
-        print("Error reordering media:", e)
+        logger.error(f"Error reordering media: {e}")
         return JsonResponse({'status': 'error'}, status=400)
 
 @login_required
 def connect_youtube(request):
     """Initiate YouTube OAuth flow"""
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": settings.GOOGLE_CLIENT_ID,
-                "client_secret": settings.GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [settings.GOOGLE_REDIRECT_URI],
-            }
-        },
-        scopes=settings.GOOGLE_SCOPES,
-        redirect_uri=settings.GOOGLE_REDIRECT_URI
-    )
+    flow = oauth_flow()
 
     authorization_url, state = flow.authorization_url(
         access_type='offline',
@@ -105,26 +143,16 @@ def oauth_callback(request):
     """Handle YouTube OAuth callback"""
     try:
         state = request.session.get('oauth_state')
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": settings.GOOGLE_CLIENT_ID,
-                    "client_secret": settings.GOOGLE_CLIENT_SECRET,
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "redirect_uris": [settings.GOOGLE_REDIRECT_URI],
-                }
-            },
-            scopes=settings.GOOGLE_SCOPES,
-            state=state,
-            redirect_uri=settings.GOOGLE_REDIRECT_URI
-        )
+        flow = oauth_flow(state=state)
 
-        flow.fetch_token(authorization_response=request.build_absolute_uri())
+        flow.fetch_token(
+            authorization_response=request.build_absolute_uri(),
+            timeout=settings.EXTERNAL_API_TIMEOUT,
+        )
         credentials = flow.credentials
 
         # Get channel info
-        youtube = build('youtube', 'v3', credentials=credentials)
+        youtube = build_youtube(credentials)
         channel_response = youtube.channels().list(
             part='snippet,contentDetails',
             mine=True
@@ -165,27 +193,12 @@ def stream_list(request):
 def stream_create(request):
     """Create a new stream"""
     # Check subscription
-    subscription = Subscription.objects.filter(
-        user=request.user,
-        is_active=True
-    ).first()
+    entitlement = get_entitlement(request.user)
 
-    if not subscription:
+    if not entitlement:
         messages.error(request, 'You need an active subscription to create streams')
         return redirect('subscribe')
 
-    # STRONG LIMIT CHECK
-    forbidden_statuses = ['running','stopped', 'starting', 'scheduled']
-    active_streams = Stream.objects.filter(
-        user=request.user,
-        status__in=forbidden_statuses
-    ).count()
-
-    if active_streams >= subscription.max_streams:
-        messages.error(request, f'You have reached your stream limit ({subscription.max_streams} streams). '
-                      f'This includes all running, starting, and scheduled streams.')
-        return redirect('stream_list')
-
     # Check YouTube connection
     youtube_accounts = YouTubeAccount.objects.filter(user=request.user, is_active=True)
     if not youtube_accounts.exists():
@@ -227,23 +240,25 @@ def stream_create(request):
     media_files = MediaFile.objects.filter(user=request.user)
 
     # NEW: Get storage info for context
-    current_usage = get_user_storage_usage(request.user)
-    available_storage = subscription.storage_limit - current_usage
-
     context = {
         'youtube_accounts': youtube_accounts,
         'media_files': media_files,
-        'storage_usage': format_bytes(current_usage),
-        'storage_limit': format_bytes(subscription.storage_limit),
-        'storage_available': format_bytes(available_storage),
+        'storage_usage': format_bytes(entitlement.storage_used),
+        'storage_limit': format_bytes(entitlement.storage_limit),
+        'storage_available': format_bytes(entitlement.storage_limit - entitlement.storage_used),
     }
     return render(request, 'streaming/stream_create.html', context)
 
 @login_required
 def stream_detail(request, stream_id):
     """View stream details"""
-    stream = get_object_or_404(Stream, id=stream_id, user=request.user)
-    logs = stream.logs.all()[:50]
+    stream = get_object_or_404(
+        Stream.objects.select_related('youtube_account', 'encoder').prefetch_related('media_files'),
+        id=stream_id,
+        user=request.user
+    )
+    # The lower bound lets PostgreSQL skip log partitions older than the stream
+    logs = stream.logs.filter(created_at__gte=stream.created_at)[:50]
     context = {
         'stream': stream,
         'logs': logs,
@@ -255,14 +270,35 @@ def stream_start(request, stream_id):
     """Start a stream"""
     stream = get_object_or_404(Stream, id=stream_id, user=request.user)
 
-    if stream.status == 'running':
+    if stream.status in slots.LIVE_STATUSES:
         messages.warning(request, 'Stream is already running')
         return redirect('stream_detail', stream_id=stream.id)
 
+    entitlement = get_entitlement(request.user)
+    if not entitlement:
+        messages.error(request, 'You need an active subscription to start streams')
+        return redirect('subscribe')
+
+    try:
+        # One start or stop of a stream at a time; a second click is answered at once
+        with state.stream_lock(stream.id):
+            _start_stream(request, stream, entitlement)
+    except state.StreamBusy as e:
+        messages.warning(request, str(e))
+
+    return redirect('stream_detail', stream_id=stream.id)
+
+def _start_stream(request, stream, entitlement):
+    """Reserve a slot for stream and start it; the caller holds the stream lock"""
+    # Claims one of the user's concurrent-stream slots; a start over the
+    # limit fails here, before anything is launched
     try:
-        stream.status = 'starting'
-        stream.save()
+        slots.reserve(stream, entitlement.max_streams)
+    except (slots.SlotUnavailable, state.InvalidTransition) as e:
+        messages.error(request, str(e))
+        return
 
+    try:
         manager = StreamManager(stream)
 
         # Create YouTube broadcast
@@ -299,9 +335,8 @@ def stream_start(request, stream_id):
         messages.success(request, 'Stream started successfully!')
 
     except Exception as e:
-        stream.status = 'error'
-        stream.error_message = str(e)
-        stream.save()
+        state.fail(stream, str(e))
+        slots.release([stream.id])
         StreamLog.objects.create(
             stream=stream,
             level='ERROR',
@@ -309,28 +344,20 @@ def stream_start(request, stream_id):
         )
         messages.error(request, f'Failed to start stream: {str(e)}')
 
-    return redirect('stream_detail', stream_id=stream.id)
 
 def upload_thumbnail_to_youtube(stream, video_id):
     """Upload thumbnail to YouTube using the Thumbnails.set API endpoint"""
     youtube_account = stream.youtube_account
 
     # Build credentials
-    credentials = Credentials(
-        token=youtube_account.access_token,
-        refresh_token=youtube_account.refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=settings.GOOGLE_CLIENT_ID,
-        client_secret=settings.GOOGLE_CLIENT_SECRET,
-        scopes=settings.GOOGLE_SCOPES
-    )
+    credentials = account_credentials(youtube_account, scopes=settings.GOOGLE_SCOPES)
 
     # Build YouTube service
-    youtube = build('youtube', 'v3', credentials=credentials)
+    youtube = build_youtube(credentials)
 
-    # Upload thumbnail
-    thumbnail_path = stream.thumbnail.path
-    media = MediaFileUpload(thumbnail_path, mimetype='image/jpeg', resumable=True)
+    # Upload the 1280x720 rendition (<= 2 MB) rather than the original photo
+    data = read_rendition(stream, 'youtube')
+    media = jpeg_upload(data)
 
     response = youtube.thumbnails().set(
         videoId=video_id,
@@ -345,11 +372,9 @@ def stream_stop(request, stream_id):
     stream = get_object_or_404(Stream, id=stream_id, user=request.user)
 
     try:
-        stream.status = 'stopping'
-        stream.save()
-
-        manager = StreamManager(stream)
-        manager.stop_stream()
+        with state.stream_lock(stream.id):
+            manager = StreamManager(stream)
+            manager.stop_stream()
 
         StreamLog.objects.create(
             stream=stream,
@@ -358,6 +383,8 @@ def stream_stop(request, stream_id):
         )
         messages.success(request, 'Stream stopped successfully!')
 
+    except state.StreamBusy as e:
+        messages.warning(request, str(e))
     except Exception as e:
         messages.error(request, f'Failed to stop stream: {str(e)}')
 
@@ -372,10 +399,15 @@ def stream_delete(request, stream_id):
         messages.error(request, 'Cannot delete a running stream. Please stop it first.')
         return redirect('stream_detail', stream_id=stream.id)
 
-    manager = StreamManager(stream)
-    manager.stop_stream()
+    try:
+        with state.stream_lock(stream.id):
+            manager = StreamManager(stream)
+            manager.stop_stream()
+            stream.delete()
+    except state.StreamBusy as e:
+        messages.warning(request, str(e))
+        return redirect('stream_detail', stream_id=stream.id)
 
-    stream.delete()
     messages.success(request, 'Stream deleted successfully!')
     return redirect('stream_list')
 
@@ -383,11 +415,7 @@ def stream_delete(request, stream_id):
 def media_upload_view(request):
     """Upload media files with storage limit check"""
     # Get subscription
-    subscription = Subscription.objects.filter(
-        user=request.user,
-        is_active=True,
-        status='active'
-    ).first()
+    subscription = get_entitlement(request.user)
 
     if not subscription:
         messages.error(request, 'You need an active subscription to upload media')
@@ -424,7 +452,7 @@ def media_upload_view(request):
             )
 
             # Get updated storage info
-            new_usage = get_user_storage_usage(request.user)
+            new_usage = current_usage + media_file.file_size
             new_available = subscription.storage_limit - new_usage
 
             messages.success(
@@ -439,14 +467,11 @@ def media_upload_view(request):
             messages.error(request, f'Failed to upload media: {str(e)}')
 
     # NEW: Get storage info for context
-    current_usage = get_user_storage_usage(request.user)
-    available_storage = subscription.storage_limit - current_usage
-
     context = {
-        'storage_usage': format_bytes(current_usage),
+        'storage_usage': format_bytes(subscription.storage_used),
         'storage_limit': format_bytes(subscription.storage_limit),
-        'storage_available': format_bytes(available_storage),
-        'storage_percentage': (current_usage / subscription.storage_limit) * 100,
+        'storage_available': format_bytes(subscription.storage_limit - subscription.storage_used),
+        'storage_percentage': subscription.storage_percentage,
     }
 
     return render(request, 'streaming/media_upload.html', context)
@@ -457,20 +482,17 @@ def media_list_view(request):
     media_files = MediaFile.objects.filter(user=request.user)
 
     # Get subscription
-    subscription = Subscription.objects.filter(
-        user=request.user,
-        is_active=True,
-        status='active'
-    ).first()
+    subscription = get_entitlement(request.user)
 
     # Get storage info
-    current_usage = get_user_storage_usage(request.user)
+    current_usage = subscription.storage_used if subscription else get_user_storage_usage(request.user)
     available_storage = 0
     if subscription:
         available_storage = subscription.storage_limit - current_usage
 
     context = {
         'media_files': media_files,
+        'fragment_version': fragments.get_version(request.user),
         'storage_usage': format_bytes(current_usage),
         'storage_limit': format_bytes(subscription.storage_limit) if subscription else 'N/A',
         'storage_available': format_bytes(available_storage),
@@ -478,13 +500,20 @@ def media_list_view(request):
 
     return render(request, 'streaming/media_list.html', context)
 
+@login_required
+def media_file_view(request, media_id):
+    """Preview or, with ?download, download one of the user's media files"""
+    media = get_object_or_404(MediaFile, id=media_id, user=request.user)
+    return media_delivery.serve(media, download='download' in request.GET)
+
 @login_required
 def media_delete_view(request, media_id):
     """Delete media file and free up storage"""
     media = get_object_or_404(MediaFile, id=media_id, user=request.user)
 
     if request.method == "POST":
-        freed_size = media.file.size if media.file else 0
+        # Recorded at upload; asking storage would be an S3 HEAD request
+        freed_size = media.file_size
 
         media.file.delete(save=False)
         if media.thumbnail:
@@ -492,14 +521,10 @@ def media_delete_view(request, media_id):
         media.delete()
 
         # Get updated storage info
-        subscription = Subscription.objects.filter(
-            user=request.user,
-            is_active=True,
-            status='active'
-        ).first()
+        subscription = get_entitlement(request.user)
 
         if subscription:
-            current_usage = get_user_storage_usage(request.user)
+            current_usage = subscription.storage_used
             messages.success(
                 request, 
                 f'Media file deleted successfully. '
@@ -523,3 +548,12 @@ def stream_status_api(request, stream_id):
         'error_message': stream.error_message,
     }
     return JsonResponse(data)
+
+
+def metrics_view(request):
+    """Prometheus scrape target; needs the METRICS_TOKEN bearer token, and nginx keeps it off the public site"""
+    if not metrics.scrape_allowed(request):
+        response = HttpResponse('Unauthorized', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,100 @@
+"""
+YouTube Data API clients.
+
+Every client talks to YouTube, token refreshes included, over a connection
+that gives up after EXTERNAL_API_TIMEOUT seconds, so a slow or unresponsive
+API fails the call instead of holding a web thread or Celery process.
+
+The Google client libraries are imported on first use, not with this module:
+they add tens of MB and a few hundred ms to every gunicorn and Celery process,
+most of which never call YouTube (see the bench_startup command).
+"""
+import io
+from functools import cache
+
+from django.conf import settings
+
+from . import metrics
+
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+# Quota units each call costs, from the YouTube Data API quota table; reads
+# (list) cost 1
+QUOTA_UNITS = {
+    'youtube.liveBroadcasts.insert': 50,
+    'youtube.liveBroadcasts.update': 50,
+    'youtube.liveBroadcasts.bind': 50,
+    'youtube.liveBroadcasts.transition': 50,
+    'youtube.liveBroadcasts.delete': 50,
+    'youtube.liveStreams.insert': 50,
+    'youtube.liveStreams.update': 50,
+    'youtube.liveStreams.delete': 50,
+    'youtube.thumbnails.set': 50,
+}
+
+
+def oauth_flow(state=None):
+    """The OAuth flow that connects a YouTube channel."""
+    from google_auth_oauthlib.flow import Flow
+
+    return Flow.from_client_config(
+        {
+            'web': {
+                'client_id': settings.GOOGLE_CLIENT_ID,
+                'client_secret': settings.GOOGLE_CLIENT_SECRET,
+                'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+                'token_uri': TOKEN_URI,
+                'redirect_uris': [settings.GOOGLE_REDIRECT_URI],
+            }
+        },
+        scopes=settings.GOOGLE_SCOPES,
+        state=state,
+        redirect_uri=settings.GOOGLE_REDIRECT_URI,
+    )
+
+
+def account_credentials(youtube_account, scopes=None):
+    """Credentials for a connected YouTubeAccount."""
+    from google.oauth2.credentials import Credentials
+
+    return Credentials(
+        token=youtube_account.access_token,
+        refresh_token=youtube_account.refresh_token,
+        token_uri=TOKEN_URI,
+        client_id=settings.GOOGLE_CLIENT_ID,
+        client_secret=settings.GOOGLE_CLIENT_SECRET,
+        scopes=scopes,
+    )
+
+
+def jpeg_upload(data):
+    """Media body for uploading JPEG bytes, e.g. to thumbnails.set."""
+    from googleapiclient.http import MediaIoBaseUpload
+
+    return MediaIoBaseUpload(io.BytesIO(data), mimetype='image/jpeg')
+
+
+@cache
+def _counted_request():
+    from googleapiclient.http import HttpRequest
+
+    class CountedRequest(HttpRequest):
+        """An API request that counts itself and its quota cost when executed."""
+
+        def execute(self, http=None, num_retries=0):
+            method = self.methodId.removeprefix('youtube.')
+            metrics.inc('stream24_youtube_api_calls_total', method=method)
+            metrics.inc('stream24_youtube_api_quota_units_total', QUOTA_UNITS.get(self.methodId, 1), method=method)
+            return super().execute(http=http, num_retries=num_retries)
+
+    return CountedRequest
+
+
+def build_youtube(credentials):
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=settings.EXTERNAL_API_TIMEOUT))
+    client_options = {'api_endpoint': settings.YOUTUBE_API_URL} if settings.YOUTUBE_API_URL else None
+    return build('youtube', 'v3', http=http, client_options=client_options, requestBuilder=_counted_request())
@@ -1,6 +1,10 @@
 import os
 import logging
+import time
 from celery import Celery
+from celery.signals import (
+    before_task_publish, task_postrun, task_prerun, worker_process_shutdown, worker_ready,
+)
 from celery.schedules import crontab
 
 logger = logging.getLogger(__name__)
@@ -18,41 +22,72 @@ app.autodiscover_tasks()
 
 # Celery Beat Schedule for periodic tasks
 app.conf.beat_schedule = {
-    # Check stream health every 5 minutes
+    # Sweep stream heartbeats every few seconds
     'check-stream-health': {
         'task': 'apps.streaming.tasks.check_stream_health',
-        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+        'schedule': 10.0,  # Every 10 seconds (HEALTH_CHECK_INTERVAL)
+        'options': {'expires': 10},  # Skip sweeps that queued up behind a busy worker
     },
     # Check subscription expiry daily
     'check-subscription-expiry': {
         'task': 'apps.payments.tasks.check_subscription_expiry',
         'schedule': crontab(hour=0, minute=0),  # Daily at midnight
     },
-    # Clean up old logs weekly
+    # Clean up old logs and create upcoming log partitions daily
     'cleanup-old-logs': {
         'task': 'apps.streaming.tasks.cleanup_old_logs',
-        'schedule': crontab(hour=2, minute=0, day_of_week=0),  # Sunday at 2 AM
+        'schedule': crontab(hour=2, minute=0),  # Daily at 2 AM
     },
 }
 
-def cleanup_stale_streams():
-    from apps.streaming.models import Stream
-    from apps.streaming.stream_manager import StreamManager
-    stale_streams = Stream.objects.filter(status='running', process_id__isnull=True)
-    for s in stale_streams:
-        manager = StreamManager(s)
-        manager.authenticate_youtube()
-        if s.broadcast_id:
-            try:
-                manager.youtube.liveBroadcasts().transition(
-                    broadcastStatus='complete',
-                    id=s.broadcast_id,
-                    part='status'
-                ).execute()
-                s.status = 'stopped'
-                s.save()
-            except Exception as e:
-                logger.error(f"Failed to cleanup stale broadcast {s.id}: {e}")
+@worker_ready.connect
+def cleanup_stale_streams(**kwargs):
+    """
+    Reconcile this node's encoder processes when a worker starts: adopt the
+    live ones, kill orphans and end the YouTube broadcasts of lost streams
+    """
+    from apps.streaming.process_registry import reconcile
+    from apps.streaming.tasks import end_lost_broadcasts
+
+    try:
+        _, _, lost_ids = reconcile()
+    except Exception as e:
+        logger.error(f"Encoder reconciliation failed: {e}")
+        return
+    if lost_ids:
+        end_lost_broadcasts.delay([str(stream_id) for stream_id in lost_ids])
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    """Record when each task was queued, so workers can report how long it waited"""
+    headers['published_at'] = time.time()
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    from apps.streaming import metrics
+
+    task.request.metrics_started = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        # Clocks on different nodes may disagree slightly
+        metrics.observe('stream24_celery_task_wait_seconds', max(time.time() - published_at, 0), task=task.name)
+
+@task_postrun.connect
+def record_task_end(task_id=None, task=None, state=None, **kwargs):
+    from apps.streaming import metrics
+
+    started = getattr(task.request, 'metrics_started', None)
+    if started is not None:
+        metrics.observe(
+            'stream24_celery_task_duration_seconds', time.perf_counter() - started, task=task.name, state=state,
+        )
+
+@worker_process_shutdown.connect
+def flush_metrics(**kwargs):
+    # Pool processes can exit without running atexit handlers
+    from apps.streaming import metrics
+
+    metrics.flush()
 
 @app.task(bind=True)
 def debug_task(self):
@@ -1,4 +1,5 @@
 import os
+import socket
 from pathlib import Path
 from decouple import config
 import os
@@ -24,6 +25,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so request latency covers every other middleware
+    'apps.streaming.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,6 +67,14 @@ if ENVIRONMENT == 'production' or not DEBUG:
             'PASSWORD': config('DB_PASSWORD', default='postgres'),
             'HOST': config('DB_HOST', default='db'),
             'PORT': config('DB_PORT', default='5432'),
+            # Each gunicorn worker thread and Celery pool process keeps one
+            # connection open across requests and tasks, checked before reuse.
+            # That is 4x8 web threads + 8 worker processes + beat in
+            # docker-compose.prod.yml, plus up to STREAM_BULK_CONCURRENCY
+            # short-lived ones during bulk operations: under PostgreSQL's
+            # default max_connections of 100
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=300, cast=int),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 else:
@@ -92,14 +103,46 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Seconds a YouTube, Google OAuth, Razorpay or S3 request may take before it
+# fails; web threads and Celery processes are never held longer than this
+EXTERNAL_API_TIMEOUT = config('EXTERNAL_API_TIMEOUT', default=10, cast=float)
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Thumbnail renditions (see apps/streaming/thumbnails.py)
+    'renditions': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # Hashed, gzipped copies that nginx serves itself (see config/storage.py)
+    'staticfiles': {'BACKEND': 'config.storage.CompressedManifestStaticFilesStorage'},
+}
+
 
 # Media files with S3 on production
 if config('ENVIRONMENT', default='development') == 'production':
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    STORAGES['default'] = {'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage'}
     AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
     AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME')
-    AWS_QUERYSTRING_AUTH = False
+    # Media uploads, downloads and exists()/url() checks from web threads
+    # give up like any other upstream call; one retry covers a dropped connection
+    from botocore.config import Config as BotocoreConfig
+    AWS_S3_CLIENT_CONFIG = BotocoreConfig(
+        connect_timeout=EXTERNAL_API_TIMEOUT,
+        read_timeout=EXTERNAL_API_TIMEOUT,
+        retries={'max_attempts': 1, 'mode': 'standard'},
+    )
+    # The bucket is private; every media URL is signed
+    AWS_QUERYSTRING_AUTH = True
+    AWS_QUERYSTRING_EXPIRE = 3600
+    # Except renditions: a signed URL changes on every render, so browsers
+    # could never reuse a cached copy. Their content-hash names can't be
+    # guessed, and the bucket policy lets anyone read uploads/renditions/
+    STORAGES['renditions'] = {
+        'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+        'OPTIONS': {
+            'querystring_auth': False,
+            'object_parameters': {'CacheControl': 'public, max-age=31536000, immutable'},
+        },
+    }
     MEDIA_URL = f"https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/"
 
     SECURE_SSL_REDIRECT = True
@@ -110,6 +153,14 @@ if config('ENVIRONMENT', default='development') == 'production':
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploaded media is only delivered through the media_file view (see
+# apps/streaming/media_delivery.py). Behind nginx the view hands the transfer
+# over with X-Accel-Redirect to this internal location
+MEDIA_ACCEL_REDIRECT = config('MEDIA_ACCEL_REDIRECT', default=not DEBUG, cast=bool)
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Seconds a presigned S3 URL for a preview or download stays valid
+MEDIA_SIGNED_URL_TTL = config('MEDIA_SIGNED_URL_TTL', default=300, cast=int)
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Google OAuth Settings
@@ -121,6 +172,10 @@ GOOGLE_SCOPES = [
     'https://www.googleapis.com/auth/youtube.force-ssl',
 ]
 
+# Root of the YouTube Data API; only set to point at a stand-in, as
+# bench_streaming does
+YOUTUBE_API_URL = config('YOUTUBE_API_URL', default='')
+
 # Razorpay Settings
 RAZORPAY_KEY_ID = config('RAZORPAY_KEY_ID')
 RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET')
@@ -158,8 +213,73 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Stream starts and stops get their own queue and workers, so they never wait
+# behind a transcode, the nightly jobs or a batch of emails
+CELERY_TASK_DEFAULT_QUEUE = 'housekeeping'
+CELERY_TASK_ROUTES = {
+    'apps.streaming.tasks.start_stream_async': {'queue': 'stream-control'},
+    'apps.streaming.tasks.stop_stream_async': {'queue': 'stream-control'},
+    'apps.streaming.tasks.restart_stream_async': {'queue': 'stream-control'},
+    'apps.streaming.tasks.bulk_start_streams': {'queue': 'stream-control'},
+    'apps.streaming.tasks.stop_user_streams': {'queue': 'stream-control'},
+    'apps.streaming.tasks.end_lost_broadcasts': {'queue': 'stream-control'},
+    # Marks dead streams and frees their slots, so it can't wait behind log archiving
+    'apps.streaming.tasks.check_stream_health': {'queue': 'stream-control'},
+    'apps.streaming.tasks.generate_thumbnail_renditions': {'queue': 'media-processing'},
+    'apps.payments.tasks.notify_expiring_subscriptions': {'queue': 'notifications'},
+    'apps.payments.tasks.send_payment_receipt': {'queue': 'notifications'},
+}
+# Workers reserve one task per process at a time; a long task holds no queued
+# tasks hostage that an idle process could have run
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Nothing reads most task results, so tasks are fire-and-forget unless they
+# declare ignore_result=False; the results that are kept expire after an hour
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_RESULT_EXPIRES = 3600
+
+# Redis for stream heartbeats; defaults to the Celery broker
+REDIS_URL = config('REDIS_URL', default=CELERY_BROKER_URL)
+
+# Shared by every web and worker process, so invalidating an entry works everywhere
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'stream24',
+    }
+}
+# Sessions are read from the cache and written through to the database, so
+# a request doesn't query the session table and a cache flush logs nobody out
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# Upper bound on how long a cached entitlement lives (see apps/payments/entitlements.py)
+ENTITLEMENT_CACHE_TTL = config('ENTITLEMENT_CACHE_TTL', default=300, cast=int)
+
+# Bearer token Prometheus sends to /metrics; without one, only DEBUG serves it
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Identifies this host in the encoder process registry; must differ per
+# machine/container that runs encoders and stay the same across restarts
+NODE_ID = config('NODE_ID', default=socket.gethostname())
+
 # FFmpeg Settings
 FFMPEG_PATH = config('FFMPEG_PATH', default='ffmpeg')
+# x264 preset and bitrate streams are encoded with, from
+# apps.streaming.stream_manager.ENCODER_PROFILES
+ENCODER_PROFILE = config('ENCODER_PROFILE', default='standard')
+# Seconds a stopping encoder gets to flush its output before it is killed
+ENCODER_STOP_TIMEOUT = config('ENCODER_STOP_TIMEOUT', default=10, cast=float)
+# Parallel YouTube calls / stream starts in bulk stream operations
+STREAM_BULK_CONCURRENCY = config('STREAM_BULK_CONCURRENCY', default=8, cast=int)
+
+# Email; the console backend just prints messages in development
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@localhost')
 
 LOGIN_URL = '/accounts/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
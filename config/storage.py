@@ -0,0 +1,42 @@
+"""
+Static file storage.
+
+collectstatic writes every file under a content-hashed name (style.css ->
+style.1a2b3c4d5e6f.css) and rewrites references to them, so a changed file
+gets a new URL and nginx can let browsers cache the old one forever. Each
+compressible file is also written gzipped next to itself (name.gz), which
+nginx's gzip_static sends instead of compressing on every request.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf', '.eot'}
+
+# Files this small gain nothing worth a second file
+MIN_COMPRESS_SIZE = 512
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Originals as well as hashed names, for anything that links to a
+        # static file without {% static %}
+        for name in set(paths) | set(self.hashed_files.values()):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        # mtime=0 keeps the output identical across builds
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data) * 0.95:
+            with open(f"{path}.gz", 'wb') as f:
+                f.write(compressed)
@@ -4,12 +4,16 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic import TemplateView
 
+from apps.streaming.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', TemplateView.as_view(template_name='home.html'), name='home'),
     path('accounts/', include('apps.accounts.urls')),
     path('streaming/', include('apps.streaming.urls')),
     path('payments/', include('apps.payments.urls')),
+    # Scraped by Prometheus on the internal network with METRICS_TOKEN (see nginx.conf)
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
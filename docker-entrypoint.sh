@@ -26,5 +26,8 @@ END
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+echo "Reconciling encoder processes..."
+python manage.py reconcile_encoders || echo "Encoder reconciliation failed"
+
 echo "Starting server..."
 exec "$@"